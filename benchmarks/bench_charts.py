@@ -0,0 +1,68 @@
+# benchmarks/bench_charts.py
+# Compara el render de pastel anterior (plt.subplots + tight_layout + savefig bbox 'tight' en cada
+# llamada) con las plantillas reutilizables de utils/chart_templates.py. Ambos lados producen el mismo
+# formato (PNG sin pérdida, BENCH_DPI, sin presupuesto de bytes), así que solo se mide la reutilización de
+# la plantilla y no la codificación png8/jpeg. Se ejecuta desde la raíz del repo:
+#   python benchmarks/bench_charts.py [renders]
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import config
+from utils import chart_templates, graphics
+
+BENCH_DPI = 100
+# Salida fijada igual en los dos lados, sea cual sea el CHART_FORMAT/CHART_MAX_BYTES del entorno
+config.CHART_FORMAT = "png"; config.CHART_MAX_BYTES = 0; config.CHART_DPI = BENCH_DPI
+
+LABELS = ['Gastos Fijos', 'Gastos Variables', 'Ahorros', 'Disponible/Sobrante']
+TITLE = "Distribución Financiera Mensual"
+
+
+def legacy_render_pie_png(valid_labels, valid_sizes, title, effective_colors=None) -> bytes:
+    fig, ax = plt.subplots(figsize=(7, 5))
+    try:
+        wedges, texts, autotexts = ax.pie(valid_sizes, labels=None, autopct='%1.1f%%', startangle=90,
+                                          colors=effective_colors, pctdistance=0.80)
+        for autotext in autotexts:
+            autotext.set_color('white'); autotext.set_fontsize(10); autotext.set_fontweight('bold')
+        ax.axis('equal')
+        plt.title(title, fontsize=14, fontweight='bold', pad=20)
+        total = sum(valid_sizes)
+        ax.legend(wedges, [f'{l} ({s/total*100:.1f}%)' for l, s in zip(valid_labels, valid_sizes)],
+                  title="Categorías", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1), fontsize=9)
+        plt.tight_layout(rect=[0, 0, 0.8, 1])
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=BENCH_DPI, bbox_inches='tight')
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def _bench(name, func, renders):
+    func(LABELS, [30.0, 20.0, 10.0, 40.0]) # Primer render fuera de la medición (imports, fuentes)
+    started = time.perf_counter()
+    for i in range(renders):
+        func(LABELS, [30.0 + i % 7, 20.0, 10.0 + i % 3, 40.0]) # Datos distintos: sin caché de por medio
+    per_render = (time.perf_counter() - started) / renders
+    print(f"{name:<12} {per_render * 1000:8.1f} ms/render")
+    return per_render
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    print(f"{renders} renders por lado, png sin pérdida a {BENCH_DPI} DPI, sin presupuesto de bytes")
+    legacy = _bench("pyplot", lambda l, s: legacy_render_pie_png(l, s, TITLE, graphics.COLORS_FINANCE), renders)
+    template = _bench("plantilla", lambda l, s: chart_templates.render_pie_png("finance", l, s, TITLE, graphics.COLORS_FINANCE), renders)
+    print(f"Aceleración: x{legacy / template:.1f}")
+
+
+if __name__ == '__main__':
+    main()
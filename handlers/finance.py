@@ -5,7 +5,6 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CallbackContext,
     ConversationHandler,
-    CallbackQueryHandler,
     MessageHandler,
     Filters,
     CommandHandler
@@ -14,6 +13,8 @@ from datetime import datetime, date
 
 import config
 from utils import database as db_utils
+from utils import message_render
+from utils.callback_router import CallbackRouter
 from . import common_handlers
 
 logger = logging.getLogger(__name__)
@@ -37,7 +38,7 @@ def finance_menu(update: Update, context: CallbackContext) -> int:
 
     has_access, access_message = db_utils.check_user_access(user_id)
     if not has_access:
-        if query: query.answer(); query.edit_message_text(text=access_message)
+        if query: query.answer(); message_render.edit_message_text(query, text=access_message)
         else: context.bot.send_message(chat_id=user_id, text=access_message)
         return ConversationHandler.END
 
@@ -57,7 +58,7 @@ def finance_menu(update: Update, context: CallbackContext) -> int:
     
     if query:
         query.answer()
-        query.edit_message_text(text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
+        message_render.edit_message_text(query, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     else: 
         context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     return STATE_FIN_MENU_ACTION
@@ -71,7 +72,7 @@ def cb_fin_show_income_submenu(update: Update, context: CallbackContext) -> int:
         [InlineKeyboardButton("📈 Ingreso Extra/Variable Mensual", callback_data=config.CB_FIN_REG_VAR_INCOME_START)],
         [common_handlers.get_back_button(config.CB_FIN_MAIN_MENU, "⬅️ A Finanzas")]
     ]
-    query.edit_message_text(text="➕ *Registrar Ingresos Mensuales:*\nSelecciona el tipo de ingreso:", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    message_render.edit_message_text(query, text="➕ *Registrar Ingresos Mensuales:*\nSelecciona el tipo de ingreso:", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     return STATE_FIN_SUBMENU_TYPE_SELECT
 
 def cb_fin_show_expense_submenu(update: Update, context: CallbackContext) -> int:
@@ -81,7 +82,7 @@ def cb_fin_show_expense_submenu(update: Update, context: CallbackContext) -> int
         [InlineKeyboardButton("🛍️ Gasto Variable Diario", callback_data=config.CB_FIN_REG_VAR_EXPENSE_START)],
         [common_handlers.get_back_button(config.CB_FIN_MAIN_MENU, "⬅️ A Finanzas")]
     ]
-    query.edit_message_text(text="➖ *Registrar Gastos Diarios:*\nSelecciona el tipo de gasto:", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    message_render.edit_message_text(query, text="➖ *Registrar Gastos Diarios:*\nSelecciona el tipo de gasto:", reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     return STATE_FIN_SUBMENU_TYPE_SELECT
 
 
@@ -101,7 +102,7 @@ def start_amount_input_flow(update: Update, context: CallbackContext, transactio
     prompt = prompt_map.get(transaction_type, "Envía el monto:") + "\n\nO /cancelfinance para volver al menú de finanzas."
     
     target_chat_id = query.message.chat_id if query and query.message else update.effective_chat.id
-    if query and query.message: query.edit_message_text(text=prompt)
+    if query and query.message: message_render.edit_message_text(query, text=prompt)
     else: context.bot.send_message(chat_id=target_chat_id, text=prompt)
     return STATE_FIN_GET_AMOUNT_INPUT
 
@@ -144,18 +145,14 @@ def cb_fin_view_summary_action(update: Update, context: CallbackContext) -> int:
     query = update.callback_query; user_id = query.from_user.id; query.answer()
     now = datetime.now(db_utils.LIMA_TZ); month_s = now.strftime("%Y-%m"); day_o = now.date()
 
-    inc_f = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='income_fixed'))
-    inc_v = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='income_variable'))
+    fin = db_utils.get_finance_summary(user_id, month_s, day_o)
+    month_totals = fin["month_totals"]
+    inc_f = month_totals.get('income_fixed', 0.0)
+    inc_v = month_totals.get('income_variable', 0.0)
     total_inc = inc_f + inc_v
-    total_sav = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='savings'))
-    
-    all_exp_dr = db_utils.get_finance_transactions(user_id, month_s, trans_type='expense_fixed') + \
-                 db_utils.get_finance_transactions(user_id, month_s, trans_type='expense_variable')
-    total_exp_month = sum(float(dict(t)['amount']) for t in all_exp_dr if dict(t)['transaction_date'] <= day_o)
-            
-    exp_today_f = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, day_obj=day_o, trans_type='expense_fixed'))
-    exp_today_v = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, day_obj=day_o, trans_type='expense_variable'))
-    total_exp_today = exp_today_f + exp_today_v
+    total_sav = month_totals.get('savings', 0.0)
+    total_exp_month = fin["expenses_month_to_date"]
+    total_exp_today = fin["expenses_today"]
     balance = (total_inc - total_sav) - total_exp_month
 
     summary = f"📊 *Resumen Financiero ({now.strftime('%B %Y')})*\n\n"
@@ -165,7 +162,7 @@ def cb_fin_view_summary_action(update: Update, context: CallbackContext) -> int:
     summary += f"💰 Saldo Estimado Mes: S/. {balance:.2f}\n\n_Registra gastos diarios._"
 
     kbd = [[common_handlers.get_back_button(config.CB_FIN_MAIN_MENU, "⬅️ A Finanzas")]]
-    query.edit_message_text(text=summary, reply_markup=InlineKeyboardMarkup(kbd), parse_mode='Markdown')
+    message_render.edit_message_text(query, text=summary, reply_markup=InlineKeyboardMarkup(kbd), parse_mode='Markdown')
     return STATE_FIN_MENU_ACTION
 
 
@@ -181,20 +178,24 @@ def cancel_finance_subflow(update: Update, context: CallbackContext) -> int: # /
 # --- REGISTRO DE HANDLERS ---
 def register_handlers(dp) -> None:
     finance_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(finance_menu, pattern=f"^{config.CB_FIN_MAIN_MENU}$")],
+        entry_points=[CallbackRouter("finance.entry", {config.CB_FIN_MAIN_MENU: finance_menu})],
         states={
             STATE_FIN_MENU_ACTION: [ 
-                CallbackQueryHandler(cb_fin_show_income_submenu, pattern=f"^{config.CB_FIN_REG_INCOME_MENU}$"),
-                CallbackQueryHandler(cb_fin_show_expense_submenu, pattern=f"^{config.CB_FIN_REG_EXPENSE_MENU}$"),
-                CallbackQueryHandler(cb_fin_reg_savings_direct_action, pattern=f"^{config.CB_FIN_REG_SAVINGS_ACTION}$"),
-                CallbackQueryHandler(cb_fin_view_summary_action, pattern=f"^{config.CB_FIN_VIEW_SUMMARY}$"),
+                CallbackRouter("finance.menu", {
+                    config.CB_FIN_REG_INCOME_MENU: cb_fin_show_income_submenu,
+                    config.CB_FIN_REG_EXPENSE_MENU: cb_fin_show_expense_submenu,
+                    config.CB_FIN_REG_SAVINGS_ACTION: cb_fin_reg_savings_direct_action,
+                    config.CB_FIN_VIEW_SUMMARY: cb_fin_view_summary_action,
+                }),
             ],
             STATE_FIN_SUBMENU_TYPE_SELECT: [ 
-                CallbackQueryHandler(cb_fin_reg_fixed_income_start_action, pattern=f"^{config.CB_FIN_REG_FIXED_INCOME_START}$"),
-                CallbackQueryHandler(cb_fin_reg_var_income_start_action, pattern=f"^{config.CB_FIN_REG_VAR_INCOME_START}$"),
-                CallbackQueryHandler(cb_fin_reg_fixed_expense_start_action, pattern=f"^{config.CB_FIN_REG_FIXED_EXPENSE_START}$"),
-                CallbackQueryHandler(cb_fin_reg_var_expense_start_action, pattern=f"^{config.CB_FIN_REG_VAR_EXPENSE_START}$"),
-                CallbackQueryHandler(finance_menu, pattern=f"^{config.CB_FIN_MAIN_MENU}$"), # "Volver a Finanzas" desde submenú
+                CallbackRouter("finance.submenu", {
+                    config.CB_FIN_REG_FIXED_INCOME_START: cb_fin_reg_fixed_income_start_action,
+                    config.CB_FIN_REG_VAR_INCOME_START: cb_fin_reg_var_income_start_action,
+                    config.CB_FIN_REG_FIXED_EXPENSE_START: cb_fin_reg_fixed_expense_start_action,
+                    config.CB_FIN_REG_VAR_EXPENSE_START: cb_fin_reg_var_expense_start_action,
+                    config.CB_FIN_MAIN_MENU: finance_menu, # "Volver a Finanzas" desde submenú
+                }),
             ],
             STATE_FIN_GET_AMOUNT_INPUT: [ 
                 MessageHandler(Filters.text & ~Filters.command, get_transaction_amount_input),
@@ -203,7 +204,7 @@ def register_handlers(dp) -> None:
         fallbacks=[
             CommandHandler("cancelfinance", cancel_finance_subflow),
             CommandHandler("cancel", lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_FIN_CLEANUP_KEYS)),
-            CallbackQueryHandler(lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_FIN_CLEANUP_KEYS), pattern=f"^{config.CB_MAIN_MENU}$")
+            CallbackRouter("finance.fallback", {config.CB_MAIN_MENU: lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_FIN_CLEANUP_KEYS)})
             ],
         allow_reentry=True
     )
@@ -5,7 +5,6 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CallbackContext,
     ConversationHandler,
-    CallbackQueryHandler,
     MessageHandler,
     Filters,
     CommandHandler
@@ -14,6 +13,10 @@ from datetime import datetime, date
 
 import config
 from utils import database as db_utils
+from utils import message_render
+from utils.callback_router import CallbackRouter
+from utils import callback_codec
+from utils import day_views
 from . import common_handlers
 
 logger = logging.getLogger(__name__)
@@ -39,7 +42,7 @@ def planning_menu(update: Update, context: CallbackContext) -> int:
 
     has_access, access_message = db_utils.check_user_access(user_id)
     if not has_access:
-        if query: query.answer(); query.edit_message_text(text=access_message)
+        if query: query.answer(); message_render.edit_message_text(query, text=access_message)
         else: context.bot.send_message(chat_id=user_id, text=access_message)
         return ConversationHandler.END
 
@@ -63,7 +66,7 @@ def planning_menu(update: Update, context: CallbackContext) -> int:
     
     if query:
         query.answer()
-        query.edit_message_text(text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
+        message_render.edit_message_text(query, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     else: 
         context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
         
@@ -86,7 +89,7 @@ def start_add_item_flow(update: Update, context: CallbackContext, item_type: str
     prompt_text = prompt_map.get(item_type)
 
     target_chat_id = query.message.chat_id if query and query.message else update.effective_chat.id
-    if query and query.message: query.edit_message_text(text=prompt_text, parse_mode='Markdown')
+    if query and query.message: message_render.edit_message_text(query, text=prompt_text, parse_mode='Markdown')
     else: context.bot.send_message(chat_id=target_chat_id, text=prompt_text, parse_mode='Markdown')
     return STATE_PLAN_ADD_GET_DESCRIPTION
 
@@ -145,6 +148,7 @@ def get_objective_reminder_input(update: Update, context: CallbackContext) -> in
     description_list = context.user_data.get(UD_PLAN_TEMP_DESCRIPTION_LIST)
     if description_list and description_list[0]:
         db_utils.save_planning_item(user_id, 'objective', description_list[0], reminder_time_to_save)
+        day_views.invalidate(user_id)
         update.message.reply_text("🎯 ¡Objetivo principal guardado!")
     else: update.message.reply_text("⚠️ Error guardando objetivo. No se encontró descripción.")
     return cancel_planning_subflow(update, context)
@@ -158,9 +162,10 @@ def done_adding_planning_items_command(update: Update, context: CallbackContext)
         update.message.reply_text("No has añadido ninguna tarea. Envía una tarea o escribe /cancelplanning para volver.")
         return STATE_PLAN_ADD_GET_DESCRIPTION 
     else:
-        for desc_text in descriptions_list:
-            db_utils.save_planning_item(user_id, item_type, desc_text, None) # Reminder None para tareas imp/sec por ahora
-        update.message.reply_text(f"✅ ¡{len(descriptions_list)} tarea(s) '{item_type}' han sido guardadas!")
+        saved_ids = db_utils.save_planning_items(user_id, item_type, descriptions_list, None) # Reminder None para tareas imp/sec por ahora
+        day_views.invalidate(user_id)
+        if saved_ids: update.message.reply_text(f"✅ ¡{len(saved_ids)} tarea(s) '{item_type}' han sido guardadas!")
+        else: update.message.reply_text("⚠️ Error guardando tus tareas. Inténtalo de nuevo más tarde.")
     return cancel_planning_subflow(update, context)
 
 def cancel_planning_subflow(update: Update, context: CallbackContext) -> int: # /cancelplanning
@@ -172,17 +177,17 @@ def cancel_planning_subflow(update: Update, context: CallbackContext) -> int: #
 
 
 # --- FLUJO: VER Y MARCAR TAREAS ---
-def view_daily_plan_action_cb(update: Update, context: CallbackContext) -> int:
+def view_daily_plan_action_cb(update: Update, context: CallbackContext, answered: bool = False) -> int:
     # (La lógica interna de esta función se mantiene igual que la última versión estable para Render)
     # ... (copia el contenido de view_daily_plan_action_cb de la respuesta anterior) ...
-    # Solo asegúrate de que los callback_data para los botones usen config.CB_TASK_DONE_PREFIX, etc.
+    # Los callback_data de los botones de marcar se generan con utils/callback_codec (acción plan_mark)
     # y que el botón de volver use config.CB_PLAN_MAIN_MENU
     query = update.callback_query
     user_id = query.from_user.id
-    if query: query.answer()
+    if query and not answered: query.answer() # Al marcar, el callback ya se respondió
 
     today_lima_date_obj = datetime.now(db_utils.LIMA_TZ).date()
-    items_dictrows = db_utils.get_daily_planning_items(user_id, today_lima_date_obj)
+    items_dictrows = day_views.get_planning_items(user_id, today_lima_date_obj) # Desde caché tras la primera vista
     message_text = "📋 *Tu Plan para Hoy:* \n\n"
     keyboard_markup_rows = []
 
@@ -216,8 +221,8 @@ def view_daily_plan_action_cb(update: Update, context: CallbackContext) -> int:
                     
                     if item.get("completed") is None: 
                         item_id = item['key'] 
-                        cb_done = f"{config.CB_TASK_DONE_PREFIX}planning_{item_id}"
-                        cb_not_done = f"{config.CB_TASK_NOT_DONE_PREFIX}planning_{item_id}"
+                        cb_done = callback_codec.encode("plan_mark", item_id, True)
+                        cb_not_done = callback_codec.encode("plan_mark", item_id, False)
                         task_short = item['text'][:15] + ('…' if len(item['text']) > 15 else '')
                         buttons_row = [
                             InlineKeyboardButton(f"✅ '{task_short}'", callback_data=cb_done),
@@ -232,7 +237,7 @@ def view_daily_plan_action_cb(update: Update, context: CallbackContext) -> int:
     
     target_chat_id = query.message.chat_id if query and query.message else user_id
     if query and query.message:
-        try: query.edit_message_text(text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
+        try: message_render.edit_message_text(query, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
         except Exception as e: 
             logger.warning(f"Error editando vista plan (planning), enviando nuevo: {e}")
             context.bot.send_message(chat_id=target_chat_id, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
@@ -242,15 +247,18 @@ def view_daily_plan_action_cb(update: Update, context: CallbackContext) -> int:
 def mark_planning_task_cb(update: Update, context: CallbackContext) -> int:
     # (Lógica idéntica a la última versión estable para Render)
     # ... (copia el contenido de mark_planning_task_cb de la respuesta anterior) ...
-    query = update.callback_query; query.answer()
+    query = update.callback_query
+    try:
+        _, mark = callback_codec.decode(query.data) # Acepta también el formato anterior (task_done_planning_<id>)
+    except callback_codec.CallbackDataError as e:
+        logger.warning(f"callback_data no válido para marcar tarea planning: {e}")
+        query.answer("Opción no válida.")
+        return view_daily_plan_action_cb(update, context, answered=True)
+    query.answer()
     try:
-        parts = query.data.split('_'); item_id = int(parts[3])
-        completed_status = (parts[0]+"_"+parts[1] == config.CB_TASK_DONE_PREFIX[:-1]) # Compara con "task_done"
-        db_utils.update_planning_item_status(item_id, completed_status)
-        return view_daily_plan_action_cb(update, context) 
-    except (IndexError, ValueError) as e:
-        logger.error(f"Error parseando callback_data para marcar tarea planning: {e}, data: {query.data}")
-        if query.message: query.message.reply_text("⚠️ Error al procesar.")
+        # Una sola escritura; la vista se redibuja desde la caché ya actualizada
+        day_views.mark_planning_item(query.from_user.id, datetime.now(db_utils.LIMA_TZ).date(), mark.item_id, mark.done)
+        return view_daily_plan_action_cb(update, context, answered=True)
     except Exception as e:
         logger.error(f"Error general marcando tarea planning: {e}, data: {query.data}")
         if query.message: query.message.reply_text("⚠️ Error inesperado.")
@@ -263,14 +271,16 @@ def register_handlers(dp) -> None:
         entry_points=[
             # El CB_PLAN_MAIN_MENU es el entry point desde main.py, que llama a planning_menu
             # y devuelve STATE_PLAN_MENU_ACTION.
-            CallbackQueryHandler(planning_menu, pattern=f"^{config.CB_PLAN_MAIN_MENU}$")
+            CallbackRouter("planning.entry", {config.CB_PLAN_MAIN_MENU: planning_menu})
             ],
         states={
             STATE_PLAN_MENU_ACTION: [ 
-                CallbackQueryHandler(cb_plan_set_objective_action, pattern=f"^{config.CB_PLAN_SET_OBJECTIVE}$"),
-                CallbackQueryHandler(cb_plan_set_important_action, pattern=f"^{config.CB_PLAN_SET_IMPORTANT}$"),
-                CallbackQueryHandler(cb_plan_set_secondary_action, pattern=f"^{config.CB_PLAN_SET_SECONDARY}$"),
-                CallbackQueryHandler(view_daily_plan_action_cb, pattern=f"^{config.CB_PLAN_VIEW_DAY}$"),
+                CallbackRouter("planning.menu", {
+                    config.CB_PLAN_SET_OBJECTIVE: cb_plan_set_objective_action,
+                    config.CB_PLAN_SET_IMPORTANT: cb_plan_set_important_action,
+                    config.CB_PLAN_SET_SECONDARY: cb_plan_set_secondary_action,
+                    config.CB_PLAN_VIEW_DAY: view_daily_plan_action_cb,
+                }),
             ],
             STATE_PLAN_ADD_GET_DESCRIPTION: [
                 MessageHandler(Filters.text & ~Filters.command, get_item_description_input),
@@ -280,11 +290,10 @@ def register_handlers(dp) -> None:
                 MessageHandler(Filters.text & ~Filters.command, get_objective_reminder_input)
             ],
             STATE_PLAN_VIEW_AND_MARK_MODE: [
-                CallbackQueryHandler(mark_planning_task_cb, pattern=f"^{config.CB_TASK_DONE_PREFIX}planning_"),
-                CallbackQueryHandler(mark_planning_task_cb, pattern=f"^{config.CB_TASK_NOT_DONE_PREFIX}planning_"),
-                # El botón "Volver a Planificación" desde la vista de tareas ahora usa CB_PLAN_MAIN_MENU
-                # y es manejado por el entry_point del ConversationHandler.
-                CallbackQueryHandler(planning_menu, pattern=f"^{config.CB_PLAN_MAIN_MENU}$")
+                CallbackRouter("planning.view", {
+                    # El botón "Volver a Planificación" desde la vista de tareas usa CB_PLAN_MAIN_MENU
+                    config.CB_PLAN_MAIN_MENU: planning_menu,
+                }, prefixes=dict.fromkeys(callback_codec.route_prefixes("plan_mark"), mark_planning_task_cb))
             ]
         },
         fallbacks=[
@@ -292,7 +301,7 @@ def register_handlers(dp) -> None:
             # Un /cancel global que te saque de toda la sección de planificación
             CommandHandler("cancel", lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_PLAN_CLEANUP_KEYS)),
             # Botón para volver al menú principal del BOT (CB_MAIN_MENU)
-            CallbackQueryHandler(lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_PLAN_CLEANUP_KEYS), pattern=f"^{config.CB_MAIN_MENU}$")
+            CallbackRouter("planning.fallback", {config.CB_MAIN_MENU: lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_PLAN_CLEANUP_KEYS)})
             ],
         allow_reentry=True 
     )
@@ -2,13 +2,18 @@
 
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import CallbackContext, CallbackQueryHandler
-from datetime import datetime, date
+from telegram.ext import CallbackContext
+from datetime import datetime
 import io 
+import time
 
 import config
 from utils import database as db_utils
+from utils import message_render
+from utils.callback_router import CallbackRouter
+from utils import callback_codec
 from utils import graphics as graphics_utils 
+from utils import chart_renderer
 from . import common_handlers
 
 logger = logging.getLogger(__name__)
@@ -21,7 +26,7 @@ def progress_menu(update: Update, context: CallbackContext) -> None:
 
     has_access, access_message = db_utils.check_user_access(user_id)
     if not has_access:
-        if query: query.answer(); query.edit_message_text(text=access_message)
+        if query: query.answer(); message_render.edit_message_text(query, text=access_message)
         else: context.bot.send_message(chat_id=user_id, text=access_message)
         return
 
@@ -29,6 +34,7 @@ def progress_menu(update: Update, context: CallbackContext) -> None:
         [InlineKeyboardButton("🎯 Gráfica de Disciplina Diaria", callback_data=config.CB_PROG_GRAPH_DISCIPLINE)],
         [InlineKeyboardButton("💹 Gráfica Financiera Mensual", callback_data=config.CB_PROG_GRAPH_FINANCE)],
         [InlineKeyboardButton("💪 Gráfica de Bienestar Físico Diario", callback_data=config.CB_PROG_GRAPH_WELLBEING)],
+        [InlineKeyboardButton("📈 Tendencias (semana / mes / año)", callback_data=config.CB_PROG_TRENDS_MENU)],
         [common_handlers.get_back_to_main_menu_button()] # Botón para volver al menú principal del bot
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -40,7 +46,7 @@ def progress_menu(update: Update, context: CallbackContext) -> None:
     
     if query:
         query.answer()
-        query.edit_message_text(text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
+        message_render.edit_message_text(query, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     else: 
         context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     # No se retorna estado de conversación aquí
@@ -58,19 +64,23 @@ def send_generated_chart(update: Update, context: CallbackContext, chart_image_b
 
     if chart_image_buffer:
         try:
+            upload_bytes = chart_image_buffer.getbuffer().nbytes; upload_started = time.monotonic()
             context.bot.send_photo(
                 chat_id=user_id, photo=chart_image_buffer,
                 caption=caption_title, reply_markup=back_to_progress_menu_keyboard
             )
+            upload_seconds = time.monotonic() - upload_started
+            chart_renderer.record_upload(upload_bytes, upload_seconds)
+            logger.info(f"CHARTS: '{caption_title}' subida a {user_id}: {upload_bytes / 1024:.1f} KB en {upload_seconds * 1000:.0f} ms.")
             if query.message: # Editar mensaje original si es posible
-                 query.edit_message_text(text=f"Aquí tienes tu: {caption_title.split(':')[0]} (ver foto enviada).", reply_markup=back_to_progress_menu_keyboard)
+                 message_render.edit_message_text(query, text=f"Aquí tienes tu: {caption_title.split(':')[0]} (ver foto enviada).", reply_markup=back_to_progress_menu_keyboard)
         except Exception as e:
             logger.error(f"Error enviando foto de gráfica '{caption_title}': {e}")
             context.bot.send_message(chat_id=user_id, text="Hubo un error al generar tu gráfica.", reply_markup=back_to_progress_menu_keyboard)
     else:
         no_data_msg = f"No hay suficientes datos para generar la '{caption_title.split(':')[0]}'. ¡Sigue registrando tu progreso!"
         if query.message:
-            query.edit_message_text(text=no_data_msg, reply_markup=back_to_progress_menu_keyboard)
+            message_render.edit_message_text(query, text=no_data_msg, reply_markup=back_to_progress_menu_keyboard)
         else:
             context.bot.send_message(chat_id=user_id, text=no_data_msg, reply_markup=back_to_progress_menu_keyboard)
 
@@ -89,46 +99,89 @@ def cb_show_finance_chart(update: Update, context: CallbackContext) -> None:
     query = update.callback_query; user_id = query.from_user.id; query.answer("Generando gráfica...")
     now = datetime.now(db_utils.LIMA_TZ); month_s = now.strftime("%Y-%m")
 
-    inc_f = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='income_fixed'))
-    inc_v = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='income_variable'))
+    month_totals = db_utils.get_finance_month_totals(user_id, month_s)
+    inc_f = month_totals.get('income_fixed', 0.0)
+    inc_v = month_totals.get('income_variable', 0.0)
     total_inc = inc_f + inc_v
-    savings = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='savings'))
-    exp_f = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='expense_fixed'))
-    exp_v = sum(float(dict(t)['amount']) for t in db_utils.get_finance_transactions(user_id, month_s, trans_type='expense_variable'))
+    savings = month_totals.get('savings', 0.0)
+    exp_f = month_totals.get('expense_fixed', 0.0)
+    exp_v = month_totals.get('expense_variable', 0.0)
 
     chart_buffer = graphics_utils.get_finance_chart_image(inc_v, exp_v, savings, exp_f, total_inc)
     send_generated_chart(update, context, chart_buffer, "💹 Distribución Financiera Mensual")
 
 def cb_show_wellbeing_chart(update: Update, context: CallbackContext) -> None:
-    query = update.callback_query; user_id = query.from_user.id; query.answer("Generando gráficas...")
+    query = update.callback_query; user_id = query.from_user.id; query.answer("Generando gráfica...")
     today_date_obj = datetime.now(db_utils.LIMA_TZ).date()
+    wb_docs = db_utils.get_daily_wellbeing_docs(user_id, today_date_obj, ['exercise', 'diet_main', 'diet_extra']) # Una sola consulta
 
-    ex_doc = db_utils.get_daily_wellbeing_doc_and_sub_items(user_id, 'exercise', today_date_obj)
+    ex_doc = wb_docs.get('exercise')
     comp_ex = sum(1 for i_dr in ex_doc["items"] if dict(i_dr).get("marked_at") and dict(i_dr).get("completed") is True) if ex_doc and ex_doc.get("items") else 0
     not_comp_ex = sum(1 for i_dr in ex_doc["items"] if dict(i_dr).get("marked_at") and dict(i_dr).get("completed") is False) if ex_doc and ex_doc.get("items") else 0
-    ex_chart_buffer = graphics_utils.get_wellbeing_exercise_chart_image(comp_ex, not_comp_ex)
-    send_generated_chart(update, context, ex_chart_buffer, "💪 Progreso en Ejercicio Diario")
-    # Pequeña pausa para que los mensajes no lleguen demasiado juntos
-    context.job_queue.run_once(lambda ctx: _send_diet_chart(update, ctx, user_id, today_date_obj), 1)
-
 
-def _send_diet_chart(original_update_for_query: Update, context: CallbackContext, user_id: int, date_obj: date):
-    """Función auxiliar para enviar la gráfica de dieta, llamada con retraso."""
-    diet_main_doc = db_utils.get_daily_wellbeing_doc_and_sub_items(user_id, 'diet_main', date_obj)
-    diet_extra_doc = db_utils.get_daily_wellbeing_doc_and_sub_items(user_id, 'diet_extra', date_obj)
-    
+    diet_main_doc = wb_docs.get('diet_main')
+    diet_extra_doc = wb_docs.get('diet_extra')
     fulfilled_diet = sum(1 for i_dr in diet_main_doc["items"] if dict(i_dr).get("marked_at") and dict(i_dr).get("completed") is True) if diet_main_doc and diet_main_doc.get("items") else 0
     not_fulfilled_diet = sum(1 for i_dr in diet_main_doc["items"] if dict(i_dr).get("marked_at") and dict(i_dr).get("completed") is False) if diet_main_doc and diet_main_doc.get("items") else 0
     extras_count = len(diet_extra_doc["items"]) if diet_extra_doc and diet_extra_doc.get("items") else 0
-    
-    diet_chart_buffer = graphics_utils.get_wellbeing_diet_chart_image(fulfilled_diet, not_fulfilled_diet, extras_count)
-    # Necesitamos el 'update' original para el 'query' en send_generated_chart
-    send_generated_chart(original_update_for_query, context, diet_chart_buffer, "🍎 Progreso en Alimentación Diaria")
+
+    # Ejercicio y alimentación en una sola imagen: un render, una subida y sin esperas artificiales
+    chart_buffer = graphics_utils.get_wellbeing_chart_image(comp_ex, not_comp_ex, fulfilled_diet, not_fulfilled_diet, extras_count)
+    send_generated_chart(update, context, chart_buffer, "💪 Bienestar Físico Diario: Ejercicio y Alimentación")
+
+
+# --- TENDENCIAS HISTÓRICAS ---
+# métrica -> (emoji, nombre, función de utils/trends, etiqueta del eje Y, máximo del eje Y, color)
+TREND_METRICS = {
+    "discipline": ("🎯", "Disciplina", "discipline_trend", "% de tareas completadas", 100, graphics_utils.COLORS_DISCIPLINE[0]),
+    "spending": ("💸", "Gastos", "spending_trend", "Gasto total", None, graphics_utils.COLORS_FINANCE[3]),
+    "exercise": ("💪", "Ejercicio", "exercise_trend", "% de ejercicios completados", 100, graphics_utils.COLORS_WELLBEING[0]),
+}
+TREND_PERIOD_BUTTONS = [("week", "Semana"), ("month", "Mes"), ("year", "Año")]
+
+def cb_show_trends_menu(update: Update, context: CallbackContext) -> None:
+    """Submenú de tendencias: una fila por métrica con un botón por periodo."""
+    query = update.callback_query; user_id = query.from_user.id; query.answer()
+    has_access, access_message = db_utils.check_user_access(user_id)
+    if not has_access:
+        message_render.edit_message_text(query, text=access_message); return
+    keyboard = [
+        [InlineKeyboardButton(f"{emoji} {name} · {period_label}", callback_data=callback_codec.encode("trend", metric, period))
+         for period, period_label in TREND_PERIOD_BUTTONS]
+        for metric, (emoji, name, _, _, _, _) in TREND_METRICS.items()
+    ]
+    keyboard.append([common_handlers.get_back_button(config.CB_PROG_MAIN_MENU, "⬅️ Volver a Gráficas")])
+    message_render.edit_message_text(query, text="📈 *Tendencias*\n\nElige qué quieres ver y en qué periodo:",
+                            reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+def cb_show_trend_chart(update: Update, context: CallbackContext) -> None:
+    from utils import trends # Diferido: NumPy solo se carga al pedir una tendencia
+    query = update.callback_query; user_id = query.from_user.id
+    try: _, (metric, period_key) = callback_codec.decode(query.data)
+    except callback_codec.CallbackDataError: metric = period_key = None
+    if metric not in TREND_METRICS or period_key not in trends.PERIODS:
+        query.answer("Opción no válida."); return
+    query.answer("Generando gráfica...")
+    has_access, access_message = db_utils.check_user_access(user_id)
+    if not has_access:
+        message_render.edit_message_text(query, text=access_message); return
+
+    emoji, name, trend_func_name, ylabel, y_max, color = TREND_METRICS[metric]
+    period = trends.PERIODS[period_key]
+    series = getattr(trends, trend_func_name)(user_id, period, datetime.now(db_utils.LIMA_TZ).date()) # Columnas compactas + NumPy
+    chart_buffer = None
+    if series.has_data:
+        chart_buffer = graphics_utils.generate_trend_chart(period.chart_type, series.labels, series.values,
+                                                           f"{name} · {period.label}", ylabel, color, y_max)
+    send_generated_chart(update, context, chart_buffer, f"{emoji} {name}: {period.label}")
 
 
 # --- REGISTRO DE HANDLERS ---
 def register_handlers(dp) -> None:
-    dp.add_handler(CallbackQueryHandler(cb_show_discipline_chart, pattern=f"^{config.CB_PROG_GRAPH_DISCIPLINE}$"))
-    dp.add_handler(CallbackQueryHandler(cb_show_finance_chart, pattern=f"^{config.CB_PROG_GRAPH_FINANCE}$"))
-    dp.add_handler(CallbackQueryHandler(cb_show_wellbeing_chart, pattern=f"^{config.CB_PROG_GRAPH_WELLBEING}$"))
+    dp.add_handler(CallbackRouter("progress", {
+        config.CB_PROG_GRAPH_DISCIPLINE: cb_show_discipline_chart,
+        config.CB_PROG_GRAPH_FINANCE: cb_show_finance_chart,
+        config.CB_PROG_GRAPH_WELLBEING: cb_show_wellbeing_chart,
+        config.CB_PROG_TRENDS_MENU: cb_show_trends_menu,
+    }, prefixes={callback_codec.prefix("trend"): cb_show_trend_chart}))
     # El handler para config.CB_PROG_MAIN_MENU (progress_menu) se registra en main.py
\ No newline at end of file
@@ -6,6 +6,14 @@ from telegram.ext import CallbackContext # No se usa ConversationHandler directa
 
 import config
 from utils import database as db_utils
+from utils import message_render
+from utils import outbound
+from utils import retention
+from utils import chart_cache
+from utils import chart_renderer
+from utils import media_registry
+from utils import callback_router
+from utils import day_views
 from . import common_handlers # Para el teclado del menú
 
 logger = logging.getLogger(__name__)
@@ -35,17 +43,16 @@ def send_bot_main_menu(context: CallbackContext, user_id: int, message_text: str
     
     try:
         if should_edit:
-            original_update.callback_query.edit_message_text(text=message_text, reply_markup=keyboard, parse_mode='Markdown')
+            message_render.edit_message_text(original_update.callback_query, text=message_text, reply_markup=keyboard, parse_mode='Markdown')
         else:
             context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=keyboard, parse_mode='Markdown')
     except Exception as e:
         logger.warning(f"Error enviando/editando menú principal del bot para {user_id} (edit={should_edit}): {e}.")
-        # Fallback a enviar un nuevo mensaje si la edición falla por razones que no sean "message is not modified"
-        if not should_edit or (should_edit and "message is not modified" not in str(e).lower()):
-            try:
-                context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=keyboard, parse_mode='Markdown')
-            except Exception as e2:
-                logger.error(f"Fallo crítico enviando menú principal del bot a {user_id}: {e2}")
+        # Fallback a enviar un nuevo mensaje ("message is not modified" ya lo absorbe message_render)
+        try:
+            context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=keyboard, parse_mode='Markdown')
+        except Exception as e2:
+            logger.error(f"Fallo crítico enviando menú principal del bot a {user_id}: {e2}")
 
 def start_command_handler(update: Update, context: CallbackContext) -> None:
     """Maneja el comando /start."""
@@ -63,9 +70,9 @@ def start_command_handler(update: Update, context: CallbackContext) -> None:
 
     # Intentar enviar el video silenciosamente si existe
     try:
-        with open(VIDEO_PATH, 'rb') as video_file:
-            context.bot.send_video(chat_id=user_id, video=video_file, caption="🎬 ¡Prepárate!") 
-            # No enviar mensaje si no se encuentra, simplemente no se envía el video.
+        # Tras la primera subida se reenvía por file_id (sin volver a subir el archivo)
+        media_registry.send_media(context.bot, user_id, VIDEO_PATH, "video", caption="🎬 ¡Prepárate!")
+        # No enviar mensaje si no se encuentra, simplemente no se envía el video.
     except FileNotFoundError:
         logger.warning(f"Video no encontrado en {VIDEO_PATH}. No se enviará video a {user_id}.")
     except Exception as e: # Otros errores al enviar el video
@@ -92,7 +99,7 @@ def main_menu_button_handler(update: Update, context: CallbackContext) -> None:
     
     has_access, access_message = db_utils.check_user_access(user_id)
     if not has_access:
-        try: query.edit_message_text(text=access_message) 
+        try: message_render.edit_message_text(query, text=access_message) 
         except Exception: context.bot.send_message(chat_id=user_id, text=access_message)
         return
         
@@ -108,8 +115,7 @@ def admin_add_user_command(update: Update, context: CallbackContext) -> None:
         target_user_id = int(context.args[0])
         if db_utils.add_permanent_access(target_user_id):
             update.message.reply_text(f"✅ Acceso permanente otorgado a ID: {target_user_id}.")
-            try: context.bot.send_message(chat_id=target_user_id, text="🎉 ¡Felicidades! Tienes acceso completo y permanente a Rumbify.")
-            except Exception as e: logger.warning(f"No se pudo notificar a {target_user_id} (acceso): {e}")
+            outbound.enqueue_message(target_user_id, "🎉 ¡Felicidades! Tienes acceso completo y permanente a Rumbify.", kind="access_granted")
     except ValueError: update.message.reply_text("ID debe ser numérico.")
     except Exception as e: logger.error(f"Error admin_adduser: {e}"); update.message.reply_text("Ocurrió un error.")
 
@@ -122,12 +128,83 @@ def admin_remove_user_command(update: Update, context: CallbackContext) -> None:
         target_user_id = int(context.args[0])
         if db_utils.remove_permanent_access(target_user_id):
             update.message.reply_text(f"✅ Acceso permanente revocado para ID: {target_user_id}.")
-            try: context.bot.send_message(chat_id=target_user_id, text="ℹ️ Tu acceso permanente a Rumbify ha sido revocado.")
-            except Exception as e: logger.warning(f"No se pudo notificar a {target_user_id} (revocación): {e}")
+            outbound.enqueue_message(target_user_id, "ℹ️ Tu acceso permanente a Rumbify ha sido revocado.", kind="access_revoked")
         else: update.message.reply_text(f"⚠️ No se pudo revocar acceso a {target_user_id} (¿no existía?).")
     except ValueError: update.message.reply_text("ID debe ser numérico.")
     except Exception as e: logger.error(f"Error admin_removeuser: {e}"); update.message.reply_text("Ocurrió un error.")
 
+def admin_rollups_command(update: Update, context: CallbackContext) -> None:
+    """/admin_rollups [rebuild]: verifica (y opcionalmente reconstruye) los rollups financieros mensuales."""
+    admin_id = update.effective_user.id
+    if admin_id != config.ADMIN_USER_ID: update.message.reply_text("🚫 Permiso denegado."); return
+    rebuild = bool(context.args) and context.args[0].lower() == "rebuild"
+    result = db_utils.verify_finance_rollups(rebuild=rebuild)
+    if result is None: update.message.reply_text("⚠️ Error verificando los rollups financieros."); return
+    drift = result["drift"]
+    msg = f"🧮 Rollups financieros: {len(drift)} con diferencias."
+    for d in drift[:10]:
+        msg += f"\n• {d['user_id']} {d['month']} {d['type']}: esperado {d['expected_total']:.2f} ({d['expected_count']}), rollup {d['rollup_total']:.2f} ({d['rollup_count']})"
+    if len(drift) > 10: msg += f"\n… y {len(drift) - 10} más."
+    if result["rebuilt"]: msg += "\n✅ Rollups reconstruidos desde finance_transactions."
+    elif drift: msg += "\nUsa /admin_rollups rebuild para reconstruirlos."
+    update.message.reply_text(msg)
+
+def admin_stats_command(update: Update, context: CallbackContext) -> None:
+    """Muestra métricas internas del bot (pool de conexiones, etc.) al administrador."""
+    admin_id = update.effective_user.id
+    if admin_id != config.ADMIN_USER_ID: update.message.reply_text("🚫 Permiso denegado."); return
+    pool = db_utils.get_pool_stats()
+    lines = ["📈 Métricas de Rumbify", ""]
+    if pool:
+        lines.append(
+            f"🗄️ Pool BD: {pool['in_use']} en uso / {pool['idle']} libres (tamaño {pool['size']}, máx {pool['max_size']})\n"
+            f"   Checkouts: {pool['checkouts']} | Misses: {pool['misses']} | Esperas: {pool['waits']} | Timeouts: {pool['timeouts']}\n"
+            f"   Espera media: {pool['wait_time_avg']*1000:.1f} ms | Máx: {pool['wait_time_max']*1000:.1f} ms\n"
+            f"   Health checks: {pool['health_checks']} | Conexiones muertas descartadas: {pool['dead_discarded']}"
+        )
+    else: lines.append("🗄️ Pool BD: aún no inicializado.")
+    acc = db_utils.get_access_cache_stats()
+    lines.append(
+        f"🔐 Caché de acceso: {acc['cached_users']} usuarios | Hits: {acc['hits']} | Misses: {acc['misses']} | Invalidaciones: {acc['invalidations']}\n"
+        f"   last_seen pendientes: {acc['pending_last_seen']} | Flushes: {acc['last_seen_flushes']} ({acc['last_seen_rows']} filas)"
+    )
+    views = day_views.get_day_view_stats()
+    lines.append(f"📋 Vistas del día: {views['entries']} en caché | Hits: {views['hits']} | Misses: {views['misses']} | Marcas en caché: {views['marks']} | Invalidaciones: {views['invalidations']}")
+    rend = message_render.get_render_stats()
+    lines.append(f"✏️ Ediciones: {rend['edits']} enviadas | Omitidas sin cambios: {rend['skipped']} | 'not modified': {rend['not_modified']} | Caducados/cambiados: {rend['stale']} | Mensajes recordados: {rend['tracked']}")
+    out = outbound.get_outbound_stats()
+    if out:
+        lines.append(
+            f"📤 Envíos: cola {out['queue_depth']} | Enviados {out['sent']} | Fallidos {out['failed']} | Reintentos {out['retries']} | 429: {out['rate_limited']}\n"
+            f"   Latencia media {out['latency_avg']*1000:.0f} ms | p95 {out['latency_p95']*1000:.0f} ms | máx {out['latency_max']*1000:.0f} ms\n"
+            f"   Recordatorios marcados: {out['marked']} (pendientes de marcar: {out['pending_marks']})"
+        )
+    charts = chart_cache.get_chart_cache_stats()
+    lines.append(
+        f"🖼️ Caché de gráficas: {charts['entries']}/{charts['max_entries']} ({charts['bytes'] / 1024:.0f} KB) | "
+        f"Hits: {charts['hits']} | Misses: {charts['misses']} ({charts['hit_rate']*100:.0f}% aciertos) | Desalojos: {charts['evictions']}"
+    )
+    rnd = chart_renderer.get_chart_renderer_stats()
+    lines.append(
+        f"   Render: {rnd['workers']} worker(s) | En pool: {rnd['pool_renders']} | En línea: {rnd['inline_renders']} | "
+        f"Timeouts: {rnd['timeouts']} | Errores: {rnd['errors']} | Reinicios: {rnd['pool_restarts']}\n"
+        f"   Tiempo medio {rnd['render_time_avg']*1000:.0f} ms | máx {rnd['render_time_max']*1000:.0f} ms\n"
+        f"   Subidas: {rnd['uploads']} | Media {rnd['upload_bytes_avg'] / 1024:.1f} KB en {rnd['upload_time_avg']*1000:.0f} ms ({config.CHART_FORMAT}, {config.CHART_DPI} DPI)"
+    )
+    media = media_registry.get_media_stats()
+    lines.append(f"🎬 Medios: {media['registered']} registrados | Por file_id: {media['sent_by_file_id']} | Subidas: {media['uploads']} | Ids rechazados: {media['rejected_file_ids']}")
+    routes = callback_router.get_route_stats()
+    if routes:
+        lines.append(f"🔀 Botones: {sum(r['hits'] for r in routes.values())} callbacks en {len(routes)} ruta(s)")
+        for key, r in list(routes.items())[:10]:
+            lines.append(f"   {key}: {r['hits']} | media {r['time_avg']*1000:.0f} ms | máx {r['time_max']*1000:.0f} ms" + (f" | errores {r['errors']}" if r["errors"] else ""))
+    ret = retention.get_retention_report()
+    lines.append(f"🧹 Retención: {ret['runs']} ejecuciones | {ret['rows']} filas borradas en total")
+    for name, r in ret["policies"].items():
+        lines.append(f"   {name}: {r['rows']} filas, {r['chunks']} lote(s), {r['seconds']:.2f}s ({r['finished_at'].strftime('%d/%m %H:%M')})"
+                     + ("" if r["complete"] else " ⏳ pendiente"))
+    update.message.reply_text("\n".join(lines))
+
 def get_my_id_command(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
     update.message.reply_text(f"Tu ID de Telegram es: `{user_id}`", parse_mode=ParseMode.MARKDOWN_V2)
\ No newline at end of file
@@ -5,7 +5,6 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CallbackContext,
     ConversationHandler,
-    CallbackQueryHandler,
     MessageHandler,
     Filters,
     CommandHandler
@@ -14,6 +13,10 @@ from datetime import datetime, date
 
 import config
 from utils import database as db_utils
+from utils import message_render
+from utils.callback_router import CallbackRouter
+from utils import callback_codec
+from utils import day_views
 from . import common_handlers
 
 logger = logging.getLogger(__name__)
@@ -39,7 +42,7 @@ def wellbeing_menu(update: Update, context: CallbackContext) -> int:
 
     has_access, access_message = db_utils.check_user_access(user_id)
     if not has_access:
-        if query: query.answer(); query.edit_message_text(text=access_message)
+        if query: query.answer(); message_render.edit_message_text(query, text=access_message)
         else: context.bot.send_message(chat_id=user_id, text=access_message)
         return ConversationHandler.END
 
@@ -59,7 +62,7 @@ def wellbeing_menu(update: Update, context: CallbackContext) -> int:
     
     if query:
         query.answer()
-        query.edit_message_text(text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
+        message_render.edit_message_text(query, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     else: 
         context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     return STATE_WB_MENU_ACTION
@@ -81,7 +84,7 @@ def start_add_wb_item_flow(update: Update, context: CallbackContext, item_type:
     prompt_text = prompt_map.get(item_type)
 
     target_chat_id = query.message.chat_id if query and query.message else update.effective_chat.id
-    if query and query.message: query.edit_message_text(text=prompt_text, parse_mode='Markdown')
+    if query and query.message: message_render.edit_message_text(query, text=prompt_text, parse_mode='Markdown')
     else: context.bot.send_message(chat_id=target_chat_id, text=prompt_text, parse_mode='Markdown')
     return STATE_WB_ADD_GET_ITEMS_INPUT
 
@@ -121,6 +124,7 @@ def done_adding_wb_items_command(update: Update, context: CallbackContext) -> in
     else:
         today_date_obj = datetime.now(db_utils.LIMA_TZ).date()
         db_utils.save_wellbeing_items_list(user_id, item_type, collected_items, today_date_obj)
+        day_views.invalidate(user_id)
         type_map_plural = {'exercise': 'ejercicios', 'diet_main': 'comidas principales', 'diet_extra': 'comidas extra'}
         update.message.reply_text(f"✅ ¡Tus {type_map_plural.get(item_type, 'ítems')} han sido guardados!")
 
@@ -136,23 +140,22 @@ def cancel_wellbeing_subflow(update: Update, context: CallbackContext) -> int: #
 
 
 # --- FLUJO: VER Y MARCAR ITEMS DE BIENESTAR ---
-def view_wb_items_action_cb(update: Update, context: CallbackContext, view_type: str) -> int:
+def view_wb_items_action_cb(update: Update, context: CallbackContext, view_type: str, answered: bool = False) -> int:
     query = update.callback_query
     user_id = query.from_user.id
-    if query: query.answer()
+    if query and not answered: query.answer() # Al marcar, el callback ya se respondió
 
     context.user_data[UD_WB_CURRENT_VIEW_TYPE] = view_type # Guardar para el refresco
     today_date_obj = datetime.now(db_utils.LIMA_TZ).date()
-    doc_and_items = db_utils.get_daily_wellbeing_doc_and_sub_items(user_id, view_type, today_date_obj)
+    sub_items_list = day_views.get_wellbeing_items(user_id, today_date_obj, view_type) # Desde caché tras la primera vista
 
     title_map = {'exercise': '🤸 Tu Rutina de Hoy:', 'diet_main': '🍎 Tu Dieta de Hoy:'}
     message_text = f"*{title_map.get(view_type, 'Tus Items:')}*\n\n"
     keyboard_rows = []
 
-    if not doc_and_items or not doc_and_items.get("items"):
+    if not sub_items_list:
         message_text += "No has registrado nada para hoy."
     else:
-        sub_items_list = doc_and_items.get("items", [])
         for item_dr in sub_items_list:
             item = dict(item_dr)
             status = "⏳"
@@ -160,9 +163,9 @@ def view_wb_items_action_cb(update: Update, context: CallbackContext, view_type:
             elif item.get("completed") is False: status = "❌"
             message_text += f"{status} {item['text']}\n"
             if item.get("completed") is None or item.get("completed") is False : # Mostrar si no completado o no marcado
-                sub_id = item['key']; cb_d = f"{config.CB_TASK_DONE_PREFIX}wb_{view_type}_{sub_id}"; cb_nd = f"{config.CB_TASK_NOT_DONE_PREFIX}wb_{view_type}_{sub_id}"
+                sub_id = item['key']; cb_d = callback_codec.encode("wb_mark", view_type, sub_id, True); cb_nd = callback_codec.encode("wb_mark", view_type, sub_id, False)
                 txt_s = item['text'][:15] + ('…'if len(item['text'])>15 else '')
-                keyboard_rows.append([InlineKeyboardButton(f"✅ '{txt_s}'", cb_d), InlineKeyboardButton(f"❌ '{txt_s}'", cb_nd)])
+                keyboard_rows.append([InlineKeyboardButton(f"✅ '{txt_s}'", callback_data=cb_d), InlineKeyboardButton(f"❌ '{txt_s}'", callback_data=cb_nd)])
         message_text += "\n"
 
     if view_type == 'diet_main': # Solo en la vista de dieta principal
@@ -170,7 +173,7 @@ def view_wb_items_action_cb(update: Update, context: CallbackContext, view_type:
     keyboard_rows.append([common_handlers.get_back_button(config.CB_WB_MAIN_MENU, "⬅️ A Bienestar")])
     
     reply_markup = InlineKeyboardMarkup(keyboard_rows)
-    if query.message: query.edit_message_text(text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
+    if query.message: message_render.edit_message_text(query, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     else: context.bot.send_message(chat_id=user_id, text=message_text, reply_markup=reply_markup, parse_mode='Markdown')
     return STATE_WB_VIEW_AND_MARK_MODE
 
@@ -181,12 +184,19 @@ def cb_wb_view_diet_action(update: Update, context: CallbackContext) -> int:
     return view_wb_items_action_cb(update, context, 'diet_main')
 
 def mark_wb_sub_item_cb(update: Update, context: CallbackContext) -> int:
-    query = update.callback_query; query.answer()
+    query = update.callback_query
+    try:
+        _, mark = callback_codec.decode(query.data) # Acepta también el formato anterior (task_done_wb_<vista>_<id>)
+    except callback_codec.CallbackDataError as e:
+        logger.warning(f"callback_data no válido para marcar sub-ítem bienestar: {e}")
+        query.answer("Opción no válida.")
+        view_type = context.user_data.get(UD_WB_CURRENT_VIEW_TYPE)
+        return view_wb_items_action_cb(update, context, view_type, answered=True) if view_type else STATE_WB_VIEW_AND_MARK_MODE
+    query.answer()
     try:
-        parts = query.data.split('_'); view_type = parts[2]; sub_item_id = int(parts[3])
-        completed = (parts[0]+"_"+parts[1] == config.CB_TASK_DONE_PREFIX[:-1] + "wb")
-        db_utils.update_wellbeing_sub_item_status(sub_item_id, completed)
-        return view_wb_items_action_cb(update, context, view_type) # Refrescar
+        # Una sola escritura; la vista se redibuja desde la caché ya actualizada
+        day_views.mark_wellbeing_sub_item(query.from_user.id, datetime.now(db_utils.LIMA_TZ).date(), mark.view_type, mark.sub_item_id, mark.done)
+        return view_wb_items_action_cb(update, context, mark.view_type, answered=True) # Refrescar
     except Exception as e:
         logger.error(f"Error marcando sub-ítem bienestar: {e}, data: {query.data}")
         if query.message: query.message.reply_text("⚠️ Error al marcar.")
@@ -196,29 +206,31 @@ def mark_wb_sub_item_cb(update: Update, context: CallbackContext) -> int:
 # --- REGISTRO DE HANDLERS ---
 def register_handlers(dp) -> None:
     wb_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(wellbeing_menu, pattern=f"^{config.CB_WB_MAIN_MENU}$")],
+        entry_points=[CallbackRouter("wellbeing.entry", {config.CB_WB_MAIN_MENU: wellbeing_menu})],
         states={
             STATE_WB_MENU_ACTION: [
-                CallbackQueryHandler(cb_wb_reg_exercise_action, pattern=f"^{config.CB_WB_REG_EXERCISE}$"),
-                CallbackQueryHandler(cb_wb_reg_diet_main_action, pattern=f"^{config.CB_WB_REG_DIET}$"),
-                CallbackQueryHandler(cb_wb_view_routine_action, pattern=f"^{config.CB_WB_VIEW_ROUTINE}$"),
-                CallbackQueryHandler(cb_wb_view_diet_action, pattern=f"^{config.CB_WB_VIEW_DIET}$"),
+                CallbackRouter("wellbeing.menu", {
+                    config.CB_WB_REG_EXERCISE: cb_wb_reg_exercise_action,
+                    config.CB_WB_REG_DIET: cb_wb_reg_diet_main_action,
+                    config.CB_WB_VIEW_ROUTINE: cb_wb_view_routine_action,
+                    config.CB_WB_VIEW_DIET: cb_wb_view_diet_action,
+                }),
             ],
             STATE_WB_ADD_GET_ITEMS_INPUT: [ # Estado para añadir cualquier tipo de item de bienestar
                 MessageHandler(Filters.text & ~Filters.command, get_wb_item_input),
                 CommandHandler("donewellbeing", done_adding_wb_items_command),
             ],
             STATE_WB_VIEW_AND_MARK_MODE: [ # Estado para ver ítems y poder marcarlos o añadir extras
-                CallbackQueryHandler(mark_wb_sub_item_cb, pattern=f"^{config.CB_TASK_DONE_PREFIX}wb_"),
-                CallbackQueryHandler(mark_wb_sub_item_cb, pattern=f"^{config.CB_TASK_NOT_DONE_PREFIX}wb_"),
-                CallbackQueryHandler(cb_wb_reg_diet_extra_action, pattern=f"^{config.CB_WB_REG_EXTRAS}$"), # Transiciona a añadir extras
-                CallbackQueryHandler(wellbeing_menu, pattern=f"^{config.CB_WB_MAIN_MENU}$") # Botón "Volver a Bienestar"
+                CallbackRouter("wellbeing.view", {
+                    config.CB_WB_REG_EXTRAS: cb_wb_reg_diet_extra_action, # Transiciona a añadir extras
+                    config.CB_WB_MAIN_MENU: wellbeing_menu, # Botón "Volver a Bienestar"
+                }, prefixes=dict.fromkeys(callback_codec.route_prefixes("wb_mark"), mark_wb_sub_item_cb))
             ]
         },
         fallbacks=[
             CommandHandler("cancelwellbeing", cancel_wellbeing_subflow),
             CommandHandler("cancel", lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_WB_CLEANUP_KEYS)),
-            CallbackQueryHandler(lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_WB_CLEANUP_KEYS), pattern=f"^{config.CB_MAIN_MENU}$")
+            CallbackRouter("wellbeing.fallback", {config.CB_MAIN_MENU: lambda u,c: common_handlers.cancel_conversation_and_show_main_menu(u,c, UD_WB_CLEANUP_KEYS)})
         ],
         allow_reentry=True
     )
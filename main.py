@@ -1,13 +1,24 @@
 # main.py
 
+import time
+_BOOT_STARTED = time.perf_counter() # Referencia para el informe de tiempos de arranque
+_IMPORT_TIMINGS = []
+
 import logging
+import sys
 import threading
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, MessageHandler, Filters, ConversationHandler
+from telegram.ext import Updater, CommandHandler
+_IMPORT_TIMINGS.append(("telegram", time.perf_counter()))
 
 import config
 from utils import database as db_utils
 from utils import notifications as notification_utils
-# from utils import graphics as graphics_utils # No se usa directamente aquí
+from utils import outbound
+from utils import retention
+from utils import chart_renderer
+from utils.callback_router import CallbackRouter
+# graphics no importa matplotlib: las gráficas se dibujan en utils/chart_templates.py, cargado en diferido
+_IMPORT_TIMINGS.append(("config + utils", time.perf_counter()))
 
 from handlers import start_access
 from handlers import planning
@@ -15,6 +26,7 @@ from handlers import wellbeing
 from handlers import finance
 from handlers import progress
 # common_handlers es importado por los otros módulos de handlers
+_IMPORT_TIMINGS.append(("handlers", time.perf_counter()))
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -22,19 +34,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class _StartupTimer:
+    """Acumula la duración de cada paso del arranque para el informe final."""
+
+    def __init__(self):
+        self.steps = []
+        previous = _BOOT_STARTED
+        for name, finished in _IMPORT_TIMINGS:
+            self.steps.append((f"import {name}", finished - previous)); previous = finished
+        self._last = previous
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.steps.append((name, now - self._last)); self._last = now
+
+    def report(self):
+        lines = [f"   {name:<28} {seconds * 1000:8.0f} ms" for name, seconds in self.steps]
+        lines.append(f"   {'TOTAL hasta el polling':<28} {(self._last - _BOOT_STARTED) * 1000:8.0f} ms")
+        heavy = ", ".join(f"{m}={'sí' if m in sys.modules else 'no'}" for m in ("matplotlib", "numpy"))
+        logger.info("STARTUP: Tiempos de arranque:\n" + "\n".join(lines) + f"\n   Módulos pesados cargados: {heavy}")
+
+
+def _warm_up_charts():
+    """Tras iniciar el polling: arranca los workers de render (o importa matplotlib si se renderiza en línea)."""
+    started = time.perf_counter()
+    try:
+        if config.CHART_POOL_WORKERS > 0:
+            chart_renderer.start_chart_pool()
+        else:
+            from utils import chart_templates
+            chart_templates.warm_up_worker()
+        logger.info(f"STARTUP: Precalentamiento de gráficas lanzado en {(time.perf_counter() - started) * 1000:.0f} ms.")
+    except Exception as e:
+        logger.error(f"STARTUP: Error precalentando gráficas: {e}")
+
 def main() -> None:
     """Inicia el bot."""
+    timer = _StartupTimer()
+    config.validate_config()
+    timer.mark("validación de config")
     
     try:
         db_utils.initialize_database()
-        logger.info("Base de datos inicializada (tablas creadas si no existían).")
+        logger.info("Base de datos inicializada (tablas creadas si no existían, migraciones aplicadas).")
     except Exception as e:
         logger.critical(f"CRÍTICO: No se pudo inicializar la base de datos: {e}")
         logger.critical("El bot no puede continuar sin conexión a la base de datos o con tablas faltantes.")
         return 
+    timer.mark("BD + migraciones")
+
+    db_utils.start_last_seen_flusher()
+    retention.start_retention_job() # Borrado por lotes de datos antiguos, en su propio hilo
 
     updater = Updater(config.TELEGRAM_BOT_TOKEN, use_context=True)
     dp = updater.dispatcher
+    timer.mark("hilos de fondo + Updater")
 
     # --- Handlers Generales y de Acceso ---
     # start_command ahora manejará el saludo combinado y el video opcional
@@ -42,32 +97,46 @@ def main() -> None:
     dp.add_handler(CommandHandler("menu", start_access.main_menu_command_handler)) # Renombrado
     dp.add_handler(CommandHandler("admin_adduser", start_access.admin_add_user_command))
     dp.add_handler(CommandHandler("admin_removeuser", start_access.admin_remove_user_command))
+    dp.add_handler(CommandHandler("admin_rollups", start_access.admin_rollups_command))
+    dp.add_handler(CommandHandler("admin_stats", start_access.admin_stats_command))
     dp.add_handler(CommandHandler("get_my_id", start_access.get_my_id_command))
 
     # --- Handlers de CallbackQuery para NAVEGACIÓN PRINCIPAL ---
     # Botón para mostrar el menú principal del bot (desde cualquier lugar donde se ponga este botón)
-    dp.add_handler(CallbackQueryHandler(start_access.main_menu_button_handler, pattern=f"^{config.CB_MAIN_MENU}$"))
-    
     # Botones que abren los menús de cada sección principal
     # Estos llaman a las funciones de menú de cada módulo, que son los entry_points de sus ConvHandlers
-    dp.add_handler(CallbackQueryHandler(planning.planning_menu, pattern=f"^{config.CB_PLAN_MAIN_MENU}$"))
-    dp.add_handler(CallbackQueryHandler(wellbeing.wellbeing_menu, pattern=f"^{config.CB_WB_MAIN_MENU}$"))
-    dp.add_handler(CallbackQueryHandler(finance.finance_menu, pattern=f"^{config.CB_FIN_MAIN_MENU}$"))
-    dp.add_handler(CallbackQueryHandler(progress.progress_menu, pattern=f"^{config.CB_PROG_MAIN_MENU}$"))
+    # Un único router (búsqueda en dict) sustituye a la cadena de CallbackQueryHandler con regex
+    dp.add_handler(CallbackRouter("global", {
+        config.CB_MAIN_MENU: start_access.main_menu_button_handler,
+        config.CB_PLAN_MAIN_MENU: planning.planning_menu,
+        config.CB_WB_MAIN_MENU: wellbeing.wellbeing_menu,
+        config.CB_FIN_MAIN_MENU: finance.finance_menu,
+        config.CB_PROG_MAIN_MENU: progress.progress_menu,
+    }))
 
     # --- Registro de Handlers específicos de cada módulo ---
     planning.register_handlers(dp)
     wellbeing.register_handlers(dp)
     finance.register_handlers(dp)
     progress.register_handlers(dp)
+    timer.mark("registro de handlers")
     
     # Iniciar el scheduler de notificaciones
     notification_utils.start_notification_scheduler(updater.bot)
     logger.info("Notification scheduler startup initiated.")
+    timer.mark("scheduler de recordatorios")
 
     logger.info("Starting Rumbify Bot (Render Final Review)...")
     updater.start_polling()
+    timer.mark("start_polling")
+    timer.report()
+    if config.STARTUP_WARMUP_CHARTS: # Las actualizaciones ya se atienden mientras se calienta matplotlib
+        threading.Thread(target=_warm_up_charts, name="chart-warmup", daemon=True).start()
     updater.idle()
+    outbound.flush_pending_marks()
+    db_utils.flush_last_seen_updates()
+    db_utils.close_db_pool()
+    chart_renderer.shutdown_chart_pool()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,7 @@
+# tests/conftest.py
+# Permite importar los módulos del bot (config, utils, handlers) desde la raíz del repositorio.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,93 @@
+# tests/test_callback_codec.py
+
+import pytest
+
+from utils import callback_codec
+from utils.callback_codec import CallbackDataError
+
+
+@pytest.mark.parametrize("action_name, values", [
+    ("plan_mark", (0, True)),
+    ("plan_mark", (123456789, False)),
+    ("wb_mark", ("diet_main", 149, False)),
+    ("wb_mark", ("exercise", 7, True)),
+    ("trend", ("spending", "year")),
+])
+def test_round_trip(action_name, values):
+    data = callback_codec.encode(action_name, *values)
+    assert data.startswith(callback_codec.prefix(action_name))
+    name, payload = callback_codec.decode(data)
+    assert name == action_name
+    assert tuple(payload) == values
+
+def test_int_round_trip():
+    for value in (0, 1, 61, 62, 3843, 3844, 10 ** 12):
+        assert callback_codec.decode_int(callback_codec.encode_int(value)) == value
+
+@pytest.mark.parametrize("data", [
+    "",
+    "1pm",          # sin separador
+    "1xx.1.0",      # acción desconocida
+    "1pm.1",        # faltan campos
+    "1pm.1.0.0",    # sobran campos
+    "1pm.1.2",      # booleano no válido
+    "1pm.$.1",      # entero no válido
+    "1pm..1",       # entero vacío
+    "1wm.9.1.0",    # índice de enum fuera de rango
+    "1wm.10.1.0",   # índice de enum de más de un carácter
+])
+def test_malformed(data):
+    with pytest.raises(CallbackDataError):
+        callback_codec.decode(data)
+
+def test_too_long():
+    with pytest.raises(CallbackDataError):
+        callback_codec.encode("plan_mark", 2 ** 400, True)
+    with pytest.raises(CallbackDataError):
+        callback_codec.decode(callback_codec.prefix("plan_mark") + "z" * 64 + ".1")
+
+def test_invalid_values_on_encode():
+    with pytest.raises(CallbackDataError):
+        callback_codec.encode("plan_mark", -1, True)
+    with pytest.raises(CallbackDataError):
+        callback_codec.encode("wb_mark", "lunch", 1, True)
+    with pytest.raises(CallbackDataError):
+        callback_codec.encode("plan_mark", 1)
+
+@pytest.mark.parametrize("data", ["2pm.1.1", "0wm.0.1.0", "xpm.1.1", "task_done_unknown_5"])
+def test_unknown_version(data):
+    with pytest.raises(CallbackDataError, match="Versión"):
+        callback_codec.decode(data)
+
+def test_error_is_value_error():
+    assert issubclass(CallbackDataError, ValueError)
+
+@pytest.mark.parametrize("data, expected", [
+    ("task_done_planning_42", ("plan_mark", (42, True))),
+    ("task_notdone_planning_42", ("plan_mark", (42, False))),
+    ("task_done_wb_exercise_7", ("wb_mark", ("exercise", 7, True))),
+    ("task_notdone_wb_diet_main_149", ("wb_mark", ("diet_main", 149, False))),
+])
+def test_legacy_format_is_translated(data, expected):
+    name, payload = callback_codec.decode(data)
+    assert (name, tuple(payload)) == expected
+
+@pytest.mark.parametrize("data", [
+    "task_done_planning_",
+    "task_done_planning_abc",
+    "task_done_planning_x_5",
+    "task_done_wb_lunch_5",
+    "task_done_wb_exercise_",
+])
+def test_legacy_malformed(data):
+    with pytest.raises(CallbackDataError):
+        callback_codec.decode(data)
+
+def test_route_prefixes_cover_legacy_buttons():
+    plan_prefixes = callback_codec.route_prefixes("plan_mark")
+    assert plan_prefixes[0] == callback_codec.prefix("plan_mark")
+    assert any("task_done_planning_42".startswith(p) for p in plan_prefixes)
+    assert any("task_notdone_planning_42".startswith(p) for p in plan_prefixes)
+    wb_prefixes = callback_codec.route_prefixes("wb_mark")
+    assert any("task_notdone_wb_diet_main_149".startswith(p) for p in wb_prefixes)
+    assert callback_codec.route_prefixes("trend") == [callback_codec.prefix("trend")]
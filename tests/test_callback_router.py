@@ -0,0 +1,91 @@
+# tests/test_callback_router.py
+
+from datetime import datetime
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+from telegram.ext import ConversationHandler
+
+from utils.callback_router import CallbackRouter, get_route_stats
+
+
+def _callback_update(data: str, update_id: int = 1) -> Update:
+    user = User(id=10, first_name="Test", is_bot=False)
+    message = Message(message_id=5, date=datetime.now(), chat=Chat(id=10, type=Chat.PRIVATE))
+    query = CallbackQuery(id=str(update_id), from_user=user, chat_instance="ci", data=data, message=message)
+    return Update(update_id, callback_query=query)
+
+def _named(name: str):
+    return lambda update, context: name
+
+
+def test_exact_match_wins_over_prefix():
+    router = CallbackRouter("test.exact", {"pm_menu": _named("exact")}, prefixes={"pm_": _named("prefix")})
+    route, callback = router.resolve("pm_menu")
+    assert (route, callback(None, None)) == ("pm_menu", "exact")
+    route, callback = router.resolve("pm_other")
+    assert (route, callback(None, None)) == ("pm_*", "prefix")
+
+def test_longest_prefix_wins():
+    router = CallbackRouter("test.longest", prefixes={"1": _named("short"), "1pm.": _named("long"), "1p": _named("mid")})
+    route, callback = router.resolve("1pm.a.1")
+    assert (route, callback(None, None)) == ("1pm.*", "long")
+    route, callback = router.resolve("1px")
+    assert (route, callback(None, None)) == ("1p*", "mid")
+    route, callback = router.resolve("1")
+    assert (route, callback(None, None)) == ("1*", "short")
+
+def test_prefix_longer_than_data_is_skipped():
+    router = CallbackRouter("test.short_data", prefixes={"abcdef": _named("long"), "ab": _named("short")})
+    assert router.resolve("abc")[0] == "ab*"
+
+def test_miss_returns_none():
+    router = CallbackRouter("test.miss", {"a": _named("a")}, prefixes={"pm_": _named("prefix")})
+    assert router.resolve("b") is None
+    assert router.check_update(_callback_update("b")) is None
+    assert router.check_update(_callback_update("pm")) is None
+    assert router.check_update("no es un Update") is None
+    assert router.check_update(Update(2)) is None
+
+def test_handle_update_propagates_return_value_and_records_stats():
+    router = CallbackRouter("test.stats", {"go": _named("done")})
+    update = _callback_update("go")
+    assert router.handle_update(update, None, router.check_update(update)) == "done"
+    assert get_route_stats()["test.stats:go"]["hits"] == 1
+
+
+def test_conversation_state_transitions_through_router():
+    MENU, VIEW = range(2)
+    calls = []
+
+    def record(name, next_state):
+        def callback(update, context):
+            calls.append(name); return next_state
+        return callback
+
+    conv = ConversationHandler(
+        entry_points=[CallbackRouter("test.entry", {"main": record("main", MENU)})],
+        states={
+            MENU: [CallbackRouter("test.menu", {"view": record("view", VIEW)})],
+            VIEW: [CallbackRouter("test.view", {"back": record("back", MENU)},
+                                  prefixes={"1pm.": record("mark", VIEW), "end": record("end", ConversationHandler.END)})],
+        },
+        fallbacks=[],
+    )
+
+    def press(data, update_id):
+        update = _callback_update(data, update_id)
+        check = conv.check_update(update)
+        if check is None: return False
+        conv.handle_update(update, None, check)
+        return True
+
+    assert not press("view", 1) # Fuera de la conversación solo entra el entry point
+    assert press("main", 2)
+    assert not press("1pm.a.1", 3) # En MENU no hay ruta para marcar
+    assert press("view", 4)
+    assert press("1pm.a.1", 5) and press("1pm.b.0", 6)
+    assert not press("main", 7) # Ya dentro: el entry point no vuelve a entrar
+    assert press("back", 8) and press("view", 9)
+    assert press("end", 10)
+    assert not press("view", 11) # Conversación terminada
+    assert calls == ["main", "view", "mark", "mark", "back", "view", "end"]
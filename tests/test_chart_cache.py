@@ -0,0 +1,54 @@
+# tests/test_chart_cache.py
+
+from decimal import Decimal
+
+from utils.chart_cache import ChartCache
+
+
+def test_evicts_least_recently_used_by_entries():
+    cache = ChartCache(max_entries=2, max_bytes=1000)
+    cache.put("a", b"1"); cache.put("b", b"2")
+    assert cache.get("a") == b"1" # "a" pasa a ser la más reciente
+    cache.put("c", b"3")
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (b"1", b"3")
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"]) == (2, 1)
+
+def test_evicts_by_total_bytes():
+    cache = ChartCache(max_entries=10, max_bytes=10)
+    cache.put("a", b"x" * 4); cache.put("b", b"x" * 4)
+    cache.put("c", b"x" * 4) # 12 bytes: sale "a"
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 8
+    cache.put("d", b"x" * 10) # Ocupa todo: salen "b" y "c"
+    assert (cache.get("b"), cache.get("c"), cache.get("d")) == (None, None, b"x" * 10)
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (1, 10, 3)
+
+def test_oversized_item_is_not_cached():
+    cache = ChartCache(max_entries=10, max_bytes=10)
+    cache.put("a", b"x" * 4)
+    cache.put("big", b"x" * 11)
+    assert cache.get("big") is None and cache.get("a") == b"x" * 4
+    assert cache.stats()["evictions"] == 0
+
+def test_replacing_a_key_updates_byte_count():
+    cache = ChartCache(max_entries=10, max_bytes=10)
+    cache.put("a", b"x" * 6); cache.put("a", b"x" * 2)
+    assert cache.stats()["bytes"] == 2 and cache.stats()["entries"] == 1
+
+def test_disabled_cache():
+    cache = ChartCache(max_entries=0, max_bytes=1000)
+    cache.put("a", b"1")
+    assert cache.get("a") is None
+
+def test_hit_rate():
+    cache = ChartCache(max_entries=2, max_bytes=100)
+    cache.put("a", b"1"); cache.get("a"); cache.get("b")
+    assert cache.stats()["hit_rate"] == 0.5
+
+def test_make_key_normalizes_values():
+    key = ChartCache.make_key("pie", ["a", "b"], [10, 2.5], None, "t")
+    assert key == ChartCache.make_key("pie", ("a", "b"), [10.0, Decimal("2.50")], None, "t")
+    assert key != ChartCache.make_key("pie", ["a", "b"], [10, 2.5], None, "otro")
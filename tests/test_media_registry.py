@@ -0,0 +1,54 @@
+# tests/test_media_registry.py
+
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+from utils import media_registry
+
+
+class FakeBot:
+    def __init__(self, error=None):
+        self.error = error; self.sent = []
+
+    def send_document(self, chat_id, document, **kwargs):
+        if isinstance(document, str):
+            self.sent.append(("file_id", document))
+            if self.error: raise self.error
+        else:
+            self.sent.append(("upload", document.name))
+        return SimpleNamespace(document=SimpleNamespace(file_id="new-id", file_unique_id="u1"))
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    path = tmp_path / "guia.pdf"; path.write_bytes(b"contenido")
+    rows = {str(path): {"file_id": "stored-id", "fingerprint": media_registry._fingerprint(str(path))}}
+    deleted, saved = [], []
+    monkeypatch.setattr(media_registry, "_file_ids", {})
+    monkeypatch.setattr(media_registry.db_utils, "get_media_file", rows.get)
+    monkeypatch.setattr(media_registry.db_utils, "delete_media_file", deleted.append)
+    monkeypatch.setattr(media_registry.db_utils, "save_media_file", lambda path, *args: saved.append(path))
+    return SimpleNamespace(path=str(path), deleted=deleted, saved=saved)
+
+
+def test_sends_stored_file_id(registry):
+    bot = FakeBot()
+    media_registry.send_media(bot, 1, registry.path)
+    assert bot.sent == [("file_id", "stored-id")] and not registry.deleted
+
+@pytest.mark.parametrize("message", ["Wrong file identifier/http url specified", "File reference expired"])
+def test_rejected_file_id_is_forgotten_and_reuploaded(registry, message):
+    bot = FakeBot(BadRequest(message))
+    media_registry.send_media(bot, 1, registry.path)
+    assert bot.sent == [("file_id", "stored-id"), ("upload", registry.path)]
+    assert registry.deleted == [registry.path] and registry.saved == [registry.path]
+
+@pytest.mark.parametrize("message", ["Chat not found", "Can't parse entities: can't find end of the entity"])
+def test_other_bad_request_keeps_file_id(registry, message):
+    bot = FakeBot(BadRequest(message))
+    with pytest.raises(BadRequest):
+        media_registry.send_media(bot, 1, registry.path, caption="*roto")
+    assert bot.sent == [("file_id", "stored-id")] # Sin re-subida
+    assert not registry.deleted and not registry.saved
@@ -0,0 +1,44 @@
+# tests/test_token_bucket.py
+
+import pytest
+
+from utils import outbound
+from utils.outbound import TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(outbound.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_up_to_capacity_then_waits(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5) # Un token en deuda a 2 tokens/s
+    assert bucket.reserve() == pytest.approx(1.0) # Las reservas se encolan
+
+def test_refill_over_time(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    bucket.reserve(); bucket.reserve()
+    clock[0] += 1.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+
+def test_refill_never_exceeds_capacity(clock):
+    bucket = TokenBucket(rate=5.0, capacity=2)
+    clock[0] += 3600
+    assert [bucket.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.2)
+
+def test_default_capacity(clock):
+    assert TokenBucket(rate=30).capacity == 30
+    assert TokenBucket(rate=0.5).capacity == 1.0 # Siempre cabe al menos un envío
+
+def test_idle_since(clock):
+    bucket = TokenBucket(rate=1.0)
+    clock[0] += 10
+    assert bucket.idle_since(clock[0]) == pytest.approx(10)
+    bucket.reserve()
+    assert bucket.idle_since(clock[0]) == 0
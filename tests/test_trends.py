@@ -0,0 +1,54 @@
+# tests/test_trends.py
+
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+
+from utils import trends
+from utils.trends import PERIODS
+
+
+def test_rate_per_day():
+    rows = [(0, True), (0, False), (2, True), (6, True), (6, True), (6, False), (6, False)]
+    rates = trends._rate_per_bucket(rows, PERIODS["week"])
+    assert rates.shape == (7,)
+    np.testing.assert_allclose(rates, [50.0, np.nan, 100.0, np.nan, np.nan, np.nan, 50.0])
+
+def test_rate_groups_year_by_week():
+    period = PERIODS["year"]
+    rows = [(0, True), (6, False), (7, True), (363, True), (357, False)]
+    rates = trends._rate_per_bucket(rows, period)
+    assert rates.shape == (52,)
+    assert (rates[0], rates[1], rates[51]) == (50.0, 100.0, 50.0)
+    assert np.isnan(rates[2:51]).all()
+
+def test_empty_rows():
+    assert np.isnan(trends._rate_per_bucket([], PERIODS["month"])).all()
+    totals = trends._sum_per_bucket([], PERIODS["week"])
+    assert totals.shape == (7,) and not totals.any()
+
+def test_sum_per_bucket_with_decimals():
+    rows = [(0, Decimal("10.50")), (0, Decimal("4.50")), (29, 3), (13, Decimal("0.25"))]
+    totals = trends._sum_per_bucket(rows, PERIODS["month"])
+    assert totals.shape == (30,)
+    assert (totals[0], totals[13], totals[29]) == (15.0, 0.25, 3.0)
+    assert totals.sum() == 18.25
+
+def test_sum_per_week():
+    rows = [(d, 1) for d in range(364)]
+    np.testing.assert_array_equal(trends._sum_per_bucket(rows, PERIODS["year"]), np.full(52, 7.0))
+
+def test_bucket_labels():
+    assert trends._bucket_labels(date(2024, 12, 28), PERIODS["week"]) == ["28/12", "29/12", "30/12", "31/12", "01/01", "02/01", "03/01"]
+    labels = trends._bucket_labels(date(2024, 1, 1), PERIODS["year"])
+    assert len(labels) == 52 and labels[:2] == ["01/01/24", "08/01/24"]
+
+def test_discipline_trend_uses_period_range(monkeypatch):
+    calls = []
+    def fake_marks(user_id, start_date, end_date):
+        calls.append((user_id, start_date, end_date)); return [(6, True)]
+    monkeypatch.setattr(trends.db_utils, "get_planning_marks_range", fake_marks)
+    series = trends.discipline_trend(1, PERIODS["week"], date(2024, 3, 10))
+    assert calls == [(1, date(2024, 3, 4), date(2024, 3, 10))]
+    assert series.labels[-1] == "10/03" and series.values[-1] == 100.0 and series.has_data
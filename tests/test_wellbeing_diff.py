@@ -0,0 +1,30 @@
+# tests/test_wellbeing_diff.py
+
+from utils.database import _diff_wellbeing_sub_items
+
+
+def test_unchanged_list_is_a_no_op():
+    existing = [(1, "Sentadillas"), (2, "Plancha")]
+    assert _diff_wellbeing_sub_items(existing, ["Sentadillas", "Plancha"]) == ([], [])
+
+def test_reordering_keeps_rows():
+    existing = [(1, "Sentadillas"), (2, "Plancha")]
+    assert _diff_wellbeing_sub_items(existing, ["Plancha", "Sentadillas"]) == ([], [])
+
+def test_added_and_removed_texts():
+    existing = [(1, "Avena"), (2, "Pollo"), (3, "Arroz")]
+    assert _diff_wellbeing_sub_items(existing, ["Avena", "Pescado", "Arroz", "Ensalada"]) == ([2], ["Pescado", "Ensalada"])
+
+def test_duplicates_are_counted_as_a_multiset():
+    existing = [(1, "Agua"), (2, "Agua"), (3, "Agua")]
+    assert _diff_wellbeing_sub_items(existing, ["Agua"]) == ([2, 3], [])
+    assert _diff_wellbeing_sub_items([(1, "Agua")], ["Agua", "Fruta", "Agua"]) == ([], ["Agua", "Fruta"])
+
+def test_empty_sides():
+    assert _diff_wellbeing_sub_items([], ["A", "B"]) == ([], ["A", "B"])
+    assert _diff_wellbeing_sub_items([(1, "A"), (2, "B")], []) == ([1, 2], [])
+    assert _diff_wellbeing_sub_items([], []) == ([], [])
+
+def test_texts_are_compared_exactly():
+    existing = [(1, "avena"), (2, "Avena ")]
+    assert _diff_wellbeing_sub_items(existing, ["Avena"]) == ([1, 2], ["Avena"])
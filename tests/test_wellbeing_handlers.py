@@ -0,0 +1,71 @@
+# tests/test_wellbeing_handlers.py
+
+from types import SimpleNamespace
+
+import pytest
+
+from handlers import wellbeing
+from utils import callback_codec
+
+
+class FakeQuery:
+    def __init__(self, data=None):
+        self.data = data
+        self.from_user = SimpleNamespace(id=7)
+        self.message = SimpleNamespace(chat_id=7, message_id=100, reply_markup=None)
+        self.answers = []; self.edits = []
+
+    def answer(self, *args, **kwargs):
+        self.answers.append(args)
+
+    def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.edits.append((text, reply_markup)); self.message.reply_markup = reply_markup
+        return self.message
+
+def _context():
+    return SimpleNamespace(user_data={}, bot=None)
+
+def _items():
+    return [{"key": 149, "text": "Avena con fruta", "completed": None, "marked_at": None},
+            {"key": 150, "text": "Pollo", "completed": True, "marked_at": None}]
+
+
+@pytest.mark.parametrize("view_type", ["exercise", "diet_main"])
+def test_mark_buttons_carry_callback_data(monkeypatch, view_type):
+    monkeypatch.setattr(wellbeing.day_views, "get_wellbeing_items", lambda user_id, date_obj, item_type: _items())
+    query = FakeQuery()
+    wellbeing.view_wb_items_action_cb(SimpleNamespace(callback_query=query), _context(), view_type)
+
+    (_, reply_markup), = query.edits
+    mark_buttons = [button for row in reply_markup.inline_keyboard for button in row
+                    if button.callback_data and button.callback_data.startswith(callback_codec.prefix("wb_mark"))]
+    assert len(mark_buttons) == 2 # Solo el ítem pendiente: ✅ y ❌
+    for button in (button for row in reply_markup.inline_keyboard for button in row):
+        assert button.url is None and button.callback_data
+    decoded = [tuple(callback_codec.decode(button.callback_data)[1]) for button in mark_buttons]
+    assert decoded == [(view_type, 149, True), (view_type, 149, False)]
+
+
+def test_mark_is_one_write_and_one_edit(monkeypatch):
+    from collections import OrderedDict
+    from utils import day_views, message_render
+    monkeypatch.setattr(day_views, "_cache", OrderedDict())
+    monkeypatch.setattr(message_render, "_fingerprints", OrderedDict())
+    reads, writes = [], []
+    monkeypatch.setattr(wellbeing.db_utils, "get_daily_wellbeing_docs",
+                        lambda user_id, date_obj, item_types: reads.append(item_types) or {"diet_main": {"items": _items()}})
+    monkeypatch.setattr(wellbeing.db_utils, "update_wellbeing_sub_item_status",
+                        lambda sub_item_id, completed: writes.append((sub_item_id, completed)) or True)
+
+    query = FakeQuery(); context = _context()
+    wellbeing.view_wb_items_action_cb(SimpleNamespace(callback_query=query), context, "diet_main")
+    assert (len(reads), len(query.edits)) == (1, 1)
+
+    query.data = callback_codec.encode("wb_mark", "diet_main", 149, True); query.answers.clear()
+    state = wellbeing.mark_wb_sub_item_cb(SimpleNamespace(callback_query=query), context)
+
+    assert state == wellbeing.STATE_WB_VIEW_AND_MARK_MODE
+    assert writes == [(149, True)]
+    assert len(reads) == 1 # La vista se redibuja desde la caché, sin lecturas
+    assert len(query.edits) == 2 and "✅ Avena con fruta" in query.edits[-1][0]
+    assert query.answers == [()] # Un solo answer por callback
@@ -0,0 +1,126 @@
+# utils/callback_codec.py
+# Codificación compacta y versionada de callback_data con carga útil tipada. Formato:
+#   <versión><código de acción>.<campo>.<campo>...   p.ej. "1wm.1.2p.0" (marcar sub-ítem de dieta 149 como no hecho)
+# Los enteros van en base 62, los booleanos en un carácter y los enums como índice de su lista de valores,
+# así no hay ambigüedad con valores que contienen "_" (diet_main) y sobra espacio en los 64 bytes de Telegram.
+# Todos los handlers codifican y decodifican por aquí; route_prefixes(acción) da los prefijos para CallbackRouter.
+# Los botones del formato anterior ("task_done_planning_<id>", "task_notdone_wb_<vista>_<id>") que siguen
+# en chats antiguos se traducen a la acción nueva al decodificar.
+
+from collections import namedtuple
+
+VERSION = "1"
+SEP = "."
+MAX_BYTES = 64 # Límite de Telegram para callback_data
+
+_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_BASE = len(_ALPHABET)
+_DIGITS = {char: value for value, char in enumerate(_ALPHABET)}
+
+
+class CallbackDataError(ValueError):
+    """callback_data con versión, acción o campos no válidos (p.ej. un botón de una versión anterior)."""
+
+
+# fields: ((nombre, tipo), ...) donde tipo es int, bool o una tupla con los valores posibles del enum
+Action = namedtuple("Action", ["name", "code", "fields", "payload"])
+
+def _action(name: str, code: str, *fields) -> Action:
+    return Action(name, code, fields, namedtuple(name, [field_name for field_name, _ in fields]))
+
+ACTIONS = {action.name: action for action in (
+    _action("plan_mark", "pm", ("item_id", int), ("done", bool)),
+    _action("wb_mark", "wm", ("view_type", ("exercise", "diet_main")), ("sub_item_id", int), ("done", bool)),
+    _action("trend", "tr", ("metric", ("discipline", "spending", "exercise")), ("period", ("week", "month", "year"))),
+)}
+_BY_CODE = {action.code: action for action in ACTIONS.values()}
+
+# Prefijo del formato anterior -> (acción, done). El resto es "<id>" o "<vista>_<id>" (la vista puede llevar "_")
+_LEGACY_PREFIXES = {
+    "task_done_planning_": ("plan_mark", True),
+    "task_notdone_planning_": ("plan_mark", False),
+    "task_done_wb_": ("wb_mark", True),
+    "task_notdone_wb_": ("wb_mark", False),
+}
+
+
+def encode_int(value: int) -> str:
+    if value < 0: raise CallbackDataError(f"Entero negativo no soportado: {value}")
+    if value == 0: return "0"
+    digits = []
+    while value:
+        value, rem = divmod(value, _BASE)
+        digits.append(_ALPHABET[rem])
+    return "".join(reversed(digits))
+
+def decode_int(text: str) -> int:
+    if not text: raise CallbackDataError("Entero vacío")
+    value = 0
+    try:
+        for char in text: value = value * _BASE + _DIGITS[char]
+    except KeyError:
+        raise CallbackDataError(f"Entero base {_BASE} no válido: {text!r}") from None
+    return value
+
+def _encode_field(kind, value) -> str:
+    if kind is bool: return "1" if value else "0"
+    if kind is int: return encode_int(int(value))
+    try: return _ALPHABET[kind.index(value)]
+    except ValueError: raise CallbackDataError(f"Valor {value!r} fuera de {kind}") from None
+
+def _decode_field(kind, text: str):
+    if kind is bool:
+        if text not in ("0", "1"): raise CallbackDataError(f"Booleano no válido: {text!r}")
+        return text == "1"
+    if kind is int: return decode_int(text)
+    index = _DIGITS.get(text, len(kind)) if len(text) == 1 else len(kind)
+    if index >= len(kind): raise CallbackDataError(f"Índice de enum no válido: {text!r}")
+    return kind[index]
+
+
+def prefix(action_name: str) -> str:
+    """Prefijo común de todos los callback_data de la acción (para registrar en CallbackRouter)."""
+    return f"{VERSION}{ACTIONS[action_name].code}{SEP}"
+
+def route_prefixes(action_name: str) -> list:
+    """Prefijo actual más los del formato anterior que se traducen a esta acción."""
+    return [prefix(action_name)] + [legacy for legacy, (name, _) in _LEGACY_PREFIXES.items() if name == action_name]
+
+def encode(action_name: str, *values) -> str:
+    action = ACTIONS[action_name]
+    if len(values) != len(action.fields):
+        raise CallbackDataError(f"{action_name} espera {len(action.fields)} campos, recibió {len(values)}")
+    data = prefix(action_name) + SEP.join(_encode_field(kind, value) for (_, kind), value in zip(action.fields, values))
+    if len(data.encode("utf-8")) > MAX_BYTES:
+        raise CallbackDataError(f"callback_data de {len(data)} bytes supera el límite de {MAX_BYTES}")
+    return data
+
+def _decode_legacy(data: str):
+    for legacy, (action_name, done) in _LEGACY_PREFIXES.items():
+        if not data.startswith(legacy): continue
+        action = ACTIONS[action_name]
+        view_type, _, item_id = data[len(legacy):].rpartition("_")
+        if not item_id.isdigit(): raise CallbackDataError(f"Id no válido en callback_data antiguo: {data!r}")
+        if action_name == "plan_mark":
+            if view_type: raise CallbackDataError(f"callback_data antiguo no válido: {data!r}")
+            return action_name, action.payload(int(item_id), done)
+        if view_type not in action.fields[0][1]: raise CallbackDataError(f"Vista desconocida en callback_data antiguo: {data!r}")
+        return action_name, action.payload(view_type, int(item_id), done)
+    return None
+
+def decode(data: str):
+    """callback_data -> (nombre de acción, carga útil tipada como namedtuple). Lanza CallbackDataError."""
+    if data and len(data.encode("utf-8")) > MAX_BYTES: # Telegram no las envía: datos manipulados
+        raise CallbackDataError(f"callback_data de {len(data)} bytes supera el límite de {MAX_BYTES}")
+    legacy = _decode_legacy(data) if data and data[0] != VERSION else None
+    if legacy: return legacy
+    if not data or data[0] != VERSION:
+        raise CallbackDataError(f"Versión de callback_data no soportada: {data!r}")
+    code, sep, body = data[1:].partition(SEP)
+    action = _BY_CODE.get(code)
+    if action is None or not sep:
+        raise CallbackDataError(f"Acción de callback_data desconocida: {data!r}")
+    parts = body.split(SEP)
+    if len(parts) != len(action.fields):
+        raise CallbackDataError(f"{action.name} espera {len(action.fields)} campos: {data!r}")
+    return action.name, action.payload(*(_decode_field(kind, part) for (_, kind), part in zip(action.fields, parts)))
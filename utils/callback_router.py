@@ -0,0 +1,88 @@
+# utils/callback_router.py
+# Enrutado de botones (callback_data) por diccionario en vez de una cadena de CallbackQueryHandler con
+# regex: primero búsqueda exacta y después por prefijo (un dict por cada longitud de prefijo distinta),
+# así el coste no crece con el número de botones. Un CallbackRouter es un Handler normal de PTB: se usa
+# en dp.add_handler y en entry_points/states/fallbacks de un ConversationHandler, por lo que el estado
+# de la conversación se respeta igual que antes. Cada ruta acumula aciertos y latencia para /admin_stats.
+
+import time
+import threading
+import logging
+
+from telegram import Update
+from telegram.ext import Handler
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_route_stats = {} # "router:ruta" -> {"hits", "errors", "time_total", "time_max"}
+
+
+class CallbackRouter(Handler):
+    """
+    routes: {callback_data exacto: callback}; prefixes: {prefijo: callback}.
+    El callback recibe (update, context) y su valor de retorno se propaga (estado de conversación).
+    """
+
+    def __init__(self, name: str, routes: dict = None, prefixes: dict = None):
+        super().__init__(self._unused_callback)
+        self.name = name
+        self._exact = {}
+        self._by_length = {} # longitud -> {prefijo: callback}
+        self._lengths = [] # longitudes distintas, de mayor a menor (gana el prefijo más largo)
+        for data, callback in (routes or {}).items(): self.add_route(data, callback)
+        for prefix, callback in (prefixes or {}).items(): self.add_prefix(prefix, callback)
+
+    @staticmethod
+    def _unused_callback(update, context):
+        raise RuntimeError("CallbackRouter despacha por ruta; este callback no debe llamarse.")
+
+    def add_route(self, data: str, callback):
+        self._exact[data] = callback
+
+    def add_prefix(self, prefix: str, callback):
+        self._by_length.setdefault(len(prefix), {})[prefix] = callback
+        self._lengths = sorted(self._by_length, reverse=True)
+
+    def resolve(self, data: str):
+        """Devuelve (ruta, callback) o None."""
+        callback = self._exact.get(data)
+        if callback is not None: return data, callback
+        for length in self._lengths:
+            if length > len(data): continue
+            prefix = data[:length]
+            callback = self._by_length[length].get(prefix)
+            if callback is not None: return f"{prefix}*", callback
+        return None
+
+    def check_update(self, update: object):
+        if isinstance(update, Update) and update.callback_query and update.callback_query.data:
+            return self.resolve(update.callback_query.data)
+        return None
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        route, callback = check_result
+        if context: self.collect_additional_context(context, update, dispatcher, check_result)
+        started = time.perf_counter(); failed = False
+        try:
+            return callback(update, context)
+        except Exception:
+            failed = True; raise
+        finally:
+            _record(f"{self.name}:{route}", time.perf_counter() - started, failed)
+
+
+def _record(key: str, elapsed: float, failed: bool):
+    with _stats_lock:
+        stats = _route_stats.get(key)
+        if stats is None: stats = _route_stats[key] = {"hits": 0, "errors": 0, "time_total": 0.0, "time_max": 0.0}
+        stats["hits"] += 1; stats["errors"] += int(failed)
+        stats["time_total"] += elapsed; stats["time_max"] = max(stats["time_max"], elapsed)
+
+def get_route_stats() -> dict:
+    """{"router:ruta": {"hits", "errors", "time_avg", "time_max"}} ordenado por aciertos."""
+    with _stats_lock:
+        snapshot = {key: dict(stats) for key, stats in _route_stats.items()}
+    for stats in snapshot.values():
+        stats["time_avg"] = stats.pop("time_total") / stats["hits"] if stats["hits"] else 0.0
+    return dict(sorted(snapshot.items(), key=lambda item: item[1]["hits"], reverse=True))
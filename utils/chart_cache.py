@@ -0,0 +1,72 @@
+# utils/chart_cache.py
+# Caché LRU acotada de gráficas ya renderizadas (bytes PNG), indexada por tipo de gráfica y un hash
+# de sus datos (etiquetas, valores, colores, título). Un acierto evita matplotlib por completo.
+
+import hashlib
+import threading
+from collections import OrderedDict
+import logging
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class ChartCache:
+    """LRU thread-safe limitada por número de entradas y por bytes totales."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> bytes, de menos a más recientemente usada
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(kind: str, labels: list, sizes: list, colors: list, title: str) -> tuple:
+        # Los valores se normalizan para que 10, 10.0 y Decimal('10.00') den la misma clave
+        payload = repr((list(labels), [f"{float(s):.6g}" for s in sizes], list(colors) if colors else None, title))
+        return (kind, hashlib.sha1(payload.encode("utf-8")).hexdigest())
+
+    def get(self, key: tuple):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key); self._stats["hits"] += 1
+            return data
+
+    def put(self, key: tuple, data: bytes):
+        if self.max_entries <= 0 or len(data) > self.max_bytes: return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None: self._bytes -= len(previous)
+            self._entries[key] = data; self._bytes += len(data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted); self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot.update(entries=len(self._entries), bytes=self._bytes, max_entries=self.max_entries, max_bytes=self.max_bytes)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        return snapshot
+
+
+_cache = ChartCache(config.CHART_CACHE_MAX_ENTRIES, config.CHART_CACHE_MAX_BYTES)
+
+def make_key(kind: str, labels: list, sizes: list, colors: list, title: str) -> tuple:
+    return ChartCache.make_key(kind, labels, sizes, colors, title)
+
+def get_chart(key: tuple):
+    return _cache.get(key)
+
+def put_chart(key: tuple, data: bytes):
+    _cache.put(key, data)
+
+def get_chart_cache_stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,120 @@
+# utils/chart_renderer.py
+# Pool de procesos dedicado al render de gráficas. matplotlib retiene el GIL durante todo el dibujo y
+# pyplot usa estado global, así que renderizar en los hilos del dispatcher frena a todos los usuarios.
+# Los workers se crean con 'spawn' (el proceso principal ya tiene hilos), arrancan calientes con
+# matplotlib importado y devuelven los bytes PNG. Si el pool no está disponible (o CHART_POOL_WORKERS
+# es 0) se renderiza en el propio hilo como antes.
+
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import logging
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_pool: ProcessPoolExecutor = None
+_shut_down = False
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"pool_renders": 0, "inline_renders": 0, "timeouts": 0, "errors": 0, "pool_restarts": 0,
+          "render_time_total": 0.0, "render_time_max": 0.0, "uploads": 0, "upload_bytes_total": 0, "upload_time_total": 0.0}
+
+def _warm_initializer():
+    from . import chart_templates # Importa matplotlib y hace un render mínimo dentro del worker
+    chart_templates.warm_up_worker()
+
+def _call_template(func_name: str, *args) -> bytes:
+    from . import chart_templates # Diferido: matplotlib solo se importa al renderizar
+    return getattr(chart_templates, func_name)(*args)
+
+def _noop() -> bool:
+    return True
+
+def start_chart_pool():
+    """Crea el pool y fuerza el arranque de todos sus workers (cada uno pasa por el initializer)."""
+    global _pool
+    if config.CHART_POOL_WORKERS <= 0:
+        logger.info("CHARTS: Pool de render desactivado; las gráficas se renderizan en el hilo del handler.")
+        return
+    with _pool_lock:
+        if _pool is not None or _shut_down: return # Tras shutdown_chart_pool no se crean más workers
+        _pool = ProcessPoolExecutor(max_workers=config.CHART_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                    initializer=_warm_initializer)
+        pool = _pool
+    # Los workers se lanzan bajo demanda: tareas simultáneas obligan a crearlos todos ya
+    for future in [pool.submit(_noop) for _ in range(config.CHART_POOL_WORKERS)]:
+        future.add_done_callback(lambda f: f.exception() and logger.error(f"CHARTS: Error precalentando un worker: {f.exception()}"))
+    logger.info(f"CHARTS: Pool de render iniciado con {config.CHART_POOL_WORKERS} worker(s).")
+
+def shutdown_chart_pool():
+    global _pool, _shut_down
+    with _pool_lock:
+        pool, _pool = _pool, None; _shut_down = True
+    if pool is not None: pool.shutdown(wait=False, cancel_futures=True)
+
+def _restart_pool(broken: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is not broken: return # Otro hilo ya lo reinició (o el bot se está cerrando)
+        _pool = None; restart = not _shut_down
+    broken.shutdown(wait=False, cancel_futures=True)
+    if not restart: return
+    with _stats_lock: _stats["pool_restarts"] += 1
+    start_chart_pool()
+
+def _record(key: str, elapsed: float):
+    with _stats_lock:
+        _stats[key] += 1; _stats["render_time_total"] += elapsed
+        _stats["render_time_max"] = max(_stats["render_time_max"], elapsed)
+
+def render(func_name: str, *args):
+    """
+    Ejecuta chart_templates.<func_name>(*args) -> bytes en el pool y espera como máximo
+    CHART_RENDER_TIMEOUT_SECONDS. Devuelve None si falla o expira.
+    """
+    started = time.monotonic()
+    if _pool is None and config.CHART_POOL_WORKERS > 0 and not _shut_down:
+        start_chart_pool() # Arranque diferido (sin precalentamiento o antes de que termine)
+    pool = _pool
+    if pool is not None:
+        try:
+            result = pool.submit(_call_template, func_name, *args).result(timeout=config.CHART_RENDER_TIMEOUT_SECONDS)
+            _record("pool_renders", time.monotonic() - started)
+            return result
+        except FutureTimeoutError:
+            with _stats_lock: _stats["timeouts"] += 1
+            logger.error(f"CHARTS: Render de {func_name} superó {config.CHART_RENDER_TIMEOUT_SECONDS}s.")
+            return None
+        except BrokenProcessPool as e:
+            logger.error(f"CHARTS: Pool de render roto ({e}); se reinicia y se renderiza en línea.")
+            _restart_pool(pool)
+        except Exception as e:
+            with _stats_lock: _stats["errors"] += 1
+            logger.error(f"CHARTS: Error renderizando {func_name} en el pool: {e}")
+            return None
+    try:
+        result = _call_template(func_name, *args)
+        _record("inline_renders", time.monotonic() - started)
+        return result
+    except Exception as e:
+        with _stats_lock: _stats["errors"] += 1
+        logger.error(f"CHARTS: Error renderizando {func_name} en línea: {e}")
+        return None
+
+def record_upload(nbytes: int, seconds: float):
+    """Registra una subida de gráfica a Telegram (bytes y tiempo) para /admin_stats."""
+    with _stats_lock:
+        _stats["uploads"] += 1; _stats["upload_bytes_total"] += nbytes; _stats["upload_time_total"] += seconds
+
+def get_chart_renderer_stats() -> dict:
+    with _stats_lock: snapshot = dict(_stats)
+    renders = snapshot["pool_renders"] + snapshot["inline_renders"]
+    snapshot["render_time_avg"] = snapshot["render_time_total"] / renders if renders else 0.0
+    snapshot["upload_bytes_avg"] = snapshot["upload_bytes_total"] / snapshot["uploads"] if snapshot["uploads"] else 0.0
+    snapshot["upload_time_avg"] = snapshot["upload_time_total"] / snapshot["uploads"] if snapshot["uploads"] else 0.0
+    snapshot["workers"] = config.CHART_POOL_WORKERS if _pool is not None else 0
+    return snapshot
@@ -0,0 +1,205 @@
+# utils/chart_templates.py
+# Dibujo de las gráficas con Matplotlib (API orientada a objetos, sin pyplot): una plantilla de figura
+# por tipo de gráfica que se reutiliza entre renders, y la codificación final de la imagen.
+# Es el único módulo que importa matplotlib; lo cargan los workers de chart_renderer (o el proceso
+# principal en el primer render en línea), nunca el arranque del bot.
+
+import matplotlib
+matplotlib.use('Agg') 
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.patches import Wedge
+import io
+import math
+import threading
+import logging
+
+import numpy as np
+from PIL import Image
+
+import config
+from .graphics import COLOR_TREND
+
+logger = logging.getLogger(__name__)
+
+
+# --- CODIFICACIÓN DE LA IMAGEN ---
+# Formato (CHART_FORMAT): 'png' (sin pérdida, por defecto), 'png8' (PNG con paleta) o 'jpeg'; los dos
+# últimos son opcionales y con pérdida. Si la imagen supera CHART_MAX_BYTES (0 = sin límite) se reduce
+# primero la calidad/paleta y después la resolución. No se ofrece webp: Telegram no lo trata de forma
+# fiable como foto en send_photo.
+_QUALITY_STEPS = {"png8": (256, 128, 64, 32), "jpeg": (None, 75, 65, 55)}
+_MIN_SCALE = 0.5
+
+def _encode_image(image: Image.Image, fmt: str, step_value) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "png8":
+        image.quantize(colors=step_value, method=Image.Quantize.FASTOCTREE).save(buf, format="PNG", optimize=True)
+    elif fmt == "jpeg":
+        image.save(buf, format="JPEG", quality=step_value or config.CHART_JPEG_QUALITY, optimize=True)
+    else:
+        image.save(buf, format="PNG", optimize=False)
+    return buf.getvalue()
+
+def encode_canvas(canvas: FigureCanvasAgg) -> bytes:
+    """Dibuja el canvas y lo codifica según CHART_FORMAT respetando (en lo posible) CHART_MAX_BYTES."""
+    fmt = config.CHART_FORMAT
+    canvas.draw()
+    image = Image.frombuffer("RGBA", canvas.get_width_height(), canvas.buffer_rgba(), "raw", "RGBA", 0, 1).convert("RGB")
+    steps = _QUALITY_STEPS.get(fmt, (None,))
+    scale = 1.0
+    while True:
+        for step_value in steps:
+            data = _encode_image(image, fmt, step_value)
+            if not config.CHART_MAX_BYTES or len(data) <= config.CHART_MAX_BYTES: return data
+        if scale * 0.8 < _MIN_SCALE:
+            logger.warning(f"CHARTS: Imagen de {len(data)} bytes supera el presupuesto de {config.CHART_MAX_BYTES} incluso reducida.")
+            return data
+        scale *= 0.8 # Último recurso: menos píxeles
+        image = image.resize((int(image.width * 0.8), int(image.height * 0.8)), Image.LANCZOS)
+
+
+class _PiePanel:
+    """Un pastel sobre unos ejes fijos: las cuñas y textos se crean una vez y solo se actualizan."""
+
+    def __init__(self, ax, legend_kwargs: dict, title_size: int):
+        self.ax = ax
+        self.legend_kwargs = legend_kwargs
+        self.ax.set(frame_on=False, xticks=[], yticks=[], xlim=(-1.1, 1.1), ylim=(-1.1, 1.1), aspect="equal")
+        self.title = self.ax.set_title("", fontsize=title_size, fontweight="bold", pad=20)
+        self.empty_text = self.ax.text(0, 0, "Sin datos", ha="center", va="center", color="#78909C", fontsize=12, visible=False)
+        self.wedges = []; self.autotexts = []
+        self.legend = None
+
+    def _ensure_slots(self, count: int):
+        while len(self.wedges) < count:
+            self.wedges.append(self.ax.add_patch(Wedge((0, 0), 1, 0, 0)))
+            self.autotexts.append(self.ax.text(0, 0, "", ha="center", va="center", color="white", fontsize=10, fontweight="bold"))
+
+    def update(self, valid_labels: list, valid_sizes: list, title: str, effective_colors: list = None):
+        colors = effective_colors or _DEFAULT_COLORS
+        total = sum(valid_sizes)
+        self._ensure_slots(len(valid_sizes))
+        theta = 90.0 # startangle=90, sentido antihorario como ax.pie
+        for i, (wedge, autotext) in enumerate(zip(self.wedges, self.autotexts)):
+            if i >= len(valid_sizes):
+                wedge.set_visible(False); autotext.set_visible(False); continue
+            span = 360.0 * valid_sizes[i] / total
+            wedge.set_theta1(theta); wedge.set_theta2(theta + span)
+            wedge.set_facecolor(colors[i % len(colors)]); wedge.set_visible(True)
+            middle = math.radians(theta + span / 2)
+            autotext.set_position((0.80 * math.cos(middle), 0.80 * math.sin(middle))) # pctdistance=0.80
+            autotext.set_text(f"{100.0 * valid_sizes[i] / total:1.1f}%"); autotext.set_visible(True)
+            theta += span
+        self.title.set_text(title)
+        self.empty_text.set_visible(not valid_sizes)
+        if self.legend is not None: self.legend.remove(); self.legend = None
+        if valid_sizes:
+            legend_labels_with_actual_percent = [f'{l} ({s/total*100:.1f}%)' for l, s in zip(valid_labels, valid_sizes)]
+            self.legend = self.ax.legend(self.wedges[:len(valid_sizes)], legend_labels_with_actual_percent,
+                                         title="Categorías", **self.legend_kwargs)
+
+
+class _PieTemplate:
+    """
+    Figura preparada una sola vez (Figure + canvas Agg, sin pyplot) con uno o varios paneles de
+    pastel en posiciones fijas; en cada render solo se actualizan los datos de los paneles. El lock
+    serializa los renders sobre la misma figura.
+    """
+
+    def __init__(self, panel_count: int = 1):
+        self.lock = threading.Lock()
+        if panel_count == 1:
+            self.fig = Figure(figsize=(7, 5), dpi=config.CHART_DPI)
+            # Posición fija equivalente a la de tight_layout(rect=[0, 0, 0.8, 1]); la leyenda ocupa el margen derecho
+            self.panels = [_PiePanel(self.fig.add_axes([0.02, 0.02, 0.6, 0.86]),
+                                     dict(loc="center left", bbox_to_anchor=(1, 0, 0.5, 1), fontsize=9), title_size=14)]
+            self.suptitle = None
+        else:
+            # Paneles lado a lado con la leyenda debajo de cada uno y un título común arriba
+            self.fig = Figure(figsize=(5 * panel_count, 6), dpi=config.CHART_DPI)
+            width = 1.0 / panel_count
+            self.panels = [_PiePanel(self.fig.add_axes([i * width + 0.1 * width, 0.3, 0.8 * width, 0.5]),
+                                     dict(loc="upper center", bbox_to_anchor=(0.5, -0.02), fontsize=9), title_size=12)
+                           for i in range(panel_count)]
+            self.suptitle = self.fig.suptitle("", fontsize=15, fontweight="bold")
+        self.canvas = FigureCanvasAgg(self.fig)
+
+    def render(self, panels_data: list, title: str = None) -> bytes:
+        with self.lock:
+            for panel, (p_labels, p_sizes, p_title, p_colors) in zip(self.panels, panels_data):
+                panel.update(p_labels, p_sizes, p_title, p_colors)
+            if self.suptitle is not None: self.suptitle.set_text(title or "")
+            return encode_canvas(self.canvas)
+
+
+_DEFAULT_COLORS = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
+_templates = {} # (kind, paneles) -> _PieTemplate (uno por proceso; en el pool cada worker tiene los suyos)
+_templates_lock = threading.Lock()
+
+def _get_template(kind: str, panel_count: int = 1) -> _PieTemplate:
+    with _templates_lock:
+        template = _templates.get((kind, panel_count))
+        if template is None: template = _templates[(kind, panel_count)] = _PieTemplate(panel_count)
+        return template
+
+def render_pie_png(kind: str, valid_labels: list, valid_sizes: list, title: str, effective_colors: list = None) -> bytes:
+    """Dibuja la gráfica de pastel sobre la plantilla de `kind` y devuelve el PNG. Corre en un worker de chart_renderer."""
+    return _get_template(kind).render([(valid_labels, valid_sizes, title, effective_colors)])
+
+def render_multi_pie_png(kind: str, prepared_panels: list, title: str) -> bytes:
+    """prepared_panels: [(título, labels, sizes, colors)] ya filtrados. Una figura con un panel por elemento."""
+    panels_data = [(p_labels, p_sizes, p_title, p_colors) for p_title, p_labels, p_sizes, p_colors in prepared_panels]
+    return _get_template(kind, len(panels_data)).render(panels_data, title)
+
+
+class _XYTemplate:
+    """Plantilla de línea o barras por día/semana (tendencias); ejes y estilo se preparan una sola vez."""
+
+    def __init__(self, chart_type: str):
+        self.lock = threading.Lock()
+        self.chart_type = chart_type
+        self.fig = Figure(figsize=(8, 4.5), dpi=config.CHART_DPI)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_axes([0.09, 0.16, 0.88, 0.72])
+        self.ax.grid(axis="y", alpha=0.3)
+        for side in ("top", "right"): self.ax.spines[side].set_visible(False)
+        self.title = self.ax.set_title("", fontsize=14, fontweight="bold", pad=14)
+        self.line = self.ax.plot([], [], marker="o", markersize=3, linewidth=2)[0] if chart_type == "line" else None
+        self.bars = None
+
+    def render(self, labels: list, values: list, title: str, ylabel: str, color: str, y_max: float = None) -> bytes:
+        x = np.arange(len(values)); y = np.asarray(values, dtype=np.float64)
+        with self.lock:
+            if self.line is not None:
+                self.line.set_data(x, y); self.line.set_color(color) # NaN = día sin datos: corta la línea
+            else:
+                if self.bars is not None: self.bars.remove()
+                self.bars = self.ax.bar(x, np.nan_to_num(y), width=0.7, color=color)
+            finite = y[np.isfinite(y)]
+            top = y_max if y_max else (finite.max() * 1.15 if finite.size and finite.max() > 0 else 1.0)
+            self.ax.set_xlim(-0.6, len(values) - 0.4); self.ax.set_ylim(0, top)
+            step = max(1, math.ceil(len(labels) / 8)) # Como mucho ~8 etiquetas en el eje X
+            self.ax.set_xticks(x[::step]); self.ax.set_xticklabels(labels[::step], fontsize=8)
+            self.ax.set_ylabel(ylabel)
+            self.title.set_text(title)
+            return encode_canvas(self.canvas)
+
+
+_xy_templates = {} # chart_type -> _XYTemplate
+
+def render_xy_png(chart_type: str, labels: list, values: list, title: str, ylabel: str, color: str, y_max: float = None) -> bytes:
+    """Dibuja una tendencia ('line' o 'bar') y devuelve el PNG. Corre en un worker de chart_renderer."""
+    with _templates_lock:
+        template = _xy_templates.get(chart_type)
+        if template is None: template = _xy_templates[chart_type] = _XYTemplate(chart_type)
+    return template.render(labels, values, title, ylabel, color, y_max)
+
+
+def warm_up_worker():
+    """Initializer de los workers: importa matplotlib y prepara todas las plantillas."""
+    for kind in ("discipline", "finance"):
+        render_pie_png(kind, ["warm-up"], [1.0], "")
+    render_multi_pie_png("wellbeing", [("", ["warm-up"], [1.0], None), ("", [], [], None)], "")
+    for chart_type in ("bar", "line"):
+        render_xy_png(chart_type, ["warm-up"], [1.0], "", "", COLOR_TREND)
@@ -4,21 +4,64 @@ import psycopg2
 import psycopg2.extras 
 import config 
 from datetime import datetime, timedelta, date, time as time_obj
-import pytz 
+import pytz
 import logging
+import threading
+import time as time_module
+import atexit
+from collections import Counter
+
+from .db_pool import ConnectionPool
+from . import migrations
 
 logger = logging.getLogger(__name__)
 
 LIMA_TZ = pytz.timezone('America/Lima')
 
-# --- MANEJO DE CONEXIÓN ---
+# --- MANEJO DE CONEXIÓN (POOL COMPARTIDO) ---
+_pool: ConnectionPool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    config.DATABASE_URL,
+                    min_size=config.DB_POOL_MIN_SIZE, max_size=config.DB_POOL_MAX_SIZE,
+                    timeout=config.DB_POOL_TIMEOUT_SECONDS,
+                    health_check_interval=config.DB_POOL_HEALTHCHECK_SECONDS,
+                    max_idle_time=config.DB_POOL_MAX_IDLE_SECONDS
+                )
+                logger.info(f"DATABASE: Pool de conexiones creado (min={config.DB_POOL_MIN_SIZE}, max={config.DB_POOL_MAX_SIZE}).")
+    return _pool
+
 def get_db_connection():
+    """Toma una conexión del pool. Debe devolverse siempre con release_db_connection()."""
     try:
-        conn = psycopg2.connect(config.DATABASE_URL)
-        return conn
+        return _get_pool().getconn()
     except psycopg2.Error as e:
-        logger.error(f"DATABASE: Error al conectar a PostgreSQL: {e}")
-        raise 
+        logger.error(f"DATABASE: Error al obtener conexión del pool: {e}")
+        raise
+
+def release_db_connection(conn):
+    """Devuelve la conexión al pool (deshaciendo cualquier transacción pendiente)."""
+    if conn is None: return
+    try:
+        _get_pool().putconn(conn)
+    except Exception as e:
+        logger.error(f"DATABASE: Error devolviendo conexión al pool: {e}")
+
+def get_pool_stats() -> dict:
+    """Métricas del pool: tamaño, en uso, misses, esperas y tiempos de espera."""
+    return _pool.stats() if _pool is not None else {}
+
+def close_db_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall(); _pool = None
 
 # --- INICIALIZACIÓN DE LA BASE DE DATOS ---
 def initialize_database():
@@ -34,13 +77,14 @@ def initialize_database():
         conn = get_db_connection(); cur = conn.cursor()
         for command in commands: cur.execute(command)
         conn.commit()
+        migrations.apply_migrations(conn) # Índices y cambios de esquema versionados
     except psycopg2.Error as e:
-        logger.error(f"DATABASE: Error creando tablas: {e}")
+        logger.error(f"DATABASE: Error creando tablas o aplicando migraciones: {e}")
         if conn and not conn.closed: conn.rollback()
         raise 
     finally:
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
 # --- FUNCIONES DE USUARIO ---
 def get_user_data(user_id: int):
@@ -53,63 +97,159 @@ def get_user_data(user_id: int):
         logger.error(f"DATABASE: Error get_user_data({user_id}): {e}"); return None
     finally:
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
-def create_or_update_user(user_id: int, data: dict):
+def create_or_update_user(user_id: int, data: dict) -> bool:
     conn = None; cur = None
     sql = """INSERT INTO rumbify_users (user_id, trial_start_date, trial_active, has_permanent_access, last_seen) VALUES (%(user_id)s, %(trial_start_date)s, %(trial_active)s, %(has_permanent_access)s, %(last_seen)s) ON CONFLICT (user_id) DO UPDATE SET trial_start_date = EXCLUDED.trial_start_date, trial_active = EXCLUDED.trial_active, has_permanent_access = EXCLUDED.has_permanent_access, last_seen = EXCLUDED.last_seen;"""
     params = {'user_id': user_id, 'trial_start_date': data.get('trial_start_date'), 'trial_active': data.get('trial_active', True), 'has_permanent_access': data.get('has_permanent_access', False), 'last_seen': data.get('last_seen')}
     try:
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute(sql, params); conn.commit()
+        cur.execute(sql, params); conn.commit(); return True
     except psycopg2.Error as e: 
         logger.error(f"DATABASE: Error en C_O_U_user para {user_id}: {e}")
         if conn and not conn.closed: conn.rollback()
+        return False
     finally: 
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
 def add_permanent_access(user_id: int):
     user_data = get_user_data(user_id)
     now_lima_iso = datetime.now(LIMA_TZ).isoformat()
     data_to_save = {"trial_start_date": user_data['trial_start_date'] if user_data else None, "trial_active": False, "has_permanent_access": True, "last_seen": now_lima_iso}
-    create_or_update_user(user_id, data_to_save); return True
+    create_or_update_user(user_id, data_to_save); invalidate_user_access(user_id); return True
 
 def remove_permanent_access(user_id: int):
     user_data = get_user_data(user_id)
     if user_data:
         update_data = dict(user_data); update_data["has_permanent_access"] = False; update_data["last_seen"] = datetime.now(LIMA_TZ).isoformat()
-        create_or_update_user(user_id, update_data); return True
+        create_or_update_user(user_id, update_data); invalidate_user_access(user_id); return True
+    invalidate_user_access(user_id)
     return False
 
+# --- CACHÉ DE DECISIONES DE ACCESO Y last_seen DIFERIDO ---
+# Cada usuario se lee de la BD como mucho una vez por TTL; la expiración de la prueba se calcula
+# con el trial_start_date cacheado. last_seen se acumula en memoria y se escribe en bloque.
+_access_cache = {} # user_id -> (user_data dict, expira_en monotonic)
+_access_cache_lock = threading.Lock()
+_pending_last_seen = {} # user_id -> datetime del último acceso aún no escrito
+_pending_last_seen_lock = threading.Lock()
+_access_stats = {"hits": 0, "misses": 0, "invalidations": 0, "last_seen_flushes": 0, "last_seen_rows": 0}
+
+def _get_cached_user_data(user_id: int):
+    with _access_cache_lock:
+        entry = _access_cache.get(user_id)
+        if entry and entry[1] > time_module.monotonic():
+            _access_stats["hits"] += 1; return entry[0]
+        if entry: del _access_cache[user_id]
+        _access_stats["misses"] += 1
+        return None
+
+def _cache_user_data(user_id: int, user_data: dict):
+    with _access_cache_lock:
+        _access_cache.pop(user_id, None)
+        _access_cache[user_id] = (user_data, time_module.monotonic() + config.ACCESS_CACHE_TTL_SECONDS)
+        if len(_access_cache) > config.ACCESS_CACHE_MAX_ENTRIES:
+            now = time_module.monotonic()
+            for uid in [uid for uid, (_, exp) in _access_cache.items() if exp <= now]: del _access_cache[uid]
+            while len(_access_cache) > config.ACCESS_CACHE_MAX_ENTRIES:
+                del _access_cache[next(iter(_access_cache))] # Las más antiguas primero (orden de inserción)
+
+def invalidate_user_access(user_id: int):
+    """Descarta la decisión cacheada de un usuario (p. ej. tras cambiar su acceso permanente)."""
+    with _access_cache_lock:
+        _access_cache.pop(user_id, None); _access_stats["invalidations"] += 1
+
+def _touch_last_seen(user_id: int, seen_at: datetime):
+    with _pending_last_seen_lock: _pending_last_seen[user_id] = seen_at
+
+def flush_last_seen_updates() -> int:
+    """Escribe todos los last_seen pendientes con un único UPDATE. Devuelve las filas enviadas."""
+    with _pending_last_seen_lock:
+        if not _pending_last_seen: return 0
+        batch = dict(_pending_last_seen); _pending_last_seen.clear()
+    conn = None; cur = None
+    sql = "UPDATE rumbify_users AS u SET last_seen = v.last_seen FROM (VALUES %s) AS v(user_id, last_seen) WHERE u.user_id = v.user_id AND (u.last_seen IS NULL OR u.last_seen < v.last_seen)"
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        psycopg2.extras.execute_values(cur, sql, list(batch.items()), template="(%s::BIGINT, %s::TIMESTAMPTZ)", page_size=1000); conn.commit()
+        with _access_cache_lock:
+            _access_stats["last_seen_flushes"] += 1; _access_stats["last_seen_rows"] += len(batch)
+        return len(batch)
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error flush_last_seen_updates ({len(batch)} usuarios): {e}")
+        if conn and not conn.closed: conn.rollback()
+        with _pending_last_seen_lock: # Reencolar sin pisar accesos más recientes
+            for uid, seen_at in batch.items():
+                if uid not in _pending_last_seen or _pending_last_seen[uid] < seen_at: _pending_last_seen[uid] = seen_at
+        return 0
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def _last_seen_flusher_loop():
+    while True:
+        time_module.sleep(config.LAST_SEEN_FLUSH_INTERVAL_SECONDS)
+        try: flush_last_seen_updates()
+        except Exception as e: logger.error(f"DATABASE: Error en el hilo de last_seen: {e}")
+
+def start_last_seen_flusher():
+    threading.Thread(target=_last_seen_flusher_loop, name="last-seen-flusher", daemon=True).start()
+    atexit.register(flush_last_seen_updates)
+    logger.info(f"DATABASE: Flush de last_seen cada {config.LAST_SEEN_FLUSH_INTERVAL_SECONDS}s iniciado.")
+
+def get_access_cache_stats() -> dict:
+    with _access_cache_lock: snapshot = dict(_access_stats); snapshot["cached_users"] = len(_access_cache)
+    with _pending_last_seen_lock: snapshot["pending_last_seen"] = len(_pending_last_seen)
+    return snapshot
+
 def check_user_access(user_id: int) -> tuple[bool, str]:
-    user_data = get_user_data(user_id); current_time_lima = datetime.now(LIMA_TZ)
-    if not user_data:
-        trial_start_iso = current_time_lima.isoformat()
-        new_user_data = {"trial_start_date": trial_start_iso, "trial_active": True, "has_permanent_access": False, "last_seen": trial_start_iso}
-        create_or_update_user(user_id, new_user_data); return True, "Trial started"
-    update_last_seen_data = dict(user_data); update_last_seen_data["last_seen"] = current_time_lima.isoformat()
-    create_or_update_user(user_id, update_last_seen_data)
+    current_time_lima = datetime.now(LIMA_TZ)
+    user_data = _get_cached_user_data(user_id)
+    if user_data is None:
+        user_row = get_user_data(user_id)
+        if not user_row:
+            new_user_data = {"trial_start_date": current_time_lima, "trial_active": True, "has_permanent_access": False, "last_seen": current_time_lima}
+            # Solo se cachea si el INSERT entró: si falló, la próxima petición vuelve a intentarlo
+            if create_or_update_user(user_id, new_user_data): _cache_user_data(user_id, new_user_data)
+            return True, "Trial started"
+        user_data = dict(user_row); _cache_user_data(user_id, user_data)
+    _touch_last_seen(user_id, current_time_lima)
     if user_data.get("has_permanent_access"): return True, "Permanent access"
     if user_data.get("trial_active") and user_data.get("trial_start_date"):
         trial_start_date_db = user_data["trial_start_date"]
         if current_time_lima < trial_start_date_db + timedelta(days=3): return True, "Trial active"
         else:
-            expired_data = dict(user_data); expired_data["trial_active"] = False
-            create_or_update_user(user_id, expired_data); return False, config.MSG_CONTACT_FOR_FULL_ACCESS
+            expired_data = dict(user_data); expired_data["trial_active"] = False; expired_data["last_seen"] = current_time_lima
+            if create_or_update_user(user_id, expired_data): _cache_user_data(user_id, expired_data)
+            return False, config.MSG_CONTACT_FOR_FULL_ACCESS
     return False, config.MSG_CONTACT_FOR_FULL_ACCESS
 
 # --- FUNCIONES DE PLANIFICACIÓN ---
+def reminder_scheduled_at(item_date: date, reminder_time: time_obj) -> datetime:
+    """Momento absoluto (hora de Lima) en que debe dispararse un recordatorio HH:MM de item_date."""
+    return LIMA_TZ.localize(datetime.combine(item_date, time_obj(reminder_time.hour, reminder_time.minute)))
+
+def _schedule_new_reminders(reminders: list):
+    """Empuja recordatorios recién guardados al scheduler en memoria (sin esperar a la siguiente recarga)."""
+    from . import notifications # Importación local para evitar la importación circular
+    for item_id, user_id, text, scheduled_at in reminders:
+        notifications.schedule_reminder(item_id, user_id, text, scheduled_at)
+
 def save_planning_item(user_id: int, item_type: str, text: str, reminder_time: str = None):
     conn = None; cur = None
     today_date = datetime.now(LIMA_TZ).date(); rt_obj = None
     if reminder_time:
         try: rt_obj = datetime.strptime(reminder_time, "%H:%M").time()
         except ValueError: logger.warning(f"DATABASE: Formato reminder_time inválido '{reminder_time}'")
-    sql = "INSERT INTO planning_items (user_id, item_date, item_type, text, reminder_time, completed, notification_sent) VALUES (%s, %s, %s, %s, %s, NULL, %s) RETURNING item_id;"
+    scheduled_at = reminder_scheduled_at(today_date, rt_obj) if rt_obj else None
+    sql = "INSERT INTO planning_items (user_id, item_date, item_type, text, reminder_time, scheduled_at, completed, notification_sent) VALUES (%s, %s, %s, %s, %s, %s, NULL, %s) RETURNING item_id;"
     try:
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute(sql, (user_id, today_date, item_type, text, rt_obj, False if rt_obj else None)); item_id = cur.fetchone()[0]; conn.commit(); return item_id
+        cur.execute(sql, (user_id, today_date, item_type, text, rt_obj, scheduled_at, False if rt_obj else None)); item_id = cur.fetchone()[0]; conn.commit()
+        if rt_obj: _schedule_new_reminders([(item_id, user_id, text, scheduled_at)])
+        return item_id
     except psycopg2.Error as e: # <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< LÍNEA 194 CORREGIDA
         logger.error(f"DATABASE: Error save_planning_item: {e}")
         if conn and not conn.closed: 
@@ -117,11 +257,39 @@ def save_planning_item(user_id: int, item_type: str, text: str, reminder_time: s
         return None
     finally: 
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
+
+def save_planning_items(user_id: int, item_type: str, texts: list, reminder_time: str = None) -> list:
+    """
+    Guarda varias tareas del mismo tipo con un único INSERT multi-fila dentro de una sola
+    transacción (todo o nada). Devuelve los item_id en el mismo orden que `texts` ([] si falla).
+    """
+    if not texts: return []
+    conn = None; cur = None
+    today_date = datetime.now(LIMA_TZ).date(); rt_obj = None
+    if reminder_time:
+        try: rt_obj = datetime.strptime(reminder_time, "%H:%M").time()
+        except ValueError: logger.warning(f"DATABASE: Formato reminder_time inválido '{reminder_time}'")
+    scheduled_at = reminder_scheduled_at(today_date, rt_obj) if rt_obj else None
+    sql = "INSERT INTO planning_items (user_id, item_date, item_type, text, reminder_time, scheduled_at, completed, notification_sent) VALUES %s RETURNING item_id"
+    rows = [(user_id, today_date, item_type, text, rt_obj, scheduled_at, False if rt_obj else None) for text in texts]
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        returned = psycopg2.extras.execute_values(cur, sql, rows, template="(%s, %s, %s, %s, %s, %s, NULL, %s)", page_size=len(rows), fetch=True)
+        conn.commit(); item_ids = [row[0] for row in returned]
+        if rt_obj: _schedule_new_reminders([(item_id, user_id, text, scheduled_at) for item_id, text in zip(item_ids, texts)])
+        return item_ids
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error save_planning_items ({len(rows)} items): {e}")
+        if conn and not conn.closed: conn.rollback()
+        return []
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
 
 def get_daily_planning_items(user_id: int, date_obj: date):
     conn = None; cur = None
-    sql = "SELECT item_id AS key, item_type AS type, text, reminder_time, completed, marked_at FROM planning_items WHERE user_id = %s AND item_date = %s ORDER BY created_at"
+    sql = "SELECT item_id AS key, item_type AS type, text, reminder_time, completed, marked_at FROM planning_items WHERE user_id = %s AND item_date = %s ORDER BY created_at, item_id"
     try:
         conn = get_db_connection(); cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         cur.execute(sql, (user_id, date_obj)); return cur.fetchall()
@@ -129,25 +297,27 @@ def get_daily_planning_items(user_id: int, date_obj: date):
         logger.error(f"DATABASE: Error get_daily_planning_items({user_id}, {date_obj}): {e}"); return []
     finally: 
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
-def update_planning_item_status(item_id: int, completed_status: bool):
+def update_planning_item_status(item_id: int, completed_status: bool) -> bool:
     conn = None; cur = None
     sql = "UPDATE planning_items SET completed = %s, marked_at = %s WHERE item_id = %s"
     try: 
         conn = get_db_connection(); cur = conn.cursor()
         cur.execute(sql, (completed_status, datetime.now(LIMA_TZ), item_id)); conn.commit()
+        return cur.rowcount > 0
     except psycopg2.Error as e: 
         logger.error(f"DATABASE: Error update_planning_item_status ({item_id}): {e}")
         if conn and not conn.closed: conn.rollback()
+        return False
     finally: 
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
 def get_pending_reminders():
     conn = None; cur = None
     today_date = datetime.now(LIMA_TZ).date()
-    sql = "SELECT item_id AS key, user_id, text, reminder_time FROM planning_items WHERE item_date = %s AND reminder_time IS NOT NULL AND notification_sent = FALSE"
+    sql = "SELECT item_id AS key, user_id, text, reminder_time, scheduled_at FROM planning_items WHERE item_date = %s AND reminder_time IS NOT NULL AND notification_sent = FALSE AND expired_at IS NULL"
     try:
         conn = get_db_connection(); cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         cur.execute(sql, (today_date,)); return cur.fetchall()
@@ -155,7 +325,7 @@ def get_pending_reminders():
         logger.error(f"DATABASE: Error get_pending_reminders: {e}"); return []
     finally: 
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
 def mark_reminder_sent(item_id: int):
     conn = None; cur = None
@@ -168,88 +338,229 @@ def mark_reminder_sent(item_id: int):
         if conn and not conn.closed: conn.rollback()
     finally: 
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
+
+def claim_due_reminders(worker_id: str, lease_seconds: float, max_attempts: int, item_ids: list = None,
+                        due_until: datetime = None, due_from: datetime = None, limit: int = 100) -> list:
+    """
+    Reclama de forma atómica recordatorios pendientes para `worker_id` (UPDATE ... RETURNING sobre
+    filas bloqueadas con FOR UPDATE SKIP LOCKED). Solo se devuelven las filas sin reclamar o con el
+    lease vencido, así varias instancias pueden repartir los envíos sin duplicados ni lock global.
+    Cada reclamo cuenta como un intento. Con item_ids se reclaman esos ítems; si no, los que tengan
+    scheduled_at entre due_from y due_until.
+    """
+    conn = None; cur = None
+    conditions = ["notification_sent = FALSE", "expired_at IS NULL", "scheduled_at IS NOT NULL",
+                  "attempts < %(max_attempts)s", "(claim_expires_at IS NULL OR claim_expires_at < NOW())"]
+    params = {'worker_id': worker_id, 'lease_seconds': lease_seconds, 'max_attempts': max_attempts, 'limit': limit}
+    if item_ids is not None:
+        conditions.append("item_id = ANY(%(item_ids)s)"); params['item_ids'] = list(item_ids)
+    else:
+        conditions.append("scheduled_at <= %(due_until)s"); params['due_until'] = due_until or datetime.now(LIMA_TZ)
+        if due_from is not None: conditions.append("scheduled_at >= %(due_from)s"); params['due_from'] = due_from
+    sql = f"""UPDATE planning_items p SET claimed_by = %(worker_id)s, claim_expires_at = NOW() + make_interval(secs => %(lease_seconds)s),
+                     attempts = p.attempts + 1
+              WHERE p.item_id IN (SELECT item_id FROM planning_items WHERE {' AND '.join(conditions)}
+                                  ORDER BY scheduled_at LIMIT %(limit)s FOR UPDATE SKIP LOCKED)
+              RETURNING p.item_id AS key, p.user_id, p.text, p.scheduled_at, p.attempts"""
+    try:
+        conn = get_db_connection(); cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(sql, params); claimed = cur.fetchall(); conn.commit(); return claimed
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error claim_due_reminders ({worker_id}): {e}")
+        if conn and not conn.closed: conn.rollback()
+        return []
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
 
-def cleanup_old_unmarked_tasks():
+def expire_overdue_reminders(older_than: datetime, reason: str, limit: int = 500) -> int:
+    """Marca como expirados (sin enviar) hasta `limit` recordatorios pendientes programados antes de older_than."""
     conn = None; cur = None
-    cutoff = datetime.now(LIMA_TZ) - timedelta(days=1)
-    sql = "DELETE FROM planning_items WHERE completed IS NULL AND created_at < %s"
+    sql = """UPDATE planning_items p SET expired_at = NOW(), last_error = %(reason)s, claimed_by = NULL, claim_expires_at = NULL
+             WHERE p.item_id IN (SELECT item_id FROM planning_items
+                                 WHERE notification_sent = FALSE AND expired_at IS NULL AND scheduled_at < %(older_than)s
+                                   AND (claim_expires_at IS NULL OR claim_expires_at < NOW())
+                                 ORDER BY scheduled_at LIMIT %(limit)s FOR UPDATE SKIP LOCKED)"""
     try:
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute(sql, (cutoff,)); deleted = cur.rowcount; conn.commit()
-        if deleted > 0: logger.info(f"DATABASE: Limpieza: {deleted} tareas planeadas antiguas no marcadas eliminadas.")
-    except psycopg2.Error as e: 
-        logger.error(f"DATABASE: Error cleanup_old_unmarked_tasks: {e}")
+        cur.execute(sql, {'older_than': older_than, 'reason': reason, 'limit': limit}); expired = cur.rowcount; conn.commit()
+        return expired
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error expire_overdue_reminders: {e}")
         if conn and not conn.closed: conn.rollback()
-    finally: 
+        return 0
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def record_reminder_failure(item_id: int, error: str, max_attempts: int):
+    """Guarda el error de un envío fallido y libera el reclamo; si agotó los intentos, lo expira."""
+    conn = None; cur = None
+    sql = """UPDATE planning_items SET last_error = %(error)s, claimed_by = NULL, claim_expires_at = NULL,
+                    expired_at = CASE WHEN attempts >= %(max_attempts)s THEN NOW() ELSE expired_at END
+             WHERE item_id = %(item_id)s AND notification_sent = FALSE"""
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, {'item_id': item_id, 'error': (error or '')[:500], 'max_attempts': max_attempts}); conn.commit()
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error record_reminder_failure ({item_id}): {e}")
+        if conn and not conn.closed: conn.rollback()
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def mark_reminders_sent(item_ids: list) -> bool:
+    """Marca varios recordatorios como enviados con un único UPDATE."""
+    if not item_ids: return True
+    conn = None; cur = None
+    sql = "UPDATE planning_items SET notification_sent = TRUE, last_error = NULL WHERE item_id = ANY(%s)"
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, (list(item_ids),)); conn.commit(); return True
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error mark_reminders_sent ({len(item_ids)} items): {e}")
+        if conn and not conn.closed: conn.rollback()
+        return False
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+# --- RETENCIÓN ---
+def delete_rows_chunk(table: str, key_column: str, where_sql: str, params: dict, limit: int) -> int:
+    """
+    Borra como máximo `limit` filas de `table` que cumplan where_sql, seleccionándolas por un índice
+    y saltando las bloqueadas (SKIP LOCKED) para no esperar a transacciones de usuarios.
+    table/key_column/where_sql son constantes internas de utils/retention.py, nunca entrada de usuario.
+    """
+    conn = None; cur = None
+    sql = f"""DELETE FROM {table} WHERE {key_column} = ANY(ARRAY(
+                  SELECT {key_column} FROM {table} WHERE {where_sql} LIMIT %(chunk_limit)s FOR UPDATE SKIP LOCKED))"""
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, dict(params, chunk_limit=limit)); deleted = cur.rowcount; conn.commit()
+        return deleted
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error delete_rows_chunk ({table}): {e}")
+        if conn and not conn.closed: conn.rollback()
+        return 0
+    finally:
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
 # --- FUNCIONES DE BIENESTAR ---
+def _diff_wellbeing_sub_items(existing: list, data_list: list) -> tuple:
+    """
+    Compara los sub-ítems guardados [(sub_item_id, text)] con la nueva lista de textos.
+    Los textos se tratan como multiconjunto: cada fila existente con un texto aún pedido se conserva.
+    Devuelve (ids a borrar, textos a insertar en el orden de data_list).
+    """
+    wanted = Counter(data_list); delete_ids = []
+    for sub_item_id, text in existing:
+        if wanted[text] > 0: wanted[text] -= 1
+        else: delete_ids.append(sub_item_id)
+    texts_to_insert = []
+    for text in data_list:
+        if wanted[text] > 0: texts_to_insert.append(text); wanted[text] -= 1
+    return delete_ids, texts_to_insert
+
 def save_wellbeing_items_list(user_id: int, item_type: str, data_list: list, date_obj: date = None):
+    """
+    Guarda la lista de sub-ítems del documento del día como un merge: solo inserta los textos
+    nuevos y borra los eliminados. Las filas que no cambian conservan completed/marked_at.
+    """
     if date_obj is None: date_obj = datetime.now(LIMA_TZ).date()
     conn = None; cur = None; doc_id = None
     try:
         conn = get_db_connection(); cur = conn.cursor()
+        # El upsert bloquea la fila del documento y serializa guardados concurrentes del mismo doc
         cur.execute("INSERT INTO wellbeing_docs (user_id, item_date, item_type, updated_at) VALUES (%s, %s, %s, %s) ON CONFLICT (user_id, item_date, item_type) DO UPDATE SET updated_at = EXCLUDED.updated_at RETURNING doc_id", (user_id, date_obj, item_type, datetime.now(LIMA_TZ))); doc_id = cur.fetchone()[0]
-        cur.execute("DELETE FROM wellbeing_sub_items WHERE doc_id = %s", (doc_id,))
-        if doc_id and data_list:
-            sub_item_sql = "INSERT INTO wellbeing_sub_items (doc_id, text) VALUES (%s, %s)"
-            sub_items_to_insert = [(doc_id, text_item) for text_item in data_list]
-            cur.executemany(sub_item_sql, sub_items_to_insert)
-        conn.commit(); return doc_id
+        cur.execute("SELECT sub_item_id, text FROM wellbeing_sub_items WHERE doc_id = %s ORDER BY sub_item_id", (doc_id,))
+        delete_ids, texts_to_insert = _diff_wellbeing_sub_items(cur.fetchall(), data_list or [])
+        if delete_ids:
+            cur.execute("DELETE FROM wellbeing_sub_items WHERE sub_item_id = ANY(%s)", (delete_ids,))
+        if texts_to_insert:
+            psycopg2.extras.execute_values(cur, "INSERT INTO wellbeing_sub_items (doc_id, text) VALUES %s",
+                                           [(doc_id, text_item) for text_item in texts_to_insert], page_size=len(texts_to_insert))
+        conn.commit()
+        logger.debug(f"DATABASE: save_wellbeing_items_list doc {doc_id}: +{len(texts_to_insert)} / -{len(delete_ids)}")
+        return doc_id
     except psycopg2.Error as e: 
         logger.error(f"DATABASE: Error save_wellbeing_items_list (type: {item_type}): {e}")
         if conn and not conn.closed: conn.rollback()
         return None
     finally:
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
-def get_daily_wellbeing_doc_and_sub_items(user_id: int, item_type: str, date_obj: date = None):
+def get_daily_wellbeing_docs(user_id: int, date_obj: date = None, item_types: list = None) -> dict:
+    """
+    Devuelve todos los documentos de bienestar del usuario para el día, con sus sub-ítems,
+    agrupados por tipo: {item_type: {"key", "items", "type", "date"}}. Una sola consulta (JOIN).
+    Los tipos sin documento no aparecen en el resultado.
+    """
     if date_obj is None: date_obj = datetime.now(LIMA_TZ).date()
-    conn = None; cur = None; doc_id_result = None
+    conn = None; cur = None
+    conditions = "d.user_id = %(user_id)s AND d.item_date = %(date_obj)s"
+    params = {'user_id': user_id, 'date_obj': date_obj}
+    if item_types: conditions += " AND d.item_type = ANY(%(item_types)s)"; params['item_types'] = list(item_types)
+    sql = f"""SELECT d.doc_id, d.item_type, s.sub_item_id, s.text, s.completed, s.marked_at
+              FROM wellbeing_docs d LEFT JOIN wellbeing_sub_items s ON s.doc_id = d.doc_id
+              WHERE {conditions} ORDER BY d.item_type, s.sub_item_id"""
     try:
-        conn = get_db_connection(); cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT doc_id FROM wellbeing_docs WHERE user_id = %s AND item_date = %s AND item_type = %s", (user_id, date_obj, item_type)); doc_row = cur.fetchone()
-        if not doc_row: return None
-        doc_id_result = doc_row['doc_id']
-        cur.execute("SELECT sub_item_id AS key, text, completed, marked_at FROM wellbeing_sub_items WHERE doc_id = %s ORDER BY sub_item_id", (doc_id_result,)); sub_items = cur.fetchall()
-        return {"key": doc_id_result, "items": sub_items, "type": item_type, "date": date_obj}
-    except psycopg2.Error as e: 
-        logger.error(f"DATABASE: Error get_daily_wellbeing_doc_and_sub_items: {e}"); return None
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, params); docs = {}
+        for doc_id, item_type, sub_item_id, text, completed, marked_at in cur.fetchall():
+            doc = docs.setdefault(item_type, {"key": doc_id, "items": [], "type": item_type, "date": date_obj})
+            if sub_item_id is not None: # LEFT JOIN: documento sin sub-ítems
+                doc["items"].append({"key": sub_item_id, "text": text, "completed": completed, "marked_at": marked_at})
+        return docs
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error get_daily_wellbeing_docs({user_id}, {date_obj}): {e}"); return {}
     finally:
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
-def update_wellbeing_sub_item_status(sub_item_id: int, completed_status: bool):
+def get_daily_wellbeing_doc_and_sub_items(user_id: int, item_type: str, date_obj: date = None):
+    return get_daily_wellbeing_docs(user_id, date_obj, [item_type]).get(item_type)
+
+def update_wellbeing_sub_item_status(sub_item_id: int, completed_status: bool) -> bool:
     conn = None; cur = None
     sql = "UPDATE wellbeing_sub_items SET completed = %s, marked_at = %s WHERE sub_item_id = %s"
     try: 
         conn = get_db_connection(); cur = conn.cursor()
         cur.execute(sql, (completed_status, datetime.now(LIMA_TZ), sub_item_id)); conn.commit()
+        return cur.rowcount > 0
     except psycopg2.Error as e: 
         logger.error(f"DATABASE: Error update_wellbeing_sub_item_status ({sub_item_id}): {e}")
         if conn and not conn.closed: conn.rollback()
+        return False
     finally: 
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
 # --- FUNCIONES DE FINANZAS ---
 def save_finance_transaction(user_id: int, trans_type: str, amount: float, description: str = None, date_obj: date = None):
     if date_obj is None: date_obj = datetime.now(LIMA_TZ).date()
     month_str = date_obj.strftime("%Y-%m"); conn = None; cur = None
-    sql = "INSERT INTO finance_transactions (user_id, transaction_type, amount, description, transaction_date, transaction_month) VALUES (%s, %s, %s, %s, %s, %s) RETURNING transaction_id;"
+    sql = "INSERT INTO finance_transactions (user_id, transaction_type, amount, description, transaction_date, transaction_month) VALUES (%s, %s, %s, %s, %s, %s) RETURNING transaction_id, amount;"
+    # El rollup mensual se actualiza en la misma transacción que el movimiento
+    rollup_sql = """INSERT INTO finance_monthly_rollup AS r (user_id, transaction_month, transaction_type, total_amount, tx_count, updated_at)
+                    VALUES (%s, %s, %s, %s, 1, %s)
+                    ON CONFLICT (user_id, transaction_month, transaction_type)
+                    DO UPDATE SET total_amount = r.total_amount + EXCLUDED.total_amount, tx_count = r.tx_count + 1, updated_at = EXCLUDED.updated_at"""
     try:
         conn = get_db_connection(); cur = conn.cursor()
-        cur.execute(sql, (user_id, trans_type, amount, description, date_obj, month_str)); trans_id = cur.fetchone()[0]; conn.commit(); return trans_id
+        cur.execute(sql, (user_id, trans_type, amount, description, date_obj, month_str)); trans_id, stored_amount = cur.fetchone()
+        cur.execute(rollup_sql, (user_id, month_str, trans_type, stored_amount, datetime.now(LIMA_TZ)))
+        conn.commit(); return trans_id
     except psycopg2.Error as e: 
         logger.error(f"DATABASE: Error save_finance_transaction: {e}")
         if conn and not conn.closed: conn.rollback()
         return None
     finally:
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
+        release_db_connection(conn)
 
 def get_finance_transactions(user_id: int, month_str: str = None, day_obj: date = None, trans_type: str = None):
     conn = None; cur = None
@@ -265,4 +576,169 @@ def get_finance_transactions(user_id: int, month_str: str = None, day_obj: date
         logger.error(f"DATABASE: Error get_finance_transactions: {e}"); return []
     finally:
         if cur and not cur.closed: cur.close()
-        if conn and not conn.closed: conn.close()
\ No newline at end of file
+        release_db_connection(conn)
+
+FINANCE_EXPENSE_TYPES = ('expense_fixed', 'expense_variable')
+
+def get_finance_month_totals(user_id: int, month_str: str) -> dict:
+    """Totales del mes por tipo de transacción, leídos del rollup mensual (O(1) por usuario)."""
+    conn = None; cur = None
+    sql = "SELECT transaction_type, total_amount FROM finance_monthly_rollup WHERE user_id = %s AND transaction_month = %s"
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, (user_id, month_str))
+        return {trans_type: float(total) for trans_type, total in cur.fetchall()}
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error get_finance_month_totals({user_id}, {month_str}): {e}"); return {}
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def get_finance_summary(user_id: int, month_str: str, day_obj: date) -> dict:
+    """
+    Totales del mes por tipo de transacción (del rollup mensual), gastos del mes hasta day_obj
+    y gastos de day_obj, en una sola consulta. day_obj debe pertenecer a month_str.
+    Solo se leen las filas de finance_transactions con fecha >= day_obj (normalmente, las de hoy).
+    """
+    conn = None; cur = None
+    summary = {"month_totals": {}, "expenses_month_to_date": 0.0, "expenses_today": 0.0}
+    sql = """WITH day_exp AS (
+                 SELECT COALESCE(SUM(amount) FILTER (WHERE transaction_date = %(day_obj)s), 0) AS day_total,
+                        COALESCE(SUM(amount) FILTER (WHERE transaction_date > %(day_obj)s), 0) AS after_day_total
+                 FROM finance_transactions
+                 WHERE user_id = %(user_id)s AND transaction_date >= %(day_obj)s AND transaction_month = %(month_str)s
+                   AND transaction_type IN %(expense_types)s)
+             SELECT r.transaction_type, r.total_amount, d.day_total, d.after_day_total
+             FROM day_exp d LEFT JOIN finance_monthly_rollup r ON r.user_id = %(user_id)s AND r.transaction_month = %(month_str)s"""
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, {'user_id': user_id, 'month_str': month_str, 'day_obj': day_obj, 'expense_types': FINANCE_EXPENSE_TYPES})
+        after_day_total = 0.0
+        for trans_type, month_total, day_total, after_total in cur.fetchall():
+            summary["expenses_today"] = float(day_total); after_day_total = float(after_total)
+            if trans_type is None: continue # Sin rollup para el mes: la fila solo trae los gastos del día
+            summary["month_totals"][trans_type] = float(month_total)
+        month_expenses = sum(summary["month_totals"].get(t, 0.0) for t in FINANCE_EXPENSE_TYPES)
+        summary["expenses_month_to_date"] = month_expenses - after_day_total
+        return summary
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error get_finance_summary({user_id}, {month_str}): {e}"); return summary
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def verify_finance_rollups(rebuild: bool = False) -> dict:
+    """
+    Recalcula los rollups desde finance_transactions y devuelve las diferencias encontradas.
+    Con rebuild=True reescribe finance_monthly_rollup completo en una transacción (bloqueando
+    brevemente las actualizaciones concurrentes del rollup para no perder movimientos).
+    """
+    conn = None; cur = None
+    drift_sql = """WITH actual AS (
+                       SELECT user_id, transaction_month, transaction_type, SUM(amount) AS total_amount, COUNT(*) AS tx_count
+                       FROM finance_transactions GROUP BY user_id, transaction_month, transaction_type)
+                   SELECT user_id, transaction_month, transaction_type, a.total_amount, a.tx_count, r.total_amount, r.tx_count
+                   FROM actual a FULL OUTER JOIN finance_monthly_rollup r USING (user_id, transaction_month, transaction_type)
+                   WHERE a.total_amount IS DISTINCT FROM r.total_amount OR a.tx_count IS DISTINCT FROM r.tx_count
+                   ORDER BY user_id, transaction_month, transaction_type"""
+    result = {"drift": [], "rebuilt": False}
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        if rebuild: cur.execute("LOCK TABLE finance_monthly_rollup IN SHARE ROW EXCLUSIVE MODE")
+        cur.execute(drift_sql)
+        result["drift"] = [
+            {"user_id": u, "month": m, "type": t, "expected_total": float(a_tot or 0), "expected_count": a_cnt or 0,
+             "rollup_total": float(r_tot or 0), "rollup_count": r_cnt or 0}
+            for u, m, t, a_tot, a_cnt, r_tot, r_cnt in cur.fetchall()
+        ]
+        if rebuild:
+            cur.execute("DELETE FROM finance_monthly_rollup")
+            cur.execute("""INSERT INTO finance_monthly_rollup (user_id, transaction_month, transaction_type, total_amount, tx_count, updated_at)
+                           SELECT user_id, transaction_month, transaction_type, SUM(amount), COUNT(*), %s
+                           FROM finance_transactions GROUP BY user_id, transaction_month, transaction_type""", (datetime.now(LIMA_TZ),))
+            result["rebuilt"] = True
+        conn.commit()
+        if result["drift"]: logger.warning(f"DATABASE: {len(result['drift'])} rollups financieros con diferencias (rebuild={rebuild}).")
+        return result
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error verify_finance_rollups(rebuild={rebuild}): {e}")
+        if conn and not conn.closed: conn.rollback()
+        return None
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+# --- SERIES HISTÓRICAS (columnas compactas para utils/trends.py) ---
+def _fetch_day_offset_columns(sql: str, params: tuple, label: str) -> list:
+    """Ejecuta una consulta que devuelve (desplazamiento en días, valor numérico) y entrega las tuplas sin DictRow."""
+    conn = None; cur = None
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, params)
+        return cur.fetchall()
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error {label}: {e}"); return []
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def get_planning_marks_range(user_id: int, start_date: date, end_date: date) -> list:
+    """[(día desde start_date, completed 0/1)] de las tareas marcadas en el rango (idx_planning_user_date)."""
+    sql = """SELECT item_date - %s, COALESCE(completed::int, 0) FROM planning_items
+             WHERE user_id = %s AND item_date BETWEEN %s AND %s AND marked_at IS NOT NULL"""
+    return _fetch_day_offset_columns(sql, (start_date, user_id, start_date, end_date), f"get_planning_marks_range({user_id})")
+
+def get_wellbeing_marks_range(user_id: int, item_type: str, start_date: date, end_date: date) -> list:
+    """[(día desde start_date, completed 0/1)] de los sub-ítems marcados de item_type en el rango."""
+    sql = """SELECT d.item_date - %s, COALESCE(s.completed::int, 0) FROM wellbeing_docs d JOIN wellbeing_sub_items s ON s.doc_id = d.doc_id
+             WHERE d.user_id = %s AND d.item_type = %s AND d.item_date BETWEEN %s AND %s AND s.marked_at IS NOT NULL"""
+    return _fetch_day_offset_columns(sql, (start_date, user_id, item_type, start_date, end_date), f"get_wellbeing_marks_range({user_id}, {item_type})")
+
+def get_expense_amounts_range(user_id: int, start_date: date, end_date: date) -> list:
+    """[(día desde start_date, monto)] de los gastos del rango (idx_finance_user_date)."""
+    sql = """SELECT transaction_date - %s, amount::float8 FROM finance_transactions
+             WHERE user_id = %s AND transaction_date BETWEEN %s AND %s AND transaction_type = ANY(%s)"""
+    return _fetch_day_offset_columns(sql, (start_date, user_id, start_date, end_date, list(FINANCE_EXPENSE_TYPES)),
+                                     f"get_expense_amounts_range({user_id})")
+
+# --- REGISTRO DE MEDIOS (file_id de Telegram) ---
+def get_media_file(media_key: str):
+    conn = None; cur = None
+    try:
+        conn = get_db_connection(); cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute("SELECT media_key, media_type, file_id, file_unique_id, fingerprint FROM media_files WHERE media_key = %s", (media_key,))
+        return cur.fetchone()
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error get_media_file({media_key}): {e}"); return None
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def save_media_file(media_key: str, media_type: str, file_id: str, file_unique_id: str = None, fingerprint: str = None):
+    conn = None; cur = None
+    sql = """INSERT INTO media_files (media_key, media_type, file_id, file_unique_id, fingerprint, updated_at) VALUES (%s, %s, %s, %s, %s, %s)
+             ON CONFLICT (media_key) DO UPDATE SET media_type = EXCLUDED.media_type, file_id = EXCLUDED.file_id,
+             file_unique_id = EXCLUDED.file_unique_id, fingerprint = EXCLUDED.fingerprint, updated_at = EXCLUDED.updated_at"""
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute(sql, (media_key, media_type, file_id, file_unique_id, fingerprint, datetime.now(LIMA_TZ))); conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error save_media_file({media_key}): {e}")
+        if conn and not conn.closed: conn.rollback()
+        return False
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
+
+def delete_media_file(media_key: str):
+    conn = None; cur = None
+    try:
+        conn = get_db_connection(); cur = conn.cursor()
+        cur.execute("DELETE FROM media_files WHERE media_key = %s", (media_key,)); conn.commit()
+    except psycopg2.Error as e:
+        logger.error(f"DATABASE: Error delete_media_file({media_key}): {e}")
+        if conn and not conn.closed: conn.rollback()
+    finally:
+        if cur and not cur.closed: cur.close()
+        release_db_connection(conn)
@@ -0,0 +1,89 @@
+# utils/day_views.py
+# Vista del día (plan y bienestar) cacheada en memoria por (usuario, fecha, vista). La primera vez se lee
+# de la BD; después, marcar un ítem es solo el UPDATE más el cambio del ítem cacheado en su sitio, y el
+# mensaje se vuelve a dibujar desde la caché sin ninguna lectura. Guardar ítems nuevos invalida al usuario.
+# DAY_VIEW_CACHE_TTL_SECONDS acota cuánto puede quedar desfasada una vista si la BD cambia por otra vía.
+
+import time
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+import logging
+
+import config
+from . import database as db_utils
+
+logger = logging.getLogger(__name__)
+
+_cache = OrderedDict() # (user_id, fecha, vista) -> (ítems, expira_en monotonic); vista: "planning" o el item_type de bienestar
+_cache_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "marks": 0, "invalidations": 0}
+
+def _get(key: tuple):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[1] > time.monotonic():
+            _cache.move_to_end(key); _stats["hits"] += 1; return entry[0]
+        if entry: del _cache[key]
+        _stats["misses"] += 1
+        return None
+
+def _put(key: tuple, items: list):
+    if config.DAY_VIEW_CACHE_MAX_ENTRIES <= 0: return
+    with _cache_lock:
+        _cache[key] = (items, time.monotonic() + config.DAY_VIEW_CACHE_TTL_SECONDS); _cache.move_to_end(key)
+        while len(_cache) > config.DAY_VIEW_CACHE_MAX_ENTRIES: _cache.popitem(last=False) # LRU
+
+def _apply_mark(key: tuple, item_key: int, completed: bool) -> bool:
+    """Actualiza el ítem cacheado en su sitio. False si la vista no está en caché o el ítem no aparece."""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if not entry: return False
+        for item in entry[0]:
+            if item["key"] == item_key:
+                item["completed"] = completed; item["marked_at"] = datetime.now(db_utils.LIMA_TZ)
+                _stats["marks"] += 1; return True
+        del _cache[key] # Ítem desconocido: la vista ya no refleja la BD
+        return False
+
+def get_planning_items(user_id: int, date_obj: date) -> list:
+    """Tareas del día como lista de dicts (mismas claves que get_daily_planning_items)."""
+    key = (user_id, date_obj, "planning")
+    items = _get(key)
+    if items is None:
+        items = [dict(item_dr) for item_dr in db_utils.get_daily_planning_items(user_id, date_obj)]
+        _put(key, items)
+    return items
+
+def get_wellbeing_items(user_id: int, date_obj: date, item_type: str) -> list:
+    """Sub-ítems del documento de bienestar del día ([] si no hay documento)."""
+    key = (user_id, date_obj, item_type)
+    items = _get(key)
+    if items is None:
+        doc = db_utils.get_daily_wellbeing_docs(user_id, date_obj, [item_type]).get(item_type)
+        items = doc["items"] if doc else []
+        _put(key, items)
+    return items
+
+def mark_planning_item(user_id: int, date_obj: date, item_id: int, completed: bool) -> bool:
+    """Escribe la marca en la BD y, si tuvo éxito, la aplica a la vista cacheada."""
+    if not db_utils.update_planning_item_status(item_id, completed):
+        invalidate(user_id); return False
+    _apply_mark((user_id, date_obj, "planning"), item_id, completed)
+    return True
+
+def mark_wellbeing_sub_item(user_id: int, date_obj: date, item_type: str, sub_item_id: int, completed: bool) -> bool:
+    if not db_utils.update_wellbeing_sub_item_status(sub_item_id, completed):
+        invalidate(user_id); return False
+    _apply_mark((user_id, date_obj, item_type), sub_item_id, completed)
+    return True
+
+def invalidate(user_id: int):
+    """Descarta todas las vistas cacheadas del usuario (tras guardar ítems nuevos)."""
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == user_id]: del _cache[key]
+        _stats["invalidations"] += 1
+
+def get_day_view_stats() -> dict:
+    with _cache_lock:
+        return dict(_stats, entries=len(_cache))
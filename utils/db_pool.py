@@ -0,0 +1,177 @@
+# utils/db_pool.py
+# Pool de conexiones PostgreSQL compartido por todas las funciones de utils/database.py.
+# Es thread-safe: lo usan a la vez los hilos del dispatcher de PTB y el hilo de notificaciones.
+
+import threading
+import time
+from collections import deque
+import logging
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones con tamaño mínimo/máximo, health check al hacer checkout
+    y descarte de conexiones muertas. Si el pool está lleno, el checkout espera
+    hasta `timeout` segundos a que se libere una conexión y luego lanza PoolError.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10, timeout: float = 10.0,
+                 health_check_interval: float = 30.0, max_idle_time: float = 600.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Tamaños de pool inválidos: min={min_size}, max={max_size}")
+        self._dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_idle_time = max_idle_time
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque() # (conn, momento en que se devolvió al pool)
+        self._in_use = set() # ids de las conexiones prestadas
+        self._size = 0 # conexiones abiertas (idle + en uso + en apertura)
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0, "misses": 0, "waits": 0, "timeouts": 0,
+            "wait_time_total": 0.0, "wait_time_max": 0.0,
+            "health_checks": 0, "dead_discarded": 0, "connect_errors": 0,
+        }
+
+        for _ in range(min_size):
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                break # El pool se irá llenando bajo demanda
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    # --- Conexiones ---
+    def _connect(self):
+        try:
+            return psycopg2.connect(self._dsn)
+        except psycopg2.Error as e:
+            with self._cond: self._stats["connect_errors"] += 1
+            logger.error(f"DB_POOL: Error al conectar a PostgreSQL: {e}")
+            raise
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            if not conn.closed: conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        """Comprueba una conexión antes de prestarla. Solo hace round-trip si lleva tiempo ociosa."""
+        if conn.closed: return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE: return False
+        if time.monotonic() - idle_since < self.health_check_interval: return True
+        with self._cond: self._stats["health_checks"] += 1
+        try:
+            with conn.cursor() as cur: cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Toma una conexión del pool (o abre una nueva si hay hueco)."""
+        wait_start = None
+        while True:
+            conn = None; idle_since = None; must_open = False
+            with self._cond:
+                if self._closed: raise PoolError("El pool de conexiones está cerrado")
+                while not self._idle and self._size >= self.max_size:
+                    if wait_start is None:
+                        wait_start = time.monotonic(); self._stats["waits"] += 1
+                    remaining = self.timeout - (time.monotonic() - wait_start)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolError(f"Pool agotado: sin conexión libre tras {self.timeout}s (max={self.max_size})")
+                    self._cond.wait(remaining)
+                    if self._closed: raise PoolError("El pool de conexiones está cerrado")
+                if self._idle:
+                    conn, idle_since = self._idle.pop() # LIFO: la más reciente, probablemente viva
+                else:
+                    self._size += 1; must_open = True; self._stats["misses"] += 1
+
+            if must_open:
+                try:
+                    conn = self._connect()
+                except psycopg2.Error:
+                    with self._cond:
+                        self._size -= 1; self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                logger.warning("DB_POOL: Conexión muerta o inválida descartada en checkout.")
+                self._close_quietly(conn)
+                with self._cond:
+                    self._size -= 1; self._stats["dead_discarded"] += 1; self._cond.notify()
+                continue
+
+            with self._cond:
+                self._in_use.add(id(conn)); self._stats["checkouts"] += 1
+                if wait_start is not None:
+                    waited = time.monotonic() - wait_start
+                    self._stats["wait_time_total"] += waited
+                    self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+            return conn
+
+    def putconn(self, conn, close: bool = False):
+        """Devuelve una conexión al pool. Deshace cualquier transacción abierta antes de guardarla."""
+        if conn is None: return
+        broken = close or conn.closed
+        if not broken:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        with self._cond:
+            if id(conn) not in self._in_use:
+                logger.warning("DB_POOL: putconn de una conexión que no pertenece al pool; se cierra.")
+                self._close_quietly(conn)
+                return
+            self._in_use.discard(id(conn))
+            now = time.monotonic()
+            if broken or self._closed:
+                self._size -= 1
+                if broken and not close: self._stats["dead_discarded"] += 1
+            else:
+                self._idle.append((conn, now))
+                self._trim_idle(now)
+            self._cond.notify()
+        if broken or self._closed: self._close_quietly(conn)
+
+    def _trim_idle(self, now: float):
+        """Cierra conexiones ociosas por encima de min_size que llevan demasiado tiempo sin usarse (con lock)."""
+        while self._size > self.min_size and self._idle and now - self._idle[0][1] > self.max_idle_time:
+            old_conn, _ = self._idle.popleft(); self._size -= 1
+            self._close_quietly(old_conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft(); self._size -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+    # --- Métricas ---
+    def stats(self) -> dict:
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot.update({
+                "size": self._size, "in_use": len(self._in_use), "idle": len(self._idle),
+                "min_size": self.min_size, "max_size": self.max_size,
+            })
+        snapshot["wait_time_avg"] = (snapshot["wait_time_total"] / snapshot["waits"]) if snapshot["waits"] else 0.0
+        return snapshot
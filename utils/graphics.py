@@ -1,89 +1,86 @@
 # utils/graphics.py
-# ESTE ARCHIVO PERMANECE IGUAL QUE EN LA VERSIÓN DE DETA
-# (El que te proporcioné en el Mensaje 3 de X de la tanda anterior, que usa Matplotlib)
+# API de gráficas para los handlers: prepara los datos, consulta la caché y pide el render al pool.
+# Este módulo no importa matplotlib (el arranque no lo paga): el dibujo vive en utils/chart_templates.py
+# y se carga en los workers de render, o en la primera gráfica si se renderiza en línea.
 
-import matplotlib
-matplotlib.use('Agg') 
-import matplotlib.pyplot as plt
 import io
 import logging
 
+from . import chart_cache
+from . import chart_renderer
+
 logger = logging.getLogger(__name__)
 
 COLORS_DISCIPLINE = ['#66BB6A', '#EF5350'] 
 COLORS_FINANCE = ['#42A5F5', '#FFA726', '#FFEE58', '#EF5350', '#AB47BC'] 
 COLORS_WELLBEING = ['#26A69A', '#FF7043', '#78909C'] 
+COLOR_TREND = '#42A5F5'
 
-def generate_pie_chart(labels: list, sizes: list, title: str, colors: list = None) -> io.BytesIO:
-    # ... (código idéntico al proporcionado anteriormente para Matplotlib) ...
-    # Asegúrate de que plt.close(fig) esté presente al final o en caso de error.
+def _prepare_pie_data(labels: list, sizes: list, title: str, colors: list = None):
+    """Filtra las categorías en cero y ajusta los colores. Devuelve (labels, sizes, colors) o None si no hay datos."""
     if not labels or not sizes or len(labels) != len(sizes):
         logger.error("Datos inválidos para generar gráfica de pastel: etiquetas o tamaños vacíos/diferentes longitudes.")
         return None
     
     valid_labels = [label for i, label in enumerate(labels) if sizes[i] > 0]
-    valid_sizes = [size for size in sizes if size > 0]
+    valid_sizes = [float(size) for size in sizes if size > 0]
     
     if not valid_labels: 
         logger.info(f"No hay datos para graficar para '{title}'. Todos los valores son cero.")
         return None
 
-    if colors and len(colors) < len(valid_labels):
-        effective_colors = (colors * (len(valid_labels) // len(colors) + 1))[:len(valid_labels)]
-    elif colors:
-        effective_colors = colors[:len(valid_labels)]
+    if colors: # Cada color sigue a su categoría aunque otras queden en cero
+        cycled_colors = (colors * (len(labels) // len(colors) + 1))[:len(labels)]
+        effective_colors = [color for color, size in zip(cycled_colors, sizes) if size > 0]
     else:
         effective_colors = None 
+    return valid_labels, valid_sizes, effective_colors
+
+def _render_cached(cache_key: tuple, title: str, render_func_name: str, *args) -> io.BytesIO:
+    cached_png = chart_cache.get_chart(cache_key)
+    if cached_png is not None: # Mismos datos que una gráfica ya renderizada: sin matplotlib
+        return io.BytesIO(cached_png)
 
-    fig = None # Inicializar fig por si hay error antes de su asignación
-    try:
-        fig, ax = plt.subplots(figsize=(7, 5)) 
-        
-        wedges, texts, autotexts = ax.pie(
-            valid_sizes,
-            labels=None, 
-            autopct='%1.1f%%',
-            startangle=90,
-            colors=effective_colors,
-            pctdistance=0.80
-        )
-
-        for autotext in autotexts:
-            autotext.set_color('white') 
-            autotext.set_fontsize(10)
-            autotext.set_fontweight('bold')
-        
-        ax.axis('equal')  
-        
-        plt.title(title, fontsize=14, fontweight='bold', pad=20)
-
-        total = sum(valid_sizes)
-        legend_labels_with_actual_percent = [
-            f'{l} ({s/total*100:.1f}%)' for l, s in zip(valid_labels, valid_sizes) if total > 0 # Evitar división por cero
-        ] if total > 0 else valid_labels # Si total es 0, solo mostrar etiquetas
-
-        ax.legend(wedges, legend_labels_with_actual_percent,
-                  title="Categorías",
-                  loc="center left",
-                  bbox_to_anchor=(1, 0, 0.5, 1), 
-                  fontsize=9)
-
-        plt.tight_layout(rect=[0, 0, 0.8, 1]) 
-
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight') 
-        buf.seek(0)
-        
-        logger.info(f"Gráfica '{title}' generada exitosamente.")
-        return buf
-        
-    except Exception as e:
-        logger.error(f"Error generando gráfica de pastel '{title}': {e}")
+    # El render (CPU y GIL intensivo) corre en el pool de procesos; el handler solo recibe los bytes
+    png_bytes = chart_renderer.render(render_func_name, *args)
+    if png_bytes is None:
+        logger.error(f"Error generando gráfica '{title}'.")
         return None
-    finally:
-        if fig: # Asegurarse de que fig fue asignada antes de intentar cerrarla
-            plt.close(fig) # Muy importante para liberar memoria
+    chart_cache.put_chart(cache_key, png_bytes)
+    logger.info(f"Gráfica '{title}' generada exitosamente.")
+    return io.BytesIO(png_bytes)
+
+def generate_pie_chart(labels: list, sizes: list, title: str, colors: list = None, kind: str = "pie") -> io.BytesIO:
+    prepared = _prepare_pie_data(labels, sizes, title, colors)
+    if prepared is None: return None
+    valid_labels, valid_sizes, effective_colors = prepared
+    cache_key = chart_cache.make_key(kind, valid_labels, valid_sizes, effective_colors, title)
+    return _render_cached(cache_key, title, "render_pie_png", kind, valid_labels, valid_sizes, title, effective_colors)
+
+def generate_multi_pie_chart(panels: list, title: str, kind: str = "multi_pie") -> io.BytesIO:
+    """
+    Varias gráficas de pastel en una sola imagen (un render, una subida). panels es una lista de
+    dicts {"labels", "sizes", "title", "colors"}; un panel sin datos se dibuja como 'Sin datos'.
+    Devuelve None si ningún panel tiene datos.
+    """
+    prepared_panels = []
+    for panel in panels:
+        prepared = _prepare_pie_data(panel["labels"], panel["sizes"], panel["title"], panel.get("colors"))
+        prepared_panels.append((panel["title"],) + (prepared if prepared else ([], [], None)))
+    if not any(p_sizes for _, _, p_sizes, _ in prepared_panels):
+        return None
+    key_labels = [repr((p_title, p_labels, p_colors, len(p_sizes))) for p_title, p_labels, p_sizes, p_colors in prepared_panels]
+    key_sizes = [size for _, _, p_sizes, _ in prepared_panels for size in p_sizes]
+    cache_key = chart_cache.make_key(kind, key_labels, key_sizes, None, title)
+    return _render_cached(cache_key, title, "render_multi_pie_png", kind, prepared_panels, title)
+
+
+def generate_trend_chart(chart_type: str, labels: list, values, title: str, ylabel: str,
+                         color: str = COLOR_TREND, y_max: float = None) -> io.BytesIO:
+    """Gráfica de tendencia por día/semana. values admite NaN (sin datos ese día). Usa caché y pool como los pasteles."""
+    values = [float(v) for v in values] # Listas simples: se serializan al pool y a la clave de caché
+    cache_key = chart_cache.make_key(f"trend_{chart_type}", labels, values, [color], f"{title}|{ylabel}|{y_max}")
+    return _render_cached(cache_key, title, "render_xy_png", chart_type, labels, values, title, ylabel, color, y_max)
 
 
 def get_discipline_chart_image(completed_tasks: int, not_done_tasks: int) -> io.BytesIO:
@@ -92,7 +89,7 @@ def get_discipline_chart_image(completed_tasks: int, not_done_tasks: int) -> io.
     labels = ['Tareas Completadas', 'Tareas No Hechas']
     sizes = [completed_tasks, not_done_tasks]
     title = "📊 Gráfica de Disciplina Diaria"
-    return generate_pie_chart(labels, sizes, title, colors=COLORS_DISCIPLINE)
+    return generate_pie_chart(labels, sizes, title, colors=COLORS_DISCIPLINE, kind="discipline")
 
 def get_finance_chart_image(income_extra: float, expenses_variable: float, savings: float, expenses_fixed: float, income_total_bruto: float) -> io.BytesIO:
     if income_total_bruto <= 0:
@@ -124,36 +121,16 @@ def get_finance_chart_image(income_extra: float, expenses_variable: float, savin
         return None
 
     title = "💰 Distribución Financiera Mensual"
-    return generate_pie_chart(labels, sizes, title, colors=COLORS_FINANCE)
-
-
-def get_wellbeing_exercise_chart_image(completed_exercises: int, not_done_exercises: int) -> io.BytesIO:
-    if completed_exercises == 0 and not_done_exercises == 0:
-        return None
-    labels = ['Ejercicios Completados', 'Ejercicios No Completados']
-    sizes = [completed_exercises, not_done_exercises]
-    title = "💪 Gráfica de Ejercicio Diario"
-    return generate_pie_chart(labels, sizes, title, colors=COLORS_WELLBEING[:2])
-
-
-def get_wellbeing_diet_chart_image(diet_fulfilled: int, diet_not_fulfilled: int, extra_meals: int) -> io.BytesIO:
-    if diet_fulfilled == 0 and diet_not_fulfilled == 0 and extra_meals == 0:
-        return None
-    labels = []
-    sizes = []
-    
-    if diet_fulfilled > 0:
-        labels.append('Dieta Cumplida')
-        sizes.append(diet_fulfilled)
-    if diet_not_fulfilled > 0:
-        labels.append('Dieta No Cumplida')
-        sizes.append(diet_not_fulfilled)
-    if extra_meals > 0:
-        labels.append('Comidas Extra')
-        sizes.append(extra_meals)
-        
-    if not labels:
-        return None
-
-    title = "🍎 Gráfica de Alimentación Diaria"
-    return generate_pie_chart(labels, sizes, title, colors=COLORS_WELLBEING)
\ No newline at end of file
+    return generate_pie_chart(labels, sizes, title, colors=COLORS_FINANCE, kind="finance")
+
+
+def get_wellbeing_chart_image(completed_exercises: int, not_done_exercises: int,
+                              diet_fulfilled: int, diet_not_fulfilled: int, extra_meals: int) -> io.BytesIO:
+    """Ejercicio y alimentación del día en una sola imagen de dos paneles."""
+    panels = [
+        {"labels": ['Ejercicios Completados', 'Ejercicios No Completados'], "sizes": [completed_exercises, not_done_exercises],
+         "title": "Ejercicio", "colors": COLORS_WELLBEING[:2]},
+        {"labels": ['Dieta Cumplida', 'Dieta No Cumplida', 'Comidas Extra'], "sizes": [diet_fulfilled, diet_not_fulfilled, extra_meals],
+         "title": "Alimentación", "colors": COLORS_WELLBEING},
+    ]
+    return generate_multi_pie_chart(panels, "Bienestar Físico Diario", kind="wellbeing")
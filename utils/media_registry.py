@@ -0,0 +1,113 @@
+# utils/media_registry.py
+# Registro de medios estáticos (vídeos, imágenes, documentos de assets/): el primer envío sube el
+# archivo y guarda en la BD el file_id que devuelve Telegram; los siguientes reenvían por file_id sin
+# volver a subir el archivo. Si Telegram rechaza el id (error de file identifier), o el contenido del archivo local cambió (sha1),
+# se vuelve a subir y se actualiza el registro. El hash no depende del mtime, así que un despliegue
+# con un checkout nuevo conserva los file_id.
+
+import os
+import hashlib
+import threading
+import logging
+
+from telegram import Bot, Message
+from telegram.error import BadRequest
+
+from . import database as db_utils
+
+logger = logging.getLogger(__name__)
+
+# media_type -> (método de Bot, nombre del parámetro del archivo)
+_SENDERS = {
+    "video": ("send_video", "video"),
+    "photo": ("send_photo", "photo"),
+    "animation": ("send_animation", "animation"),
+    "document": ("send_document", "document"),
+    "audio": ("send_audio", "audio"),
+    "voice": ("send_voice", "voice"),
+}
+
+_file_ids = {} # media_key -> (file_id, fingerprint) ya leídos de la BD o subidos en este proceso
+_upload_locks = {} # media_key -> Lock: un solo upload a la vez por archivo
+_content_hashes = {} # path -> (tamaño, mtime_ns, fingerprint): el archivo se hashea una vez por proceso
+_lock = threading.Lock()
+_stats = {"sent_by_file_id": 0, "uploads": 0, "rejected_file_ids": 0}
+# Únicos BadRequest que invalidan el file_id; el resto (chat no encontrado, caption mal formado...) se propaga
+_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference expired")
+
+def _fingerprint(path: str):
+    """sha1 del contenido; solo se recalcula si el archivo cambia de tamaño o mtime en este proceso."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    with _lock: cached = _content_hashes.get(path)
+    if cached and cached[:2] == (st.st_size, st.st_mtime_ns): return cached[2]
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as media_file:
+            for block in iter(lambda: media_file.read(1024 * 1024), b""): digest.update(block)
+    except FileNotFoundError:
+        return None
+    fingerprint = f"sha1:{digest.hexdigest()}"
+    with _lock: _content_hashes[path] = (st.st_size, st.st_mtime_ns, fingerprint)
+    return fingerprint
+
+def _file_id_from_message(message: Message, media_type: str):
+    media = getattr(message, media_type, None)
+    if media_type == "photo" and media: media = media[-1] # La resolución más grande
+    return (media.file_id, media.file_unique_id) if media else (None, None)
+
+def _cached_file_id(media_key: str, fingerprint: str):
+    with _lock: cached = _file_ids.get(media_key)
+    if cached is None:
+        row = db_utils.get_media_file(media_key)
+        cached = (row["file_id"], row["fingerprint"]) if row else (None, None)
+        with _lock: _file_ids[media_key] = cached
+    file_id, stored_fingerprint = cached
+    # Sin archivo local (fingerprint None) se confía en el id guardado
+    if file_id and (fingerprint is None or fingerprint == stored_fingerprint): return file_id
+    return None
+
+def _forget(media_key: str):
+    with _lock: _file_ids[media_key] = (None, None)
+    db_utils.delete_media_file(media_key)
+
+def _upload(bot: Bot, chat_id: int, path: str, media_type: str, fingerprint: str, **kwargs) -> Message:
+    method, param = _SENDERS[media_type]
+    with open(path, 'rb') as media_file: # FileNotFoundError se propaga al handler
+        message = getattr(bot, method)(chat_id=chat_id, **{param: media_file}, **kwargs)
+    file_id, file_unique_id = _file_id_from_message(message, media_type)
+    with _lock: _stats["uploads"] += 1
+    if file_id:
+        with _lock: _file_ids[path] = (file_id, fingerprint)
+        db_utils.save_media_file(path, media_type, file_id, file_unique_id, fingerprint)
+        logger.info(f"MEDIA: '{path}' subido; file_id registrado para próximos envíos.")
+    return message
+
+def send_media(bot: Bot, chat_id: int, path: str, media_type: str = "document", **kwargs) -> Message:
+    """Envía el asset `path` reutilizando su file_id si ya se subió antes. kwargs van al send_* (caption, etc.)."""
+    method, param = _SENDERS[media_type]
+    fingerprint = _fingerprint(path)
+    file_id = _cached_file_id(path, fingerprint)
+    if file_id:
+        try:
+            message = getattr(bot, method)(chat_id=chat_id, **{param: file_id}, **kwargs)
+            with _lock: _stats["sent_by_file_id"] += 1
+            return message
+        except BadRequest as e: # file_id caducado o de otro bot: se sube de nuevo
+            if not any(error in str(e).lower() for error in _FILE_ID_ERRORS): raise
+            logger.warning(f"MEDIA: file_id de '{path}' rechazado ({e}); se vuelve a subir.")
+            with _lock: _stats["rejected_file_ids"] += 1
+            _forget(path)
+    with _lock: upload_lock = _upload_locks.setdefault(path, threading.Lock())
+    with upload_lock:
+        file_id = _cached_file_id(path, fingerprint) # Otro hilo pudo subirlo mientras esperábamos
+        if file_id:
+            message = getattr(bot, method)(chat_id=chat_id, **{param: file_id}, **kwargs)
+            with _lock: _stats["sent_by_file_id"] += 1
+            return message
+        return _upload(bot, chat_id, path, media_type, fingerprint, **kwargs)
+
+def get_media_stats() -> dict:
+    with _lock: return dict(_stats, registered=sum(1 for file_id, _ in _file_ids.values() if file_id))
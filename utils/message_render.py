@@ -0,0 +1,92 @@
+# utils/message_render.py
+# Capa fina para editar mensajes: recuerda un hash del último texto + teclado enviado a cada
+# (chat, message_id) y omite la llamada a la API si no cambió nada (botones "Volver", dobles toques).
+# Un "message is not modified" de Telegram también se trata como éxito, sin reenviar el mensaje.
+# Todas las ediciones de los handlers pasan por edit_message_text(); cualquier otra llamada que toque
+# el mensaje (teclado, borrado) pasa por este módulo y olvida su render. Cada render recordado caduca a
+# los RENDER_FINGERPRINT_TTL_SECONDS, y solo se omite la edición si el teclado que el callback trae de
+# Telegram es el que enviamos, así que un cambio hecho por otra instancia no deja una vista vieja.
+
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import logging
+
+from telegram.error import BadRequest
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_fingerprints = OrderedDict() # (chat_id, message_id) -> (hash del render, hash del teclado, expira_en monotonic)
+_lock = threading.Lock()
+_stats = {"edits": 0, "skipped": 0, "not_modified": 0, "stale": 0}
+
+def _markup_hash(reply_markup) -> str:
+    markup = json.dumps(reply_markup.to_dict(), sort_keys=True, ensure_ascii=False) if reply_markup else ""
+    return hashlib.sha1(markup.encode("utf-8")).hexdigest()
+
+def _fingerprint(text: str, markup_hash: str, parse_mode) -> str:
+    return hashlib.sha1(f"{parse_mode}\x00{text}\x00{markup_hash}".encode("utf-8")).hexdigest()
+
+def _remember(key: tuple, fingerprint: str, markup_hash: str):
+    with _lock:
+        _fingerprints[key] = (fingerprint, markup_hash, time.monotonic() + config.RENDER_FINGERPRINT_TTL_SECONDS)
+        _fingerprints.move_to_end(key)
+        while len(_fingerprints) > config.RENDER_FINGERPRINT_MAX_ENTRIES: _fingerprints.popitem(last=False)
+
+def _already_shown(key: tuple, fingerprint: str, message) -> bool:
+    with _lock:
+        entry = _fingerprints.get(key)
+        if entry is None or entry[0] != fingerprint: return False
+        # Caducado, o el teclado actual del mensaje no es el nuestro: alguien lo cambió por otra vía
+        if entry[2] <= time.monotonic() or _markup_hash(message.reply_markup) != entry[1]:
+            del _fingerprints[key]; _stats["stale"] += 1
+            return False
+        _fingerprints.move_to_end(key); _stats["skipped"] += 1
+        return True
+
+def _key(query):
+    message = query.message
+    return (message.chat_id, message.message_id) if message is not None else None
+
+def forget(chat_id: int, message_id: int):
+    """Olvida el render recordado de un mensaje (tras tocarlo fuera de edit_message_text)."""
+    with _lock: _fingerprints.pop((chat_id, message_id), None)
+
+def edit_message_text(query, text: str, reply_markup=None, parse_mode=None, **kwargs):
+    """Como query.edit_message_text, pero sin llamada a la API si el mensaje ya muestra este render."""
+    key = _key(query)
+    if key is None or config.RENDER_FINGERPRINT_MAX_ENTRIES <= 0: # Mensajes inline: sin (chat, message_id)
+        return query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode, **kwargs)
+    markup_hash = _markup_hash(reply_markup)
+    fingerprint = _fingerprint(text, markup_hash, parse_mode)
+    if _already_shown(key, fingerprint, query.message): return query.message
+    try:
+        result = query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode, **kwargs)
+    except BadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            forget(*key); raise
+        with _lock: _stats["not_modified"] += 1 # Ya mostraba esto (p.ej. editado antes de un reinicio)
+        result = query.message
+    else:
+        with _lock: _stats["edits"] += 1
+    _remember(key, fingerprint, markup_hash)
+    return result
+
+def edit_message_reply_markup(query, reply_markup=None, **kwargs):
+    """Cambia solo el teclado; el render recordado deja de ser válido."""
+    key = _key(query)
+    if key: forget(*key)
+    return query.edit_message_reply_markup(reply_markup=reply_markup, **kwargs)
+
+def delete_message(query, **kwargs):
+    key = _key(query)
+    if key: forget(*key)
+    return query.delete_message(**kwargs)
+
+def get_render_stats() -> dict:
+    with _lock:
+        return dict(_stats, tracked=len(_fingerprints))
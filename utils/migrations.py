@@ -0,0 +1,156 @@
+# utils/migrations.py
+# Migraciones versionadas del esquema. Las versiones aplicadas se registran en schema_migrations.
+#
+# Cada migración tiene:
+#   - statements: SQL idempotente (IF NOT EXISTS, etc.) que se ejecuta en una transacción.
+#   - concurrent_indexes: (nombre, CREATE INDEX CONCURRENTLY ...) que se construyen online,
+#     fuera de transacción, sin bloquear escrituras en las tablas de producción.
+# Para añadir una migración basta con agregar una nueva entrada al final de MIGRATIONS.
+
+import logging
+from collections import namedtuple
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple("Migration", ["version", "description", "statements", "concurrent_indexes"])
+
+# Clave arbitraria para pg_advisory_lock: evita que dos instancias migren a la vez
+MIGRATIONS_LOCK_KEY = 72815001
+
+MIGRATIONS = [
+    Migration(
+        1, "Índices para planificación, recordatorios, bienestar y finanzas",
+        [],
+        [
+            ("idx_planning_user_date",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_planning_user_date ON planning_items (user_id, item_date)"),
+            ("idx_planning_pending_reminders",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_planning_pending_reminders ON planning_items (item_date, reminder_time) "
+             "WHERE reminder_time IS NOT NULL AND notification_sent = FALSE"),
+            ("idx_planning_unmarked_created",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_planning_unmarked_created ON planning_items (created_at) WHERE completed IS NULL"),
+            ("idx_wb_sub_items_doc",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wb_sub_items_doc ON wellbeing_sub_items (doc_id)"),
+            ("idx_finance_user_month_type",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_finance_user_month_type ON finance_transactions (user_id, transaction_month, transaction_type)"),
+        ]
+    ),
+    Migration(
+        2, "Rollup mensual de finanzas por usuario/mes/tipo",
+        [
+            """CREATE TABLE IF NOT EXISTS finance_monthly_rollup (
+                   user_id BIGINT NOT NULL, transaction_month VARCHAR(7) NOT NULL, transaction_type VARCHAR(30) NOT NULL,
+                   total_amount NUMERIC(14, 2) NOT NULL DEFAULT 0, tx_count INTEGER NOT NULL DEFAULT 0, updated_at TIMESTAMPTZ,
+                   PRIMARY KEY (user_id, transaction_month, transaction_type))""",
+            """INSERT INTO finance_monthly_rollup (user_id, transaction_month, transaction_type, total_amount, tx_count, updated_at)
+               SELECT user_id, transaction_month, transaction_type, SUM(amount), COUNT(*), CURRENT_TIMESTAMP
+               FROM finance_transactions GROUP BY user_id, transaction_month, transaction_type
+               ON CONFLICT (user_id, transaction_month, transaction_type)
+               DO UPDATE SET total_amount = EXCLUDED.total_amount, tx_count = EXCLUDED.tx_count, updated_at = EXCLUDED.updated_at""",
+        ],
+        [
+            ("idx_finance_user_date",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_finance_user_date ON finance_transactions (user_id, transaction_date)"),
+        ]
+    ),
+    Migration(
+        3, "Reclamo de recordatorios con lease para varias instancias",
+        [
+            "ALTER TABLE planning_items ADD COLUMN IF NOT EXISTS claimed_by TEXT",
+            "ALTER TABLE planning_items ADD COLUMN IF NOT EXISTS claim_expires_at TIMESTAMPTZ",
+        ],
+        []
+    ),
+    Migration(
+        4, "Estado durable de recordatorios (scheduled_at, intentos, último error, expiración)",
+        [
+            "ALTER TABLE planning_items ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMPTZ",
+            "ALTER TABLE planning_items ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE planning_items ADD COLUMN IF NOT EXISTS last_error TEXT",
+            "ALTER TABLE planning_items ADD COLUMN IF NOT EXISTS expired_at TIMESTAMPTZ",
+            """UPDATE planning_items SET scheduled_at = (item_date + reminder_time) AT TIME ZONE 'America/Lima'
+               WHERE reminder_time IS NOT NULL AND scheduled_at IS NULL AND notification_sent = FALSE""",
+        ],
+        [
+            ("idx_planning_reminders_due",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_planning_reminders_due ON planning_items (scheduled_at) "
+             "WHERE notification_sent = FALSE AND expired_at IS NULL AND scheduled_at IS NOT NULL"),
+        ]
+    ),
+    Migration(
+        5, "Índices para los borrados por lotes de la retención",
+        [],
+        [
+            ("idx_planning_item_date",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_planning_item_date ON planning_items (item_date)"),
+            ("idx_wb_docs_item_date",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_wb_docs_item_date ON wellbeing_docs (item_date)"),
+            ("idx_finance_transaction_date",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_finance_transaction_date ON finance_transactions (transaction_date)"),
+            ("idx_finance_rollup_month",
+             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_finance_rollup_month ON finance_monthly_rollup (transaction_month)"),
+        ]
+    ),
+    Migration(
+        6, "Registro de file_id de Telegram para medios estáticos",
+        [
+            """CREATE TABLE IF NOT EXISTS media_files (
+                   media_key TEXT PRIMARY KEY, media_type VARCHAR(20) NOT NULL, file_id TEXT NOT NULL, file_unique_id TEXT,
+                   fingerprint TEXT, updated_at TIMESTAMPTZ)""",
+        ],
+        []
+    ),
+]
+
+
+def _applied_versions(cur) -> set:
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def _drop_invalid_index(cur, index_name: str):
+    """Un CREATE INDEX CONCURRENTLY interrumpido deja un índice INVALID que IF NOT EXISTS no repara."""
+    cur.execute("SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s", (index_name,))
+    row = cur.fetchone()
+    if row and not row[0]:
+        logger.warning(f"MIGRATIONS: Índice inválido '{index_name}' encontrado; se elimina para reconstruirlo.")
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+def apply_migrations(conn) -> list:
+    """
+    Aplica en orden las migraciones pendientes usando `conn` (que queda en modo
+    transaccional al terminar). Devuelve la lista de versiones aplicadas.
+    """
+    applied_now = []
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True # CREATE INDEX CONCURRENTLY no puede ir dentro de una transacción
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, description TEXT, applied_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP)")
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+        try:
+            done = _applied_versions(cur)
+            for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+                if migration.version in done: continue
+                logger.info(f"MIGRATIONS: Aplicando v{migration.version}: {migration.description}")
+                if migration.statements:
+                    cur.execute("BEGIN")
+                    try:
+                        for statement in migration.statements: cur.execute(statement)
+                        cur.execute("COMMIT")
+                    except psycopg2.Error:
+                        cur.execute("ROLLBACK"); raise
+                for index_name, index_sql in migration.concurrent_indexes:
+                    _drop_invalid_index(cur, index_name)
+                    cur.execute(index_sql)
+                cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s) ON CONFLICT (version) DO NOTHING",
+                            (migration.version, migration.description))
+                applied_now.append(migration.version)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+    finally:
+        cur.close()
+        conn.autocommit = previous_autocommit
+    if applied_now: logger.info(f"MIGRATIONS: Versiones aplicadas: {applied_now}")
+    return applied_now
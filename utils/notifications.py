@@ -1,82 +1,159 @@
 # utils/notifications.py
-# (Este código es el mismo que el del Mensaje 3 de X (Revisión Completa para Render)
-# que te di antes, ya que su lógica no cambia fundamentalmente).
+# Programador de recordatorios basado en un min-heap ordenado por hora de disparo (scheduled_at).
+# Los recordatorios pendientes del día se cargan al arrancar y en el cambio de día (hora de Lima);
+# save_planning_item empuja los nuevos directamente. El hilo duerme hasta el siguiente vencimiento.
+# Antes de enviar, cada recordatorio se reclama en la BD (SKIP LOCKED + lease), de modo que varias
+# instancias pueden correr a la vez sin enviar duplicados.
+# El estado es durable (scheduled_at, attempts, last_error, expired_at): al arrancar, y luego en un
+# barrido periódico, se entregan los recordatorios atrasados dentro del margen de gracia y se expiran
+# explícitamente los demás, siempre en lotes acotados.
 
+import heapq
+import os
+import socket
+import uuid
 import time
 import threading
-from datetime import datetime # No renombres time aquí, datetime.time es diferente
+from datetime import datetime, timedelta, time as time_obj
 import logging
 
 from telegram import Bot
 
+import config
 from . import database as db_utils
+from . import outbound
 
 logger = logging.getLogger(__name__)
 
-_bot_instance: Bot = None # Variable global para la instancia del bot
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+LATE_NOTE_AFTER_MINUTES = 2 # A partir de este retraso el mensaje indica la hora original
 
-def check_and_send_reminders():
-    if _bot_instance is None:
-        logger.warning("Instancia del bot no establecida para el programador de notificaciones.")
+_heap = [] # (scheduled_at, item_id, user_id, text)
+_scheduled_ids = set() # item_ids ya en el heap (o disparados) para el día cargado
+_loaded_day = None
+_cond = threading.Condition()
+
+def schedule_reminder(item_id: int, user_id: int, text: str, scheduled_at: datetime):
+    """Añade un recordatorio al heap si es del día cargado. Lo despierta si pasa a ser el próximo."""
+    if not all([item_id, user_id, scheduled_at]):
+        logger.warning(f"Datos incompletos para el recordatorio (item_id: {item_id})")
         return
+    scheduled_at = scheduled_at.astimezone(db_utils.LIMA_TZ)
+    with _cond:
+        if item_id in _scheduled_ids: return
+        if _loaded_day is not None and scheduled_at.date() != _loaded_day: return # Otro día: lo cargará la recarga
+        _scheduled_ids.add(item_id)
+        heapq.heappush(_heap, (scheduled_at, item_id, int(user_id), text or "Tu tarea programada"))
+        _cond.notify()
 
-    try:
-        pending_items_from_db = db_utils.get_pending_reminders()
-        now_lima = datetime.now(db_utils.LIMA_TZ)
-
-        for item_dictrow in pending_items_from_db:
-            item = dict(item_dictrow) # Convertir DictRow a dict
-            user_id_str = item.get("user_id") # user_id es BIGINT en BD, psycopg2 lo da como int o str
-            item_id = item.get("key") # 'key' es el alias de item_id
-            reminder_time_obj_db = item.get("reminder_time") # Objeto datetime.time de la BD
-            task_text = item.get("text", "Tu tarea programada")
-
-            if not all([user_id_str, item_id, reminder_time_obj_db]):
-                logger.warning(f"Datos incompletos para el recordatorio (item_id: {item_id}): {item}")
-                continue
-            
-            try:
-                user_id = int(user_id_str) # Convertir a int si es necesario
-                reminder_datetime_lima = now_lima.replace(
-                    hour=reminder_time_obj_db.hour, 
-                    minute=reminder_time_obj_db.minute, 
-                    second=0, 
-                    microsecond=0
-                )
-            except (AttributeError, ValueError) as e: 
-                logger.error(f"Error procesando datos del recordatorio (item_id {item_id}): {e}")
-                continue
-
-            time_difference_minutes = (now_lima - reminder_datetime_lima).total_seconds() / 60
-
-            if -1 < time_difference_minutes < 5: # Margen para el scheduler
-                try:
-                    logger.info(f"Enviando recordatorio a {user_id} para tarea ID {item_id}: {task_text}")
-                    _bot_instance.send_message(
-                        chat_id=user_id,
-                        text=f"🔔 ¡Recordatorio Rumbify! 🔔\n\nEs hora de: {task_text}"
-                    )
-                    db_utils.mark_reminder_sent(item_id) 
-                    logger.info(f"Recordatorio para item_id {item_id} enviado y marcado.")
-                except Exception as e:
-                    logger.error(f"Error enviando recordatorio para item_id {item_id} a {user_id}: {e}")
-    except Exception as e:
-        logger.error(f"Error crítico en check_and_send_reminders: {e}")
+def reload_day_reminders():
+    """Recarga desde la BD los recordatorios pendientes del día (solo al arrancar y al cambiar de día)."""
+    global _loaded_day
+    today = datetime.now(db_utils.LIMA_TZ).date()
+    with _cond: # Se limpia antes de leer: lo que se empuje mientras tanto queda deduplicado por item_id
+        _heap.clear(); _scheduled_ids.clear(); _loaded_day = today
+    pending_items_from_db = db_utils.get_pending_reminders()
+    for item_dictrow in pending_items_from_db:
+        item = dict(item_dictrow) # Convertir DictRow a dict
+        scheduled_at = item.get("scheduled_at")
+        if scheduled_at is None and item.get("reminder_time"):
+            scheduled_at = db_utils.reminder_scheduled_at(today, item["reminder_time"])
+        schedule_reminder(item.get("key"), item.get("user_id"), item.get("text"), scheduled_at)
+    logger.info(f"Recordatorios del {today} cargados en el scheduler: {len(_heap)}.")
+
+def _reminder_text(text: str, scheduled_at: datetime, now_lima: datetime) -> str:
+    message = f"🔔 ¡Recordatorio Rumbify! 🔔\n\nEs hora de: {text}"
+    if scheduled_at and (now_lima - scheduled_at) > timedelta(minutes=LATE_NOTE_AFTER_MINUTES):
+        message += f"\n\n⏰ (Recordatorio atrasado: estaba programado para las {scheduled_at.astimezone(db_utils.LIMA_TZ).strftime('%H:%M')})"
+    return message
+
+def _enqueue_claimed(claimed_rows: list, now_lima: datetime):
+    for row in claimed_rows:
+        item = dict(row)
+        logger.info(f"Encolando recordatorio a {item['user_id']} para tarea ID {item['key']} (intento {item['attempts']}): {item['text']}")
+        # El sender saliente limita la tasa, reintenta los 429 y marca los entregados por lotes
+        outbound.enqueue_message(int(item["user_id"]), _reminder_text(item["text"], item["scheduled_at"], now_lima),
+                                 item_id=item["key"], kind="reminder")
+
+def _send_due_reminders(due: list, now_lima: datetime):
+    """Reclama en la BD los recordatorios vencidos del heap y encola solo los que gane esta instancia."""
+    grace_cutoff = now_lima - timedelta(minutes=config.REMINDER_GRACE_MINUTES)
+    item_ids = [item_id for scheduled_at, item_id, _, _ in due if scheduled_at >= grace_cutoff]
+    if len(item_ids) < len(due):
+        logger.warning(f"{len(due) - len(item_ids)} recordatorio(s) del heap fuera del margen de gracia; los expirará el barrido.")
+    if not item_ids: return
+    claimed = db_utils.claim_due_reminders(WORKER_ID, config.REMINDER_CLAIM_LEASE_SECONDS, config.REMINDER_MAX_ATTEMPTS,
+                                           item_ids=item_ids, limit=len(item_ids))
+    if len(claimed) < len(item_ids):
+        logger.info(f"{len(item_ids) - len(claimed)} recordatorio(s) ya reclamados o enviados por otra instancia.")
+    _enqueue_claimed(claimed, now_lima)
+
+def catch_up_overdue_reminders(pause_between_batches: bool = True) -> dict:
+    """
+    Pasada de recuperación: expira los recordatorios vencidos hace más que el margen de gracia y
+    entrega los que aún están dentro del margen. Trabaja en lotes de REMINDER_CATCHUP_BATCH_SIZE
+    (con pausa entre lotes) para que una caída larga no provoque una estampida de envíos.
+    """
+    result = {"expired": 0, "delivered": 0}
+    now_lima = datetime.now(db_utils.LIMA_TZ)
+    grace_cutoff = now_lima - timedelta(minutes=config.REMINDER_GRACE_MINUTES)
+    batch_size = config.REMINDER_CATCHUP_BATCH_SIZE
+    reason = f"expired: más de {config.REMINDER_GRACE_MINUTES:g} min de retraso"
+    while True:
+        expired = db_utils.expire_overdue_reminders(grace_cutoff, reason, limit=batch_size)
+        result["expired"] += expired
+        if expired < batch_size: break
+        if pause_between_batches: time.sleep(config.REMINDER_CATCHUP_PAUSE_SECONDS)
+    while True:
+        claimed = db_utils.claim_due_reminders(WORKER_ID, config.REMINDER_CLAIM_LEASE_SECONDS, config.REMINDER_MAX_ATTEMPTS,
+                                               due_until=now_lima, due_from=grace_cutoff, limit=batch_size)
+        _enqueue_claimed(claimed, now_lima)
+        result["delivered"] += len(claimed)
+        if len(claimed) < batch_size: break
+        if pause_between_batches: time.sleep(config.REMINDER_CATCHUP_PAUSE_SECONDS)
+    if result["expired"] or result["delivered"]:
+        logger.info(f"Recuperación de recordatorios: {result['delivered']} encolados, {result['expired']} expirados.")
+    return result
+
+def _seconds_until_next_day(now_lima: datetime) -> float:
+    next_midnight = db_utils.LIMA_TZ.localize(datetime.combine(now_lima.date() + timedelta(days=1), time_obj(0, 0)))
+    return (next_midnight - now_lima).total_seconds()
 
 def notification_scheduler_loop():
-    logger.info("Notification scheduler loop_thread started (Render Final Review).")
+    logger.info("Notification scheduler loop_thread started (heap).")
+    try:
+        catch_up_overdue_reminders() # Recordatorios vencidos mientras el worker estaba caído
+    except Exception as e:
+        logger.error(f"Error en la recuperación inicial de recordatorios: {e}")
+    reload_day_reminders()
+    next_sweep = time.monotonic() + config.REMINDER_SWEEP_INTERVAL_SECONDS
     while True:
-        check_and_send_reminders()
         try:
-            db_utils.cleanup_old_unmarked_tasks() # Limpieza de tareas de planificación
-            # Podríamos añadir limpieza para wellbeing_docs/sub_items si es necesario
+            now_lima = datetime.now(db_utils.LIMA_TZ)
+            if now_lima.date() != _loaded_day:
+                reload_day_reminders(); continue
+
+            if time.monotonic() >= next_sweep:
+                # Barrido de respaldo: leases vencidos, instancias caídas, reintentos tras fallos
+                catch_up_overdue_reminders(pause_between_batches=False)
+                next_sweep = time.monotonic() + config.REMINDER_SWEEP_INTERVAL_SECONDS
+
+            due = []
+            with _cond:
+                while _heap and _heap[0][0] <= now_lima: due.append(heapq.heappop(_heap))
+                if not due:
+                    timeout = min(_seconds_until_next_day(now_lima), max(0.0, next_sweep - time.monotonic()))
+                    if _heap: timeout = min(timeout, (_heap[0][0] - now_lima).total_seconds())
+                    _cond.wait(max(timeout, 0.05)) # schedule_reminder despierta al hilo
+                    continue
+
+            _send_due_reminders(due, now_lima)
         except Exception as e:
-            logger.error(f"Error durante la tarea de limpieza periódica: {e}")
-        time.sleep(60) # Revisar cada minuto
+            logger.error(f"Error crítico en notification_scheduler_loop: {e}")
+            time.sleep(5)
 
 def start_notification_scheduler(bot: Bot):
-    global _bot_instance
-    _bot_instance = bot
-    scheduler_thread = threading.Thread(target=notification_scheduler_loop, daemon=True)
+    outbound.start_outbound_sender(bot)
+    scheduler_thread = threading.Thread(target=notification_scheduler_loop, name="reminder-scheduler", daemon=True)
     scheduler_thread.start()
-    logger.info("Notification scheduler thread initiated from notifications.py (Render Final Review).")
\ No newline at end of file
+    logger.info("Notification scheduler thread initiated from notifications.py (heap).")
@@ -0,0 +1,194 @@
+# utils/outbound.py
+# Envío saliente concurrente y con límite de tasa para recordatorios y mensajes del sistema.
+# Un pool de workers consume una cola; cada envío pasa por un token bucket global y otro por chat
+# (límites de Telegram), respeta los 429 (retry_after) y los recordatorios entregados se marcan
+# en la BD por lotes.
+
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+import logging
+
+from telegram import Bot
+from telegram.error import RetryAfter, TimedOut, NetworkError, Unauthorized, BadRequest
+
+import config
+from . import database as db_utils
+
+logger = logging.getLogger(__name__)
+
+OutboundMessage = namedtuple("OutboundMessage", ["chat_id", "text", "kwargs", "item_id", "kind", "enqueued_at", "attempt"])
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `rate` tokens por segundo con ráfagas de hasta `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Toma un token (aunque quede en negativo) y devuelve cuántos segundos hay que esperar para usarlo."""
+        with self._lock:
+            now = time.monotonic(); self._refill(now)
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def idle_since(self, now: float) -> float:
+        with self._lock: return now - self._updated
+
+
+class OutboundSender:
+    def __init__(self, bot: Bot, workers: int, global_rate: float, per_chat_rate: float,
+                 max_retries: int = 3, mark_batch_size: int = 50, mark_flush_seconds: float = 2.0):
+        self._bot = bot
+        self._queue = queue.Queue()
+        self._global_bucket = TokenBucket(global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._chat_buckets = {}
+        self._chat_buckets_lock = threading.Lock()
+        self._paused_until = 0.0 # Pausa global tras un 429
+        self._max_retries = max_retries
+        self._mark_batch_size = mark_batch_size
+        self._mark_flush_seconds = mark_flush_seconds
+        self._delivered_ids = []
+        self._delivered_lock = threading.Lock()
+        self._delivered_event = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"enqueued": 0, "sent": 0, "failed": 0, "retries": 0, "rate_limited": 0, "marked": 0}
+        self._latencies = deque(maxlen=500) # segundos desde que se encola hasta que Telegram acepta
+
+        for i in range(workers):
+            threading.Thread(target=self._worker_loop, name=f"outbound-{i}", daemon=True).start()
+        threading.Thread(target=self._mark_loop, name="outbound-marker", daemon=True).start()
+
+    # --- API ---
+    def enqueue(self, chat_id: int, text: str, item_id: int = None, kind: str = "system", **kwargs):
+        """Encola un mensaje. Si item_id viene informado, el recordatorio se marcará como enviado al entregarse."""
+        self._queue.put(OutboundMessage(chat_id, text, kwargs, item_id, kind, time.monotonic(), 0))
+        with self._stats_lock: self._stats["enqueued"] += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            snapshot = dict(self._stats); latencies = sorted(self._latencies)
+        snapshot["queue_depth"] = self._queue.qsize()
+        with self._delivered_lock: snapshot["pending_marks"] = len(self._delivered_ids)
+        snapshot["latency_avg"] = (sum(latencies) / len(latencies)) if latencies else 0.0
+        snapshot["latency_p95"] = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+        snapshot["latency_max"] = latencies[-1] if latencies else 0.0
+        return snapshot
+
+    def flush_marks(self) -> int:
+        """Marca en la BD, con un único UPDATE, los recordatorios entregados pendientes."""
+        with self._delivered_lock:
+            ids = self._delivered_ids; self._delivered_ids = []
+        if not ids: return 0
+        if db_utils.mark_reminders_sent(ids):
+            with self._stats_lock: self._stats["marked"] += len(ids)
+            return len(ids)
+        with self._delivered_lock: self._delivered_ids = ids + self._delivered_ids # Reintentar en el siguiente lote
+        return 0
+
+    # --- Internos ---
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        with self._chat_buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) > 5000: # Olvidar los chats inactivos (bucket ya lleno)
+                    now = time.monotonic()
+                    for cid in [c for c, b in self._chat_buckets.items() if b.idle_since(now) > 60]: del self._chat_buckets[cid]
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self._per_chat_rate, capacity=1)
+            return bucket
+
+    def _wait_for_slot(self, chat_id: int):
+        pause = self._paused_until - time.monotonic()
+        if pause > 0: time.sleep(pause)
+        wait = self._chat_bucket(chat_id).reserve()
+        if wait > 0: time.sleep(wait)
+        wait = self._global_bucket.reserve()
+        if wait > 0: time.sleep(wait)
+
+    def _retry(self, msg: OutboundMessage, delay: float):
+        with self._stats_lock: self._stats["retries"] += 1
+        retry_msg = msg._replace(attempt=msg.attempt + 1)
+        threading.Timer(delay, self._queue.put, args=(retry_msg,)).start()
+
+    def _worker_loop(self):
+        while True:
+            msg = self._queue.get()
+            try:
+                self._wait_for_slot(msg.chat_id)
+                self._bot.send_message(chat_id=msg.chat_id, text=msg.text, **msg.kwargs)
+                with self._stats_lock:
+                    self._stats["sent"] += 1; self._latencies.append(time.monotonic() - msg.enqueued_at)
+                if msg.item_id is not None: self._record_delivered(msg.item_id)
+            except RetryAfter as e:
+                with self._stats_lock: self._stats["rate_limited"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f"OUTBOUND: 429 de Telegram, pausa de {e.retry_after}s (chat {msg.chat_id}).")
+                if msg.attempt < self._max_retries: self._retry(msg, e.retry_after)
+                else: self._fail(msg, e)
+            except (Unauthorized, BadRequest) as e: # Usuario bloqueó el bot, chat inexistente, etc.: no reintentar
+                self._fail(msg, e)
+            except (TimedOut, NetworkError) as e: # Va después: BadRequest hereda de NetworkError
+                if msg.attempt < self._max_retries: self._retry(msg, 2 ** msg.attempt)
+                else: self._fail(msg, e)
+            except Exception as e:
+                self._fail(msg, e)
+            finally:
+                self._queue.task_done()
+
+    def _fail(self, msg: OutboundMessage, error: Exception):
+        with self._stats_lock: self._stats["failed"] += 1
+        logger.error(f"OUTBOUND: Error enviando {msg.kind} a {msg.chat_id} (item_id {msg.item_id}, intento {msg.attempt + 1}): {error}")
+        if msg.item_id is not None: # Estado durable: el barrido lo reintentará o lo expirará
+            db_utils.record_reminder_failure(msg.item_id, f"{type(error).__name__}: {error}", config.REMINDER_MAX_ATTEMPTS)
+
+    def _record_delivered(self, item_id: int):
+        with self._delivered_lock:
+            self._delivered_ids.append(item_id)
+            if len(self._delivered_ids) >= self._mark_batch_size: self._delivered_event.set()
+
+    def _mark_loop(self):
+        while True:
+            self._delivered_event.wait(self._mark_flush_seconds); self._delivered_event.clear()
+            try: self.flush_marks()
+            except Exception as e: logger.error(f"OUTBOUND: Error marcando recordatorios entregados: {e}")
+
+
+_sender: OutboundSender = None
+
+def start_outbound_sender(bot: Bot) -> OutboundSender:
+    global _sender
+    if _sender is None:
+        _sender = OutboundSender(
+            bot, workers=config.OUTBOUND_WORKERS,
+            global_rate=config.OUTBOUND_GLOBAL_RATE, per_chat_rate=config.OUTBOUND_PER_CHAT_RATE,
+            max_retries=config.OUTBOUND_MAX_RETRIES,
+            mark_batch_size=config.OUTBOUND_MARK_BATCH_SIZE, mark_flush_seconds=config.OUTBOUND_MARK_FLUSH_SECONDS
+        )
+        logger.info(f"OUTBOUND: Sender iniciado ({config.OUTBOUND_WORKERS} workers, {config.OUTBOUND_GLOBAL_RATE} msg/s global).")
+    return _sender
+
+def enqueue_message(chat_id: int, text: str, item_id: int = None, kind: str = "system", **kwargs) -> bool:
+    """Encola un mensaje en el sender compartido. Devuelve False si aún no se ha iniciado."""
+    if _sender is None:
+        logger.warning(f"OUTBOUND: Sender no iniciado; mensaje {kind} a {chat_id} descartado.")
+        return False
+    _sender.enqueue(chat_id, text, item_id=item_id, kind=kind, **kwargs)
+    return True
+
+def get_outbound_stats() -> dict:
+    return _sender.stats() if _sender is not None else {}
+
+def flush_pending_marks():
+    if _sender is not None: _sender.flush_marks()
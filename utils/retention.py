@@ -0,0 +1,119 @@
+# utils/retention.py
+# Retención de datos en su propio hilo y con su propio intervalo (RETENTION_INTERVAL_SECONDS).
+# Cada política borra en lotes acotados (RETENTION_CHUNK_SIZE filas por DELETE, elegidas por índice
+# y con SKIP LOCKED), con pausa entre lotes, de modo que nunca hay un DELETE masivo ni bloqueos largos.
+# Una política con valor 0 en config queda desactivada. El resultado de cada ejecución queda en
+# get_retention_report() para /admin_stats.
+
+import time
+import threading
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+import logging
+
+import config
+from . import database as db_utils
+
+logger = logging.getLogger(__name__)
+
+# where_sql usa parámetros con nombre; params(now_lima) calcula los cortes en cada ejecución
+RetentionPolicy = namedtuple("RetentionPolicy", ["name", "table", "key_column", "where_sql", "params", "enabled"])
+
+def _month_cutoff(now_lima: datetime, months: int) -> date:
+    """Primer día del mes que queda `months` meses antes del actual (se conserva desde ese mes)."""
+    month_index = now_lima.year * 12 + (now_lima.month - 1) - months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+# El orden importa: los sub-ítems van antes que sus documentos y el rollup después de los movimientos
+POLICIES = [
+    RetentionPolicy(
+        "planning_unmarked", "planning_items", "item_id",
+        "completed IS NULL AND created_at < %(cutoff)s", # idx_planning_unmarked_created
+        lambda now: {"cutoff": now - timedelta(days=config.RETENTION_PLANNING_UNMARKED_DAYS)},
+        lambda: config.RETENTION_PLANNING_UNMARKED_DAYS > 0
+    ),
+    RetentionPolicy(
+        "planning", "planning_items", "item_id",
+        "item_date < %(cutoff)s", # idx_planning_item_date
+        lambda now: {"cutoff": now.date() - timedelta(days=config.RETENTION_PLANNING_DAYS)},
+        lambda: config.RETENTION_PLANNING_DAYS > 0
+    ),
+    RetentionPolicy(
+        "wellbeing_sub_items", "wellbeing_sub_items", "sub_item_id",
+        "doc_id IN (SELECT doc_id FROM wellbeing_docs WHERE item_date < %(cutoff)s)", # idx_wb_docs_item_date + idx_wb_sub_items_doc
+        lambda now: {"cutoff": now.date() - timedelta(days=config.RETENTION_WELLBEING_DAYS)},
+        lambda: config.RETENTION_WELLBEING_DAYS > 0
+    ),
+    RetentionPolicy(
+        "wellbeing_docs", "wellbeing_docs", "doc_id",
+        "item_date < %(cutoff)s", # Sin sub-ítems ya: el CASCADE no tiene nada que arrastrar
+        lambda now: {"cutoff": now.date() - timedelta(days=config.RETENTION_WELLBEING_DAYS)},
+        lambda: config.RETENTION_WELLBEING_DAYS > 0
+    ),
+    RetentionPolicy(
+        "finance_transactions", "finance_transactions", "transaction_id",
+        "transaction_date < %(cutoff)s", # idx_finance_transaction_date
+        lambda now: {"cutoff": _month_cutoff(now, config.RETENTION_FINANCE_MONTHS)},
+        lambda: config.RETENTION_FINANCE_MONTHS > 0
+    ),
+    RetentionPolicy(
+        "finance_monthly_rollup", "finance_monthly_rollup", "ctid", # PK compuesta: se borra por ctid
+        "transaction_month < %(cutoff)s", # idx_finance_rollup_month
+        lambda now: {"cutoff": _month_cutoff(now, config.RETENTION_FINANCE_MONTHS).strftime("%Y-%m")},
+        lambda: config.RETENTION_FINANCE_MONTHS > 0
+    ),
+]
+
+_report_lock = threading.Lock()
+_last_report = {} # nombre de política -> {"rows", "chunks", "complete", "seconds", "finished_at"}
+_totals = {"runs": 0, "rows": 0}
+
+def _run_policy(policy: RetentionPolicy, now_lima: datetime, pause_between_chunks: bool) -> dict:
+    params = policy.params(now_lima)
+    result = {"rows": 0, "chunks": 0, "complete": False}
+    started = time.monotonic()
+    while result["chunks"] < config.RETENTION_MAX_CHUNKS_PER_RUN:
+        deleted = db_utils.delete_rows_chunk(policy.table, policy.key_column, policy.where_sql, params, config.RETENTION_CHUNK_SIZE)
+        result["rows"] += deleted; result["chunks"] += 1
+        if deleted < config.RETENTION_CHUNK_SIZE: result["complete"] = True; break
+        if pause_between_chunks: time.sleep(config.RETENTION_CHUNK_PAUSE_SECONDS)
+    result["seconds"] = time.monotonic() - started
+    return result
+
+def run_retention(pause_between_chunks: bool = True) -> dict:
+    """Ejecuta una vez todas las políticas activas, en orden. Devuelve el informe por política."""
+    now_lima = datetime.now(db_utils.LIMA_TZ)
+    report = {}
+    for policy in POLICIES:
+        if not policy.enabled(): continue
+        try:
+            result = _run_policy(policy, now_lima, pause_between_chunks)
+        except Exception as e:
+            logger.error(f"RETENTION: Error en la política {policy.name}: {e}")
+            continue
+        result["finished_at"] = datetime.now(db_utils.LIMA_TZ)
+        report[policy.name] = result
+        if result["rows"]:
+            logger.info(f"RETENTION: {policy.name}: {result['rows']} filas borradas en {result['chunks']} lote(s), {result['seconds']:.2f}s.")
+        if not result["complete"]:
+            logger.warning(f"RETENTION: {policy.name} alcanzó el tope de {config.RETENTION_MAX_CHUNKS_PER_RUN} lotes; continuará en la próxima ejecución.")
+    with _report_lock:
+        _last_report.update(report)
+        _totals["runs"] += 1; _totals["rows"] += sum(r["rows"] for r in report.values())
+    return report
+
+def get_retention_report() -> dict:
+    with _report_lock:
+        return {"runs": _totals["runs"], "rows": _totals["rows"], "policies": {name: dict(r) for name, r in _last_report.items()}}
+
+def retention_loop():
+    logger.info("RETENTION: Hilo de retención iniciado.")
+    while True:
+        try:
+            run_retention()
+        except Exception as e:
+            logger.error(f"RETENTION: Error crítico en retention_loop: {e}")
+        time.sleep(config.RETENTION_INTERVAL_SECONDS)
+
+def start_retention_job():
+    threading.Thread(target=retention_loop, name="retention", daemon=True).start()
@@ -0,0 +1,63 @@
+# utils/trends.py
+# Series históricas para las gráficas de tendencia (semana / mes / año). La BD devuelve solo dos
+# columnas compactas (día relativo al inicio del rango, valor) y la agregación por día o por semana
+# se hace con NumPy (bincount), sin recorrer filas en Python.
+
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+
+from . import database as db_utils
+
+# days: longitud del rango; bucket_days: días por punto (el año se agrupa por semanas)
+Period = namedtuple("Period", ["key", "label", "days", "bucket_days", "chart_type"])
+PERIODS = {
+    "week": Period("week", "Últimos 7 días", 7, 1, "bar"),
+    "month": Period("month", "Últimos 30 días", 30, 1, "bar"),
+    "year": Period("year", "Últimos 12 meses (por semana)", 364, 7, "line"),
+}
+
+TrendSeries = namedtuple("TrendSeries", ["labels", "values", "has_data"])
+
+def _period_range(period: Period, today: date) -> tuple:
+    return today - timedelta(days=period.days - 1), today
+
+def _bucket_labels(start_date: date, period: Period) -> list:
+    buckets = period.days // period.bucket_days
+    fmt = "%d/%m" if period.bucket_days == 1 else "%d/%m/%y"
+    return [(start_date + timedelta(days=i * period.bucket_days)).strftime(fmt) for i in range(buckets)]
+
+def _columns(rows: list) -> tuple:
+    """[(offset, valor)] -> (offsets int, valores float) como arrays, en una sola conversión."""
+    data = np.array(rows, dtype=np.float64).reshape(-1, 2)
+    return data[:, 0].astype(np.int64), data[:, 1]
+
+def _rate_per_bucket(rows: list, period: Period) -> np.ndarray:
+    """Porcentaje de ítems completados por bucket; NaN donde no hubo ítems marcados."""
+    offsets, completed = _columns(rows)
+    buckets = period.days // period.bucket_days
+    index = offsets // period.bucket_days
+    done = np.bincount(index, weights=completed, minlength=buckets)[:buckets]
+    total = np.bincount(index, minlength=buckets)[:buckets].astype(np.float64)
+    return np.divide(done * 100.0, total, out=np.full(buckets, np.nan), where=total > 0)
+
+def _sum_per_bucket(rows: list, period: Period) -> np.ndarray:
+    offsets, amounts = _columns(rows)
+    buckets = period.days // period.bucket_days
+    return np.bincount(offsets // period.bucket_days, weights=amounts, minlength=buckets)[:buckets]
+
+def discipline_trend(user_id: int, period: Period, today: date) -> TrendSeries:
+    start_date, end_date = _period_range(period, today)
+    rates = _rate_per_bucket(db_utils.get_planning_marks_range(user_id, start_date, end_date), period)
+    return TrendSeries(_bucket_labels(start_date, period), rates, bool(np.isfinite(rates).any()))
+
+def exercise_trend(user_id: int, period: Period, today: date) -> TrendSeries:
+    start_date, end_date = _period_range(period, today)
+    rates = _rate_per_bucket(db_utils.get_wellbeing_marks_range(user_id, 'exercise', start_date, end_date), period)
+    return TrendSeries(_bucket_labels(start_date, period), rates, bool(np.isfinite(rates).any()))
+
+def spending_trend(user_id: int, period: Period, today: date) -> TrendSeries:
+    start_date, end_date = _period_range(period, today)
+    totals = _sum_per_bucket(db_utils.get_expense_amounts_range(user_id, start_date, end_date), period)
+    return TrendSeries(_bucket_labels(start_date, period), totals, bool(totals.any()))